@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+#
+# Copyright 2013 The Flutter Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+#
+# Copies files as cheaply as the filesystem allows.
+#
+# The packaging scripts assemble buckets, FAR directories and frameworks out
+# of large build outputs. Each file is copied with the first strategy that
+# works:
+#
+#   * reflink: a copy-on-write clone (FICLONE on Linux, clonefile on macOS),
+#   * hardlink: a second name for the same inode, only if the caller allows
+#     it, since a later in-place edit of either name changes both,
+#   * copy_file_range: an in-kernel copy on Linux,
+#   * copy: a plain read and write.
+#
+# On a filesystem with reflinks, or with hardlinks allowed, copying a tree only
+# writes metadata.
+#
+# Usage from other scripts:
+#
+#   sys.path.insert(0, os.path.join(FLUTTER_DIR, 'build'))
+#   import copy_strategy
+#   copy_strategy.copy_path(source, destination, allow_hardlink=True)
+
+import ctypes
+import errno
+import filecmp
+import functools
+import os
+import shutil
+import sys
+import threading
+
+try:
+  import fcntl
+except ImportError:
+  fcntl = None
+
+REFLINK = 'reflink'
+HARDLINK = 'hardlink'
+COPY_FILE_RANGE = 'copy_file_range'
+COPY = 'copy'
+
+# _IOW(0x94, 9, int) from linux/fs.h.
+_FICLONE = 0x40049409
+
+# Errors that mean a filesystem, rather than a particular file, does not
+# support a strategy.
+_UNSUPPORTED_ERRNOS = {
+    errno.EXDEV,
+    errno.EOPNOTSUPP,
+    errno.ENOTSUP,
+    errno.ENOTTY,
+    errno.ENOSYS,
+    errno.EINVAL,
+}
+
+# (strategy, source device, destination device) combinations that are known
+# not to work, so they are not attempted again for every file.
+_unsupported = set()
+_unsupported_lock = threading.Lock()
+
+
+class CopyVerificationError(Exception):
+  pass
+
+
+def _unsupported_error(message):
+  return OSError(errno.ENOTSUP, message)
+
+
+def _reflink(source, destination):
+  if sys.platform.startswith('linux') and fcntl:
+    with open(source, 'rb') as source_file, open(destination, 'wb') as destination_file:
+      fcntl.ioctl(destination_file.fileno(), _FICLONE, source_file.fileno())
+  elif sys.platform == 'darwin':
+    clonefile = getattr(ctypes.CDLL(None, use_errno=True), 'clonefile', None)
+    if clonefile is None:
+      raise _unsupported_error('clonefile is not available')
+    if clonefile(os.fsencode(source), os.fsencode(destination), 0) != 0:
+      error = ctypes.get_errno()
+      raise OSError(error, os.strerror(error), destination)
+  else:
+    raise _unsupported_error('reflinks are not supported on %s' % sys.platform)
+
+
+def _hardlink(source, destination):
+  os.link(source, destination)
+
+
+def _copy_file_range(source, destination):
+  if not hasattr(os, 'copy_file_range'):
+    raise _unsupported_error('copy_file_range is not available')
+  with open(source, 'rb') as source_file, open(destination, 'wb') as destination_file:
+    while os.copy_file_range(source_file.fileno(), destination_file.fileno(), 1 << 30):
+      pass
+
+
+def _copy(source, destination):
+  shutil.copyfile(source, destination)
+
+
+_COPIERS = {
+    REFLINK: _reflink,
+    HARDLINK: _hardlink,
+    COPY_FILE_RANGE: _copy_file_range,
+    COPY: _copy,
+}
+
+
+def _remove_if_exists(path):
+  try:
+    os.unlink(path)
+  except FileNotFoundError:
+    pass
+
+
+def verify_copy(source, destination, strategy):
+  """Raises CopyVerificationError if |destination| does not hold the contents of |source|."""
+  if strategy == HARDLINK:
+    matches = os.path.samefile(source, destination)
+  else:
+    matches = filecmp.cmp(source, destination, shallow=False)
+  if not matches:
+    raise CopyVerificationError(
+        '%s does not match %s after a %s copy' % (destination, source, strategy)
+    )
+
+
+def copy_file(source, destination, allow_hardlink=False, preserve_times=False, verify=False):
+  """Copies the file |source| to |destination|, replacing it if it exists.
+
+  Like shutil.copy, the permission bits are copied too, and with
+  |preserve_times| so are the access and modification times. Hardlinks share
+  all of them with the source. Returns the strategy that made the copy.
+  """
+  if os.path.lexists(destination):
+    if os.path.exists(destination) and os.path.samefile(source, destination):
+      return HARDLINK
+    os.unlink(destination)
+
+  strategies = [REFLINK, HARDLINK, COPY_FILE_RANGE]
+  if not allow_hardlink:
+    strategies.remove(HARDLINK)
+  devices = (
+      os.stat(source).st_dev,
+      os.stat(os.path.dirname(os.path.abspath(destination))).st_dev,
+  )
+  strategy = COPY
+  for candidate in strategies:
+    key = (candidate,) + devices
+    if key in _unsupported:
+      continue
+    try:
+      _COPIERS[candidate](source, destination)
+    except OSError as error:
+      _remove_if_exists(destination)
+      if error.errno in _UNSUPPORTED_ERRNOS:
+        with _unsupported_lock:
+          _unsupported.add(key)
+      continue
+    strategy = candidate
+    break
+  else:
+    _copy(source, destination)
+
+  if strategy != HARDLINK:
+    if preserve_times:
+      shutil.copystat(source, destination)
+    else:
+      shutil.copymode(source, destination)
+  if verify:
+    verify_copy(source, destination, strategy)
+  return strategy
+
+
+def copy_tree(
+    source,
+    destination,
+    allow_hardlink=False,
+    preserve_times=False,
+    verify=False,
+    symlinks=False,
+    ignore=None
+):
+  """Copies the directory |source| to |destination|, which must not exist.
+
+  Behaves like shutil.copytree, but copies each file with copy_file.
+  """
+  copy_function = functools.partial(
+      copy_file, allow_hardlink=allow_hardlink, preserve_times=preserve_times, verify=verify
+  )
+  shutil.copytree(
+      source, destination, symlinks=symlinks, ignore=ignore, copy_function=copy_function
+  )
+
+
+def copy_path(source, destination, **kwargs):
+  """Copies the file or directory |source| to |destination|, creating its parent.
+
+  Takes the same keyword arguments as copy_tree.
+  """
+  os.makedirs(os.path.dirname(os.path.abspath(destination)), exist_ok=True)
+  if os.path.isdir(source):
+    copy_tree(source, destination, **kwargs)
+  else:
+    kwargs.pop('symlinks', None)
+    kwargs.pop('ignore', None)
+    copy_file(source, destination, **kwargs)
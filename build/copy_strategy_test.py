@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+#
+# Copyright 2013 The Flutter Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import errno
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+from unittest import mock
+
+import copy_strategy
+
+ALL_STRATEGIES = [
+    copy_strategy.REFLINK,
+    copy_strategy.HARDLINK,
+    copy_strategy.COPY_FILE_RANGE,
+]
+
+
+class CopyStrategyTest(unittest.TestCase):
+
+  def setUp(self):
+    self.temp_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.temp_dir)
+    copy_strategy._unsupported.clear()
+    self.addCleanup(copy_strategy._unsupported.clear)
+    self.source = os.path.join(self.temp_dir, 'source')
+    with open(self.source, 'w') as f:
+      f.write('contents')
+    os.chmod(self.source, 0o750)
+    self.destination = os.path.join(self.temp_dir, 'destination')
+    self.attempts = []
+
+  def FakeCopiers(self, results):
+    """Replaces the copiers with fakes that fail with the errnos in |results|.
+
+    A strategy that maps to None copies the file. Every attempt is recorded.
+    """
+
+    def MakeCopier(strategy):
+
+      def Copy(source, destination):
+        self.attempts.append(strategy)
+        error = results.get(strategy)
+        if error is not None:
+          # Leave a partial file behind, which copy_file must clean up.
+          with open(destination, 'w') as f:
+            f.write('partial')
+          raise OSError(error, os.strerror(error))
+        self.assertFalse(os.path.lexists(destination))
+        shutil.copyfile(source, destination)
+
+      return Copy
+
+    copiers = {strategy: MakeCopier(strategy) for strategy in ALL_STRATEGIES}
+    patcher = mock.patch.dict(copy_strategy._COPIERS, copiers)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+  def ReadDestination(self):
+    with open(self.destination) as f:
+      return f.read()
+
+  def test_fallback_order(self):
+    self.FakeCopiers({strategy: errno.EOPNOTSUPP for strategy in ALL_STRATEGIES})
+    strategy = copy_strategy.copy_file(self.source, self.destination, allow_hardlink=True)
+    self.assertEqual(strategy, copy_strategy.COPY)
+    self.assertEqual(self.attempts, ALL_STRATEGIES)
+    self.assertEqual(self.ReadDestination(), 'contents')
+    self.assertEqual(stat.S_IMODE(os.stat(self.destination).st_mode), 0o750)
+
+  def test_first_working_strategy_wins(self):
+    self.FakeCopiers({copy_strategy.REFLINK: errno.EXDEV})
+    strategy = copy_strategy.copy_file(self.source, self.destination, allow_hardlink=True)
+    self.assertEqual(strategy, copy_strategy.HARDLINK)
+    self.assertEqual(self.attempts, [copy_strategy.REFLINK, copy_strategy.HARDLINK])
+
+  def test_hardlinks_need_permission(self):
+    self.FakeCopiers({copy_strategy.REFLINK: errno.ENOTTY})
+    strategy = copy_strategy.copy_file(self.source, self.destination)
+    self.assertEqual(strategy, copy_strategy.COPY_FILE_RANGE)
+    self.assertEqual(self.attempts, [copy_strategy.REFLINK, copy_strategy.COPY_FILE_RANGE])
+
+  def test_unsupported_strategies_are_remembered(self):
+    self.FakeCopiers({copy_strategy.REFLINK: errno.EOPNOTSUPP, copy_strategy.HARDLINK: errno.EXDEV})
+    copy_strategy.copy_file(self.source, self.destination, allow_hardlink=True)
+    self.attempts = []
+    other_destination = os.path.join(self.temp_dir, 'other')
+    strategy = copy_strategy.copy_file(self.source, other_destination, allow_hardlink=True)
+    # The same filesystems are not asked again.
+    self.assertEqual(strategy, copy_strategy.COPY_FILE_RANGE)
+    self.assertEqual(self.attempts, [copy_strategy.COPY_FILE_RANGE])
+
+  def test_other_errors_are_not_remembered(self):
+    self.FakeCopiers({copy_strategy.REFLINK: errno.EACCES})
+    copy_strategy.copy_file(self.source, self.destination)
+    self.attempts = []
+    copy_strategy.copy_file(self.source, self.destination)
+    self.assertEqual(self.attempts, [copy_strategy.REFLINK, copy_strategy.COPY_FILE_RANGE])
+
+  def test_verify_catches_mismatch(self):
+
+    def BadCopy(source, destination):
+      with open(destination, 'w') as f:
+        f.write('something else')
+
+    with mock.patch.dict(copy_strategy._COPIERS, {copy_strategy.REFLINK: BadCopy}):
+      with self.assertRaises(copy_strategy.CopyVerificationError):
+        copy_strategy.copy_file(self.source, self.destination, verify=True)
+
+  def test_copy_file(self):
+    with open(self.destination, 'w') as f:
+      f.write('old')
+    os.utime(self.source, (1000000000, 1000000000))
+    strategy = copy_strategy.copy_file(
+        self.source, self.destination, preserve_times=True, verify=True
+    )
+    self.assertNotEqual(strategy, copy_strategy.HARDLINK)
+    self.assertFalse(os.path.samefile(self.source, self.destination))
+    self.assertEqual(self.ReadDestination(), 'contents')
+    self.assertEqual(os.stat(self.destination).st_mtime, 1000000000)
+
+    # Copying onto a hardlink of the source leaves it alone.
+    os.remove(self.destination)
+    os.link(self.source, self.destination)
+    self.assertEqual(copy_strategy.copy_file(self.source, self.destination), copy_strategy.HARDLINK)
+
+  def test_copy_path(self):
+    source_dir = os.path.join(self.temp_dir, 'tree')
+    os.makedirs(os.path.join(source_dir, 'sub'))
+    shutil.copy(self.source, os.path.join(source_dir, 'sub', 'file'))
+    destination_dir = os.path.join(self.temp_dir, 'out', 'nested', 'tree')
+
+    copy_strategy.copy_path(source_dir, destination_dir, allow_hardlink=True, verify=True)
+    with open(os.path.join(destination_dir, 'sub', 'file')) as f:
+      self.assertEqual(f.read(), 'contents')
+
+    copy_strategy.copy_path(self.source, os.path.join(self.temp_dir, 'out', 'file'))
+    self.assertTrue(os.path.isfile(os.path.join(self.temp_dir, 'out', 'file')))
+
+
+if __name__ == '__main__':
+  unittest.main()
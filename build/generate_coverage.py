@@ -8,7 +8,12 @@ import sys
 import subprocess
 import os
 import argparse
+import concurrent.futures
 import errno
+import glob
+import hashlib
+import json
+import re
 import shutil
 
 
@@ -43,65 +48,321 @@ def remove_if_exists(path):
     os.remove(path)
 
 
-def collect_profiles(args):
-  raw_profiles = []
-  binaries = []
+def run_captured(command, env=None):
+  """Runs |command| and prints its output in one piece once it finishes.
 
-  # Run all unit tests and collect raw profiles.
-  for test in args.tests:
-    absolute_test_path = os.path.abspath(test)
-    absolute_test_dir = os.path.dirname(absolute_test_path)
-    test_name = os.path.basename(absolute_test_path)
+  Commands run concurrently, so their output is buffered to keep each log
+  readable.
+  """
+  process = subprocess.run(
+      command, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, check=False
+  )
+  output = process.stdout.decode('utf-8', errors='replace')
+  if output:
+    print(output, end='' if output.endswith('\n') else '\n')
+  if process.returncode != 0:
+    raise subprocess.CalledProcessError(process.returncode, command)
 
-    if not os.path.exists(absolute_test_path):
-      print('Path %s does not exist.' % absolute_test_path)
-      return -1
 
-    unstripped_test_path = os.path.join(absolute_test_dir, 'exe.unstripped', test_name)
+def raw_profile_pattern(test_path):
+  # %p and %m give every process (and every instrumented module in it) its own
+  # file, so tests that spawn children of themselves do not clobber each other.
+  return test_path + '.%p.%m.rawprofile'
 
-    if os.path.exists(unstripped_test_path):
-      binaries.append(unstripped_test_path)
-    else:
-      binaries.append(absolute_test_path)
 
-    raw_profile = absolute_test_path + '.rawprofile'
+def update_digest(digest, path):
+  with open(path, 'rb') as input_file:
+    for chunk in iter(lambda: input_file.read(1 << 20), b''):
+      digest.update(chunk)
+  return digest
 
-    remove_if_exists(raw_profile)
 
-    print('Running test %s to gather profile.' % os.path.basename(absolute_test_path))
+def profile_cache_key(test_path, test_args):
+  """Returns a key identifying a test binary's contents and the arguments it runs with."""
+  digest = hashlib.sha256()
+  digest.update(json.dumps(test_args).encode('utf-8'))
+  return update_digest(digest, test_path).hexdigest()
 
-    test_command = [absolute_test_path]
 
-    test_args = ' '.join(args.test_args).split()
+def profile_digest_path(cached_profile):
+  return cached_profile + '.sha256'
 
-    if test_args is not None:
-      test_command += test_args
 
-    subprocess.check_call(test_command, env={'LLVM_PROFILE_FILE': raw_profile})
+def is_cached_profile_valid(cached_profile):
+  """Returns whether |cached_profile| matches the digest recorded when it was written.
 
-    if not os.path.exists(raw_profile):
-      print('Could not find raw profile data for unit test run %s.' % test)
-      print('Did you build with the --coverage flag?')
-      return -1
+  A profile that was truncated, corrupted or written without its digest is not
+  reused.
+  """
+  try:
+    with open(profile_digest_path(cached_profile)) as digest_file:
+      recorded_digest = digest_file.read().strip()
+    return update_digest(hashlib.sha256(), cached_profile).hexdigest() == recorded_digest
+  except OSError:
+    return False
+
+
+def write_cached_profile(temp_profile, cached_profile):
+  """Moves |temp_profile| into the cache and records its digest next to it."""
+  digest = update_digest(hashlib.sha256(), temp_profile).hexdigest()
+  os.replace(temp_profile, cached_profile)
+  temp_digest_path = profile_digest_path(cached_profile) + '.tmp'
+  with open(temp_digest_path, 'w') as digest_file:
+    digest_file.write(digest + '\n')
+  os.replace(temp_digest_path, profile_digest_path(cached_profile))
+
+
+def collect_profile(test, test_args, cache_dir=None, llvm_bin_dir=None):
+  """Runs |test| and returns its binary and profiles, or None on failure.
+
+  If |cache_dir| is given, the test's raw profiles are merged into an indexed
+  profile stored there, keyed on the test binary and its arguments. An
+  unchanged test is not run again; its cached profile is returned instead.
+  """
+  absolute_test_path = os.path.abspath(test)
+  absolute_test_dir = os.path.dirname(absolute_test_path)
+  test_name = os.path.basename(absolute_test_path)
+
+  if not os.path.exists(absolute_test_path):
+    print('Path %s does not exist.' % absolute_test_path)
+    return None
+
+  unstripped_test_path = os.path.join(absolute_test_dir, 'exe.unstripped', test_name)
+
+  if os.path.exists(unstripped_test_path):
+    binary = unstripped_test_path
+  else:
+    binary = absolute_test_path
+
+  cached_profile = None
+  if cache_dir:
+    cache_key = profile_cache_key(absolute_test_path, test_args)
+    cached_profile = os.path.join(cache_dir, '%s-%s.profdata' % (test_name, cache_key))
+    if is_cached_profile_valid(cached_profile):
+      print('Reusing cached profile for unchanged test %s.' % test_name)
+      return (binary, [cached_profile])
+
+  raw_profile_glob = absolute_test_path + '.*.rawprofile'
+  for stale_profile in glob.glob(raw_profile_glob):
+    remove_if_exists(stale_profile)
+
+  print('Running test %s to gather profile.' % os.path.basename(absolute_test_path))
+
+  test_command = [absolute_test_path] + test_args
+
+  run_captured(test_command, env={'LLVM_PROFILE_FILE': raw_profile_pattern(absolute_test_path)})
+
+  raw_profiles = sorted(glob.glob(raw_profile_glob))
+  if not raw_profiles:
+    print('Could not find raw profile data for unit test run %s.' % test)
+    print('Did you build with the --coverage flag?')
+    return None
+
+  if cached_profile:
+    # Profiles from older builds of this test, and an entry that failed
+    # validation, can no longer be reused.
+    for stale_profile in glob.glob(os.path.join(cache_dir, test_name + '-*.profdata')):
+      # Skip the profiles of other tests whose name starts with this one's.
+      if len(os.path.basename(stale_profile)) == len(os.path.basename(cached_profile)):
+        remove_if_exists(stale_profile)
+        remove_if_exists(profile_digest_path(stale_profile))
+    profdata_binary = os.path.join(llvm_bin_dir, 'llvm-profdata')
+    temp_profile = cached_profile + '.tmp'
+    subprocess.check_call([profdata_binary, 'merge', '-sparse'] + raw_profiles +
+                          ['-o', temp_profile])
+    write_cached_profile(temp_profile, cached_profile)
+    return (binary, [cached_profile])
+
+  return (binary, raw_profiles)
+
+
+def collect_profiles(args, llvm_bin_dir=None):
+  binaries = []
+  raw_profiles = []
 
-    raw_profiles.append(raw_profile)
+  test_args = ' '.join(args.test_args or []).split()
+
+  cache_dir = None
+  if args.cache_dir:
+    cache_dir = os.path.abspath(args.cache_dir)
+    make_dirs(cache_dir)
+
+  # Run all unit tests concurrently and collect raw profiles.
+  with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, args.jobs)) as executor:
+    results = list(
+        executor.map(
+            lambda test: collect_profile(test, test_args, cache_dir, llvm_bin_dir), args.tests
+        )
+    )
+
+  for result in results:
+    if result is None:
+      return ([], [])
+    binaries.append(result[0])
+    raw_profiles += result[1]
 
   return (binaries, raw_profiles)
 
 
-def merge_profiles(llvm_bin_dir, raw_profiles, output):
+def merge_profiles(llvm_bin_dir, raw_profiles, output, jobs=1):
   # Merge all raw profiles into a single profile.
   profdata_binary = os.path.join(llvm_bin_dir, 'llvm-profdata')
 
   print('Merging %d raw profile(s) into single profile.' % len(raw_profiles))
   merged_profile_path = os.path.join(output, 'all.profile')
   remove_if_exists(merged_profile_path)
-  merge_command = [profdata_binary, 'merge', '-sparse'] + raw_profiles + ['-o', merged_profile_path]
+  merge_command = [profdata_binary, 'merge', '-sparse', '-num-threads=%d' % jobs]
+  merge_command += raw_profiles + ['-o', merged_profile_path]
   subprocess.check_call(merge_command)
   print('Done.')
   return merged_profile_path
 
 
+def generate_html_report(llvm_cov_binary, report_flags, output):
+  print('Generating HTML report.')
+  run_captured([llvm_cov_binary, 'show'] + report_flags + [
+      '-format=html',
+      '-output-dir=%s' % output,
+      '-tab-size=2',
+  ])
+  print('Done generating HTML report.')
+
+
+def generate_summary_report(llvm_cov_binary, report_flags):
+  print('Generating a summary report.')
+  run_captured([llvm_cov_binary, 'report'] + report_flags)
+  print('Done generating summary report.')
+
+
+def generate_lcov_report(llvm_cov_binary, report_flags, output):
+  print('Generating LCOV report.')
+  lcov_file = os.path.join(output, 'coverage.lcov')
+  remove_if_exists(lcov_file)
+  with open(lcov_file, 'w') as lcov_redirect:
+    subprocess.check_call([llvm_cov_binary, 'export'] + report_flags + [
+        '-format=lcov',
+    ],
+                          stdout=lcov_redirect)
+  print('Done generating LCOV report.')
+
+
+# Matches the new-file side of a unified diff hunk header, e.g. "@@ -3,2 +4,5 @@".
+DIFF_HUNK_PATTERN = re.compile(r'^@@ -\d+(?:,\d+)? \+(\d+)(?:,(\d+))? @@')
+
+
+def get_changed_lines(diff_range, repo_dir):
+  """Returns a map from absolute file path to the set of lines |diff_range| added or changed."""
+  repo_root = subprocess.check_output(['git', 'rev-parse', '--show-toplevel'], cwd=repo_dir)
+  repo_root = repo_root.decode('utf-8').strip()
+  diff_command = ['git', 'diff', '--unified=0', '--no-color', diff_range, '--']
+  diff = subprocess.check_output(diff_command, cwd=repo_root).decode('utf-8', errors='replace')
+  changed_lines = {}
+  current_lines = None
+  for line in diff.splitlines():
+    if line.startswith('+++ '):
+      path = line[4:]
+      if path == '/dev/null':
+        current_lines = None
+      else:
+        path = path[2:] if path.startswith('b/') else path
+        current_lines = changed_lines.setdefault(os.path.join(repo_root, path), set())
+      continue
+    match = DIFF_HUNK_PATTERN.match(line)
+    if match and current_lines is not None:
+      start = int(match.group(1))
+      count = int(match.group(2)) if match.group(2) is not None else 1
+      current_lines.update(range(start, start + count))
+  return {path: lines for path, lines in changed_lines.items() if lines}
+
+
+def parse_lcov_line_counts(lcov):
+  """Returns a map from source file to {line: execution count} from LCOV data."""
+  counts = {}
+  current = None
+  for line in lcov.splitlines():
+    if line.startswith('SF:'):
+      current = counts.setdefault(os.path.realpath(line[3:]), {})
+    elif line.startswith('DA:') and current is not None:
+      line_number, count = line[3:].split(',')[:2]
+      current[int(line_number)] = current.get(int(line_number), 0) + int(count)
+    elif line == 'end_of_record':
+      current = None
+  return counts
+
+
+def lcov_export_command(llvm_cov_binary, binaries, profile_flags, source_files):
+  """Returns the llvm-cov command that exports LCOV data for just |source_files|.
+
+  llvm-cov reads its first positional argument as the covered binary and the
+  rest as source files, so the first binary is passed positionally and any
+  others with -object.
+  """
+  command = [llvm_cov_binary, 'export', binaries[0]]
+  for binary in binaries[1:]:
+    command += ['-object', binary]
+  return command + profile_flags + ['-format=lcov'] + list(source_files)
+
+
+def generate_diff_report(llvm_cov_binary, binaries, profile_flags, output, diff_range, repo_dir):
+  """Writes a coverage summary limited to the lines changed in |diff_range|.
+
+  Only the touched files are exported from the merged profile, which keeps
+  this fast no matter how many binaries contributed to it.
+  """
+  print('Generating a patch coverage report for %s.' % diff_range)
+  changed_lines = get_changed_lines(diff_range, repo_dir)
+  files = []
+  if changed_lines:
+    command = lcov_export_command(llvm_cov_binary, binaries, profile_flags, sorted(changed_lines))
+    lcov = subprocess.check_output(command).decode('utf-8')
+    line_counts = parse_lcov_line_counts(lcov)
+    for path in sorted(changed_lines):
+      counts = line_counts.get(os.path.realpath(path))
+      if not counts:
+        continue
+      instrumented = sorted(line for line in changed_lines[path] if line in counts)
+      if not instrumented:
+        continue
+      files.append({
+          'path': os.path.relpath(path, repo_dir),
+          'lines': len(instrumented),
+          'covered': len([line for line in instrumented if counts[line] > 0]),
+          'uncovered_lines': [line for line in instrumented if counts[line] == 0],
+      })
+
+  total_lines = sum(file['lines'] for file in files)
+  total_covered = sum(file['covered'] for file in files)
+  summary = {
+      'diff': diff_range,
+      'lines': total_lines,
+      'covered': total_covered,
+      'files': files,
+  }
+  with open(os.path.join(output, 'patch_coverage.json'), 'w') as json_file:
+    json.dump(summary, json_file, indent=2)
+
+  def percent(covered, lines):
+    return '%.1f%%' % (100.0 * covered / lines) if lines else 'n/a'
+
+  with open(os.path.join(output, 'patch_coverage.md'), 'w') as markdown_file:
+    markdown_file.write('# Patch coverage for `%s`\n\n' % diff_range)
+    markdown_file.write(
+        '%d of %d changed lines covered (%s).\n\n' %
+        (total_covered, total_lines, percent(total_covered, total_lines))
+    )
+    if files:
+      markdown_file.write('| File | Covered | Uncovered lines |\n')
+      markdown_file.write('| --- | --- | --- |\n')
+      for file in files:
+        coverage = percent(file['covered'], file['lines'])
+        uncovered_lines = ', '.join(str(line) for line in file['uncovered_lines'])
+        markdown_file.write(
+            '| %s | %d/%d (%s) | %s |\n' %
+            (file['path'], file['covered'], file['lines'], coverage, uncovered_lines)
+        )
+  print('Done generating patch coverage report.')
+
+
 def main():
   parser = argparse.ArgumentParser()
 
@@ -124,9 +385,17 @@ def main():
       '-f',
       '--format',
       type=str,
-      choices=['all', 'html', 'summary', 'lcov'],
+      choices=['all', 'html', 'summary', 'lcov', 'diff'],
       required=True,
-      help='The type of coverage information to be displayed.'
+      help='The type of coverage information to be displayed. "diff" only reports the lines '
+      'changed in --diff-range.'
+  )
+  parser.add_argument(
+      '--diff-range',
+      dest='diff_range',
+      required=False,
+      help='A git revision range, e.g. "origin/main...HEAD". Its changed lines are '
+      'summarized in patch_coverage.json and patch_coverage.md.'
   )
   parser.add_argument(
       '-a',
@@ -136,16 +405,35 @@ def main():
       required=False,
       help='The arguments to pass to the unit test executable being run.'
   )
+  parser.add_argument(
+      '-j',
+      '--jobs',
+      type=int,
+      default=os.cpu_count() or 1,
+      help='The number of tests, merge threads and reports to run concurrently.'
+  )
+  parser.add_argument(
+      '--cache-dir',
+      dest='cache_dir',
+      required=False,
+      help='A directory in which to keep a profile per test binary. Tests whose binary and '
+      'arguments are unchanged since their cached profile was recorded are not run again.'
+  )
 
   args = parser.parse_args()
 
+  if args.format == 'diff' and not args.diff_range:
+    parser.error('--format=diff requires --diff-range.')
+
   output = os.path.abspath(args.output)
 
   make_dirs(output)
 
   generate_all_reports = args.format == 'all'
 
-  binaries, raw_profiles = collect_profiles(args)
+  llvm_bin_dir = get_llvm_bin_directory()
+
+  binaries, raw_profiles = collect_profiles(args, llvm_bin_dir)
 
   if len(raw_profiles) == 0:
     print('No raw profiles could be generated.')
@@ -156,9 +444,7 @@ def main():
     binaries_flag.append('-object')
     binaries_flag.append(binary)
 
-  llvm_bin_dir = get_llvm_bin_directory()
-
-  merged_profile_path = merge_profiles(llvm_bin_dir, raw_profiles, output)
+  merged_profile_path = merge_profiles(llvm_bin_dir, raw_profiles, output, args.jobs)
 
   if not os.path.exists(merged_profile_path):
     print('Could not generate or find merged profile %s.' % merged_profile_path)
@@ -167,41 +453,29 @@ def main():
   llvm_cov_binary = os.path.join(llvm_bin_dir, 'llvm-cov')
   instr_profile_flag = '-instr-profile=%s' % merged_profile_path
   ignore_flags = '-ignore-filename-regex=third_party|unittest|fixture'
+  profile_flags = [instr_profile_flag, ignore_flags]
+  report_flags = binaries_flag + profile_flags
 
-  # Generate the HTML report if specified.
+  # Every report only reads the merged profile, so they are generated
+  # concurrently.
+  reports = []
   if generate_all_reports or args.format == 'html':
-    print('Generating HTML report.')
-    subprocess.check_call([llvm_cov_binary, 'show'] + binaries_flag + [
-        instr_profile_flag,
-        '-format=html',
-        '-output-dir=%s' % output,
-        '-tab-size=2',
-        ignore_flags,
-    ])
-    print('Done.')
-
-  # Generate a report summary if specified.
+    reports.append((generate_html_report, llvm_cov_binary, report_flags, output))
   if generate_all_reports or args.format == 'summary':
-    print('Generating a summary report.')
-    subprocess.check_call([llvm_cov_binary, 'report'] + binaries_flag + [
-        instr_profile_flag,
-        ignore_flags,
-    ])
-    print('Done.')
-
-  # Generate a lcov summary if specified.
+    reports.append((generate_summary_report, llvm_cov_binary, report_flags))
   if generate_all_reports or args.format == 'lcov':
-    print('Generating LCOV report.')
-    lcov_file = os.path.join(output, 'coverage.lcov')
-    remove_if_exists(lcov_file)
-    with open(lcov_file, 'w') as lcov_redirect:
-      subprocess.check_call([llvm_cov_binary, 'export'] + binaries_flag + [
-          instr_profile_flag,
-          ignore_flags,
-          '-format=lcov',
-      ],
-                            stdout=lcov_redirect)
-    print('Done.')
+    reports.append((generate_lcov_report, llvm_cov_binary, report_flags, output))
+  if args.diff_range and (generate_all_reports or args.format == 'diff'):
+    repo_dir = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+    reports.append((
+        generate_diff_report, llvm_cov_binary, binaries, profile_flags, output, args.diff_range,
+        repo_dir
+    ))
+
+  with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, args.jobs)) as executor:
+    futures = [executor.submit(*report) for report in reports]
+    for future in futures:
+      future.result()
 
   return 0
 
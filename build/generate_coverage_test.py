@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+#
+# Copyright 2013 The Flutter Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import os
+import shutil
+import stat
+import subprocess
+import sys
+import tempfile
+import textwrap
+import unittest
+
+import generate_coverage
+
+
+def find_llvm_bin_directory():
+  try:
+    return generate_coverage.get_llvm_bin_directory()
+  except Exception:  # pylint: disable=broad-except
+    profdata_binary = shutil.which('llvm-profdata')
+    return os.path.dirname(os.path.realpath(profdata_binary)) if profdata_binary else None
+
+
+LLVM_BIN_DIR = find_llvm_bin_directory()
+
+# Writes a text profile where an instrumented test would write its raw profile,
+# and records every run of the test.
+FAKE_TEST = textwrap.dedent(
+    """\
+    #!%s
+    import os
+    import sys
+    with open(__file__ + '.runs', 'a') as runs:
+      runs.write(' '.join(sys.argv[1:]) + '\\n')
+    profile = os.environ['LLVM_PROFILE_FILE'].replace('%%p', str(os.getpid())).replace('%%m', '0')
+    with open(profile, 'w') as f:
+      f.write('main\\n# Func Hash:\\n0\\n# Num Counters:\\n1\\n# Counter Values:\\n1\\n')
+    # Build: %s
+    """
+)
+
+
+class GenerateCoverageTest(unittest.TestCase):
+
+  def setUp(self):
+    self.temp_dir = os.path.realpath(tempfile.mkdtemp())
+    self.addCleanup(shutil.rmtree, self.temp_dir)
+
+  def Git(self, *args):
+    subprocess.check_call(['git', '-c', 'user.name=test', '-c', 'user.email=test@test'] +
+                          list(args),
+                          cwd=self.temp_dir,
+                          stdout=subprocess.DEVNULL)
+
+  def WriteFile(self, name, lines):
+    path = os.path.join(self.temp_dir, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+      f.write(''.join(line + '\n' for line in lines))
+
+  def WriteFakeTest(self, version=''):
+    path = os.path.join(self.temp_dir, 'out', 'fake_unittests')
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+      f.write(FAKE_TEST % (sys.executable, version))
+    os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR)
+    return path
+
+  def ReadRuns(self, test):
+    if not os.path.exists(test + '.runs'):
+      return []
+    with open(test + '.runs') as f:
+      return f.read().splitlines()
+
+  def CollectProfile(self, test, test_args):
+    cache_dir = os.path.join(self.temp_dir, 'cache')
+    os.makedirs(cache_dir, exist_ok=True)
+    binary, profiles = generate_coverage.collect_profile(
+        test, test_args, cache_dir=cache_dir, llvm_bin_dir=LLVM_BIN_DIR
+    )
+    self.assertEqual(binary, test)
+    self.assertEqual(len(profiles), 1)
+    self.assertTrue(generate_coverage.is_cached_profile_valid(profiles[0]))
+    return profiles[0]
+
+  @unittest.skipUnless(LLVM_BIN_DIR, 'needs llvm-profdata')
+  def test_profile_cache(self):
+    test = self.WriteFakeTest()
+    profile = self.CollectProfile(test, ['--gtest_filter=A.*'])
+    self.assertEqual(self.ReadRuns(test), ['--gtest_filter=A.*'])
+
+    # An unchanged test is not run again.
+    self.assertEqual(self.CollectProfile(test, ['--gtest_filter=A.*']), profile)
+    self.assertEqual(len(self.ReadRuns(test)), 1)
+
+    # Different arguments are another entry.
+    self.assertNotEqual(self.CollectProfile(test, ['--gtest_filter=B.*']), profile)
+    self.assertEqual(len(self.ReadRuns(test)), 2)
+
+    # A rebuilt test replaces the entries of the old binary.
+    self.WriteFakeTest(version='rebuilt')
+    new_profile = self.CollectProfile(test, ['--gtest_filter=A.*'])
+    self.assertNotEqual(new_profile, profile)
+    self.assertFalse(os.path.exists(profile))
+    self.assertEqual(len(self.ReadRuns(test)), 3)
+
+  @unittest.skipUnless(LLVM_BIN_DIR, 'needs llvm-profdata')
+  def test_corrupt_profile_is_not_reused(self):
+    test = self.WriteFakeTest()
+    profile = self.CollectProfile(test, [])
+    with open(profile, 'rb') as f:
+      contents = f.read()
+
+    # A truncated profile.
+    with open(profile, 'wb') as f:
+      f.write(contents[:100])
+    self.assertEqual(self.CollectProfile(test, []), profile)
+    self.assertEqual(len(self.ReadRuns(test)), 2)
+
+    # A profile whose digest was never written.
+    os.remove(generate_coverage.profile_digest_path(profile))
+    self.assertEqual(self.CollectProfile(test, []), profile)
+    self.assertEqual(len(self.ReadRuns(test)), 3)
+
+    with open(profile, 'rb') as f:
+      self.assertEqual(f.read(), contents)
+
+  def test_get_changed_lines(self):
+    self.Git('init', '--quiet')
+    self.WriteFile('src/a.cc', ['1', '2', '3', '4', '5'])
+    self.WriteFile('src/removed.cc', ['removed'])
+    self.WriteFile('src/only_deletions.cc', ['1', '2'])
+    self.Git('add', '.')
+    self.Git('commit', '--quiet', '-m', 'base')
+
+    self.WriteFile('src/a.cc', ['1', 'two', '3', '4', '5', '6', '7'])
+    os.remove(os.path.join(self.temp_dir, 'src', 'removed.cc'))
+    self.WriteFile('src/only_deletions.cc', ['1'])
+    self.WriteFile('src/new.cc', ['new 1', 'new 2'])
+    self.Git('add', '.')
+    self.Git('commit', '--quiet', '-m', 'change')
+
+    changed_lines = generate_coverage.get_changed_lines(
+        'HEAD~1...HEAD', os.path.join(self.temp_dir, 'src')
+    )
+    self.assertEqual(
+        changed_lines, {
+            os.path.join(self.temp_dir, 'src', 'a.cc'): {2, 6, 7},
+            os.path.join(self.temp_dir, 'src', 'new.cc'): {1, 2},
+        }
+    )
+
+  def test_parse_lcov_line_counts(self):
+    lcov = '\n'.join([
+        'SF:%s/a.cc' % self.temp_dir,
+        'FN:1,main',
+        'DA:1,3',
+        'DA:2,0',
+        'end_of_record',
+        'SF:%s/b.cc' % self.temp_dir,
+        'DA:4,1',
+        'end_of_record',
+        # Counts for a file exported twice are added up.
+        'SF:%s/a.cc' % self.temp_dir,
+        'DA:2,5',
+        'end_of_record',
+        'DA:9,9',
+    ])
+    self.assertEqual(
+        generate_coverage.parse_lcov_line_counts(lcov), {
+            os.path.join(self.temp_dir, 'a.cc'): {1: 3, 2: 5},
+            os.path.join(self.temp_dir, 'b.cc'): {4: 1},
+        }
+    )
+
+  def test_lcov_export_command(self):
+    command = generate_coverage.lcov_export_command(
+        'llvm-cov', ['out/a_unittests', 'out/b_unittests'], ['-instr-profile=all.profile'],
+        ['/src/a.cc', '/src/b.cc']
+    )
+    self.assertEqual(
+        command, [
+            'llvm-cov', 'export', 'out/a_unittests', '-object', 'out/b_unittests',
+            '-instr-profile=all.profile', '-format=lcov', '/src/a.cc', '/src/b.cc'
+        ]
+    )
+
+
+if __name__ == '__main__':
+  unittest.main()
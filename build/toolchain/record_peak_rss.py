@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+#
+# Copyright 2013 The Flutter Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Runs a build action's Python script and records the action's peak memory.
+
+The peak resident set size of the script and everything it ran is appended to
+a log as "<peak RSS in bytes>\t<pool>\t<output>". tools/gn reads that log when
+it next configures the out directory to size the pools in this directory.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+try:
+  import resource
+except ImportError:
+  # Windows has no getrusage; the action runs without being measured.
+  resource = None
+
+
+def get_children_peak_rss():
+  """Returns the largest peak RSS in bytes of the waited-for child processes."""
+  peak_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+  # Linux reports kilobytes, macOS bytes.
+  return peak_rss if sys.platform == 'darwin' else peak_rss * 1024
+
+
+def append_record(log_path, peak_rss, pool, output):
+  # A single write to a file opened for appending keeps the records of actions
+  # that finish at the same time from interleaving.
+  record = ('%d\t%s\t%s\n' % (peak_rss, pool, output)).encode('utf-8')
+  log = os.open(log_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+  try:
+    os.write(log, record)
+  finally:
+    os.close(log)
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument('--log', required=True, help='The log to append the record to.')
+  parser.add_argument('--pool', required=True, help='The pool the action runs in.')
+  parser.add_argument(
+      '--output', required=True, help='The first output of the action, as ninja names it.'
+  )
+  parser.add_argument('script', help='The Python script that performs the action.')
+  parser.add_argument('script_args', nargs=argparse.REMAINDER)
+  args = parser.parse_args()
+
+  returncode = subprocess.call([sys.executable, args.script] + args.script_args)
+  # A failed action may not have reached its peak, so only successes count.
+  if returncode == 0 and resource is not None:
+    append_record(args.log, get_children_peak_rss(), args.pool, args.output)
+  return returncode
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+#
+# Copyright 2013 The Flutter Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+RECORD_PEAK_RSS_PY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'record_peak_rss.py')
+
+# Touches |size| bytes in a child process, the way gn_run_binary.py runs the
+# tool that does the work, then exits with |exit_code|.
+ACTION_SCRIPT = '''
+import subprocess
+import sys
+size, exit_code = sys.argv[1:]
+subprocess.check_call([sys.executable, '-c', 'b = bytearray(%s)' % size])
+sys.exit(int(exit_code))
+'''
+
+MB = 2**20
+
+
+@unittest.skipIf(sys.platform.startswith('win'), 'getrusage is not available on Windows')
+class RecordPeakRssTest(unittest.TestCase):
+
+  def setUp(self):
+    self.temp_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.temp_dir)
+    self.script = os.path.join(self.temp_dir, 'action.py')
+    with open(self.script, 'w') as f:
+      f.write(ACTION_SCRIPT)
+    self.log = os.path.join(self.temp_dir, '.ninja_rss')
+
+  def RunAction(self, output, size, exit_code=0):
+    sampler = [
+        sys.executable, RECORD_PEAK_RSS_PY, '--log', self.log, '--pool', 'dart_kernel', '--output',
+        output
+    ]
+    return subprocess.call(sampler + [self.script, str(size), str(exit_code)])
+
+  def ReadLog(self):
+    with open(self.log) as f:
+      return [line.split('\t') for line in f.read().splitlines()]
+
+  def test_records_peak_rss(self):
+    self.assertEqual(self.RunAction('gen/small.dill', 0), 0)
+    self.assertEqual(self.RunAction('gen/large.dill', 200 * MB), 0)
+    (small_peak, small_pool, small_output), (large_peak, large_pool, large_output) = self.ReadLog()
+    self.assertEqual((small_pool, small_output), ('dart_kernel', 'gen/small.dill'))
+    self.assertEqual((large_pool, large_output), ('dart_kernel', 'gen/large.dill'))
+    # The allocation happens in a grandchild of the sampler.
+    self.assertGreater(int(large_peak), 200 * MB)
+    self.assertLess(int(small_peak), 200 * MB)
+
+  def test_failed_action_is_not_recorded(self):
+    self.assertEqual(self.RunAction('gen/failed.dill', 0, exit_code=3), 3)
+    self.assertFalse(os.path.exists(self.log))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -5,30 +5,314 @@
 # found in the LICENSE file.
 
 import argparse
+import collections
+import concurrent.futures
+import fnmatch
+import hashlib
+import itertools
 import json
 import os
 import stat
+import struct
 import sys
 import zipfile
+import zlib
 
+# Timestamp used for every entry in reproducible mode. This is the earliest
+# time the zip format can represent.
+_REPRODUCIBLE_DATE_TIME = (1980, 1, 1, 0, 0, 0)
 
-def _zip_dir(path, zip_file, prefix):
+# Bump this whenever the manifest format or the way entries are encoded changes,
+# so that incremental runs do not reuse entries written by an older version.
+_MANIFEST_VERSION = 1
+
+_SYMLINK = 'symlink'
+_FILE = 'file'
+
+# Formats whose contents are already compressed. Deflating them again costs CPU
+# and rarely saves more than a few bytes.
+_PRECOMPRESSED_EXTENSIONS = frozenset([
+    '.7z',
+    '.aar',
+    '.apk',
+    '.br',
+    '.bz2',
+    '.far',
+    '.gz',
+    '.jar',
+    '.jpeg',
+    '.jpg',
+    '.png',
+    '.tgz',
+    '.webp',
+    '.woff2',
+    '.xz',
+    '.zip',
+    '.zst',
+])
+
+
+class CompressionPolicy:
+  """Decides whether an archive entry is deflated or stored.
+
+  Explicit rules are checked first, in the order they were given, and the first
+  rule whose pattern matches the archive path wins. Files that no rule matches
+  are stored if their extension is a known compressed format. Otherwise, if
+  sampling is enabled, the first |sample_size| bytes are deflated and the file
+  is stored when the sample does not shrink below |min_ratio| of its size.
+  """
+
+  def __init__(self, rules=(), sample_size=0, min_ratio=0.9):
+    self.rules = list(rules)
+    self.sample_size = sample_size
+    self.min_ratio = min_ratio
+
+  def should_deflate(self, archive_name, data):
+    for pattern, deflate in self.rules:
+      if fnmatch.fnmatch(archive_name, pattern):
+        return deflate
+    if os.path.splitext(archive_name)[1].lower() in _PRECOMPRESSED_EXTENSIONS:
+      return False
+    if self.sample_size > 0 and data:
+      sample = data[:self.sample_size]
+      compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+      compressed_size = len(compressor.compress(sample) + compressor.flush())
+      return compressed_size < len(sample) * self.min_ratio
+    return True
+
+
+def _collect_dir(path, prefix, entries):
   path = path.rstrip('/\\')
   for root, directories, files in os.walk(path):
+    # Walk in sorted order so that the archive layout does not depend on the
+    # order in which the file system happens to return directory entries.
+    directories.sort()
+    files.sort()
+    archive_root = os.path.join(prefix, os.path.relpath(root, path))
+    if root == path:
+      archive_root = prefix
     for directory in directories:
       if os.path.islink(os.path.join(root, directory)):
-        add_symlink(
-            zip_file,
-            os.path.join(root, directory),
-            os.path.join(root.replace(path, prefix), directory),
+        entries.append(
+            (_SYMLINK, os.path.join(root, directory), os.path.join(archive_root, directory))
         )
     for file in files:
-      if os.path.islink(os.path.join(root, file)):
-        add_symlink(
-            zip_file, os.path.join(root, file), os.path.join(root.replace(path, prefix), file)
-        )
-        continue
-      zip_file.write(os.path.join(root, file), os.path.join(root.replace(path, prefix), file))
+      kind = _SYMLINK if os.path.islink(os.path.join(root, file)) else _FILE
+      entries.append((kind, os.path.join(root, file), os.path.join(archive_root, file)))
+
+
+def _collect(path, archive_name, entries):
+  if os.path.islink(path):
+    entries.append((_SYMLINK, path, archive_name))
+  elif os.path.isdir(path):
+    _collect_dir(path, archive_name, entries)
+  else:
+    entries.append((_FILE, path, archive_name))
+
+
+def _make_zip_info(source, archive_name, reproducible):
+  zip_info = zipfile.ZipInfo.from_file(source, archive_name)
+  if reproducible:
+    zip_info.date_time = _REPRODUCIBLE_DATE_TIME
+    zip_info.create_system = 3  # Unix like system
+    mode = os.stat(source).st_mode
+    permissions = 0o755 if mode & (stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH) else 0o644
+    zip_info.external_attr = (stat.S_IFREG | permissions) << 16
+  return zip_info
+
+
+def _compress_file(source, archive_name, policy, reproducible):
+  """Reads and, if |policy| allows it, deflates a file without touching the archive.
+
+  This is safe to run on a worker thread: zlib releases the GIL while
+  compressing, so several entries can be compressed at once.
+  """
+  zip_info = _make_zip_info(source, archive_name, reproducible)
+  with open(source, 'rb') as source_file:
+    data = source_file.read()
+  if policy.should_deflate(archive_name, data):
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+    payload = compressor.compress(data) + compressor.flush()
+    zip_info.compress_type = zipfile.ZIP_DEFLATED
+  else:
+    payload = data
+    zip_info.compress_type = zipfile.ZIP_STORED
+  zip_info.file_size = len(data)
+  zip_info.compress_size = len(payload)
+  zip_info.CRC = zlib.crc32(data)
+  return zip_info, payload, hashlib.sha256(data).hexdigest()
+
+
+def _stream_file(zip_file, source, archive_name, policy, reproducible):
+  """Compresses a file into |zip_file| a chunk at a time.
+
+  Serial runs use this instead of _compress_file so that a file is never held
+  in memory as a whole. Returns the zip_info and digest of the entry.
+  """
+  zip_info = _make_zip_info(source, archive_name, reproducible)
+  digest = hashlib.sha256()
+  with open(source, 'rb') as source_file:
+    # Only the leading sample is needed to pick the compression.
+    head = source_file.read(policy.sample_size)
+    if policy.should_deflate(archive_name, head):
+      zip_info.compress_type = zipfile.ZIP_DEFLATED
+    else:
+      zip_info.compress_type = zipfile.ZIP_STORED
+    chunks = itertools.chain([head], iter(lambda: source_file.read(1 << 20), b''))
+    with zip_file.open(zip_info, 'w') as entry:
+      for chunk in chunks:
+        digest.update(chunk)
+        entry.write(chunk)
+  return zip_info, digest.hexdigest()
+
+
+def _hash_file(path):
+  digest = hashlib.sha256()
+  with open(path, 'rb') as source_file:
+    for chunk in iter(lambda: source_file.read(1 << 20), b''):
+      digest.update(chunk)
+  return digest.hexdigest()
+
+
+class _PreviousArchive:
+  """An archive written by an earlier incremental run, and its manifest.
+
+  Entries whose inputs are unchanged are copied out of this archive without
+  being recompressed.
+  """
+
+  def __init__(self, path, manifest):
+    self.zip_file = zipfile.ZipFile(path)
+    self.records = manifest['entries']
+
+  def close(self):
+    self.zip_file.close()
+
+  def _read_raw(self, zip_info):
+    self.zip_file.fp.seek(zip_info.header_offset)
+    header = self.zip_file.fp.read(zipfile.sizeFileHeader)
+    if len(header) != zipfile.sizeFileHeader or header[:4] != zipfile.stringFileHeader:
+      return None
+    name_length, extra_length = struct.unpack('<26xHH', header)
+    self.zip_file.fp.seek(name_length + extra_length, os.SEEK_CUR)
+    payload = self.zip_file.fp.read(zip_info.compress_size)
+    if len(payload) != zip_info.compress_size:
+      return None
+    return payload
+
+  def reuse(self, source, archive_name, reproducible):
+    """Returns the previous (zip_info, payload, digest) for |source|, or None if it changed.
+
+    A matching size and modification time is trusted; otherwise the file is
+    hashed and compared with the digest recorded in the manifest.
+    """
+    record = self.records.get(archive_name)
+    if record is None:
+      return None
+    source_stat = os.stat(source)
+    if source_stat.st_size != record['size']:
+      return None
+    digest = record['sha256']
+    if source_stat.st_mtime_ns != record['mtime_ns'] and _hash_file(source) != digest:
+      return None
+    try:
+      previous_info = self.zip_file.getinfo(archive_name)
+    except KeyError:
+      return None
+    if previous_info.header_offset != record['offset']:
+      return None
+    payload = self._read_raw(previous_info)
+    if payload is None:
+      return None
+    zip_info = _make_zip_info(source, archive_name, reproducible)
+    zip_info.compress_type = previous_info.compress_type
+    zip_info.file_size = previous_info.file_size
+    zip_info.compress_size = previous_info.compress_size
+    zip_info.CRC = previous_info.CRC
+    return zip_info, payload, digest
+
+
+def _manifest_path(output):
+  return output + '.manifest.json'
+
+
+def _load_previous_archive(output, options):
+  try:
+    with open(_manifest_path(output)) as manifest_file:
+      manifest = json.load(manifest_file)
+  except (OSError, ValueError):
+    return None
+  if manifest.get('version') != _MANIFEST_VERSION or manifest.get('options') != options:
+    return None
+  try:
+    return _PreviousArchive(output, manifest)
+  except (OSError, zipfile.BadZipFile):
+    return None
+
+
+def _write_compressed(zip_file, zip_info, payload):
+  """Appends an entry whose data has already been compressed.
+
+  zipfile has no public API for this, so the local header is written by hand
+  and the entry is registered the same way ZipFile.write does it.
+  """
+  zip_file._writecheck(zip_info)  # pylint: disable=protected-access
+  zip_file._didModify = True  # pylint: disable=protected-access
+  zip_info.header_offset = zip_file.fp.tell()
+  # Decide on a zip64 header the way ZipFile.open does, so entries that are
+  # streamed by serial runs are encoded identically.
+  zip64 = zip_info.file_size * 1.05 > zipfile.ZIP64_LIMIT
+  zip_file.fp.write(zip_info.FileHeader(zip64))
+  zip_file.fp.write(payload)
+  zip_file.filelist.append(zip_info)
+  zip_file.NameToInfo[zip_info.filename] = zip_info
+  zip_file.start_dir = zip_file.fp.tell()
+
+
+def _compressed_entries(entries, jobs, policy, reproducible, previous=None):
+  """Yields (entry, compressed file) pairs in the order of |entries|.
+
+  Files are compressed on up to |jobs| threads, but at most 2 * |jobs| results
+  are held in memory at a time. Unchanged files are taken from |previous|, if
+  given, instead of being compressed again. With a single job, files are not
+  compressed here: they are yielded with None, to be streamed by _write_entry.
+  """
+  if jobs <= 1:
+    for kind, source, archive_name in entries:
+      compressed = None
+      if kind == _FILE and previous:
+        compressed = previous.reuse(source, archive_name, reproducible)
+      yield (kind, source, archive_name), compressed
+    return
+
+  with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+    pending = collections.deque()
+    for entry in entries:
+      kind, source, archive_name = entry
+      future = None
+      if kind == _FILE:
+        reused = previous.reuse(source, archive_name, reproducible) if previous else None
+        if reused is None:
+          future = executor.submit(_compress_file, source, archive_name, policy, reproducible)
+        else:
+          future = concurrent.futures.Future()
+          future.set_result(reused)
+      pending.append((entry, future))
+      while len(pending) > 2 * jobs:
+        done_entry, done_future = pending.popleft()
+        yield done_entry, done_future.result() if done_future else None
+    while pending:
+      done_entry, done_future = pending.popleft()
+      yield done_entry, done_future.result() if done_future else None
+
+
+def _write_entry(zip_file, source, archive_name, compressed, policy, reproducible):
+  """Writes a file entry yielded by _compressed_entries and returns its zip_info and digest."""
+  if compressed is None:
+    return _stream_file(zip_file, source, archive_name, policy, reproducible)
+  zip_info, payload, digest = compressed
+  _write_compressed(zip_file, zip_info, payload)
+  return zip_info, digest
 
 
 def add_symlink(zip_file, source, target):
@@ -50,28 +334,76 @@ def add_symlink(zip_file, source, target):
 
 
 def main(args):
-  zip_file = zipfile.ZipFile(args.output, 'w', zipfile.ZIP_DEFLATED)
+  entries = []
   if args.source_file:
     with open(args.source_file) as source_file:
       file_dict_list = json.load(source_file)
       for file_dict in file_dict_list:
-        if os.path.islink(file_dict['source']):
-          add_symlink(zip_file, file_dict['source'], file_dict['destination'])
-          continue
-        if os.path.isdir(file_dict['source']):
-          _zip_dir(file_dict['source'], zip_file, file_dict['destination'])
-        else:
-          zip_file.write(file_dict['source'], file_dict['destination'])
+        _collect(file_dict['source'], file_dict['destination'], entries)
   else:
     for path, archive_name in args.input_pairs:
-      if os.path.islink(path):
-        add_symlink(zip_file, path, archive_name)
-        continue
-      if os.path.isdir(path):
-        _zip_dir(path, zip_file, archive_name)
-      else:
-        zip_file.write(path, archive_name)
-  zip_file.close()
+      _collect(path, archive_name, entries)
+
+  rules = [(pattern, False) for pattern in args.store_patterns or []]
+  rules += [(pattern, True) for pattern in args.deflate_patterns or []]
+  policy = CompressionPolicy(rules, args.sample_size, args.min_ratio)
+
+  if not args.incremental:
+    with zipfile.ZipFile(args.output, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+      compressed_entries = _compressed_entries(entries, args.jobs, policy, args.reproducible)
+      for (kind, source, archive_name), compressed in compressed_entries:
+        if kind == _SYMLINK:
+          add_symlink(zip_file, source, archive_name)
+        else:
+          _write_entry(zip_file, source, archive_name, compressed, policy, args.reproducible)
+    return 0
+
+  # Anything that changes how an unchanged input is encoded invalidates the
+  # previous archive.
+  options = {
+      'reproducible': args.reproducible,
+      'rules': rules,
+      'sample_size': args.sample_size,
+      'min_ratio': args.min_ratio,
+  }
+  previous = _load_previous_archive(args.output, json.loads(json.dumps(options)))
+  # Remove the manifest first so that a failed run never leaves a manifest that
+  # describes a different archive.
+  if os.path.exists(_manifest_path(args.output)):
+    os.remove(_manifest_path(args.output))
+
+  records = {}
+  temp_output = args.output + '.tmp'
+  try:
+    with zipfile.ZipFile(temp_output, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+      compressed_entries = _compressed_entries(
+          entries, args.jobs, policy, args.reproducible, previous
+      )
+      for (kind, source, archive_name), compressed in compressed_entries:
+        if kind == _SYMLINK:
+          add_symlink(zip_file, source, archive_name)
+          continue
+        zip_info, digest = _write_entry(
+            zip_file, source, archive_name, compressed, policy, args.reproducible
+        )
+        source_stat = os.stat(source)
+        records[zip_info.filename] = {
+            'size': source_stat.st_size,
+            'mtime_ns': source_stat.st_mtime_ns,
+            'sha256': digest,
+            'offset': zip_info.header_offset,
+        }
+  finally:
+    if previous:
+      previous.close()
+  os.replace(temp_output, args.output)
+
+  with open(_manifest_path(args.output), 'w') as manifest_file:
+    json.dump({'version': _MANIFEST_VERSION, 'options': options, 'entries': records},
+              manifest_file,
+              indent=1,
+              sort_keys=True)
+  return 0
 
 
 if __name__ == '__main__':
@@ -87,4 +419,53 @@ if __name__ == '__main__':
   parser.add_argument(
       '-f', dest='source_file', action='store', help='The path to the file list to zip.'
   )
+  parser.add_argument(
+      '-j',
+      dest='jobs',
+      type=int,
+      default=1,
+      help='The number of files to compress in parallel. The archive layout does not '
+      'depend on this value.'
+  )
+  parser.add_argument(
+      '--reproducible',
+      action='store_true',
+      default=False,
+      help='Normalize timestamps and permissions so that identical inputs produce a '
+      'byte-identical archive.'
+  )
+  parser.add_argument(
+      '--store',
+      dest='store_patterns',
+      action='append',
+      help='A glob matched against archive paths whose files are stored uncompressed, '
+      'e.g. "lib/*.so" for libraries that are mapped directly from the archive. '
+      'Takes precedence over --deflate.'
+  )
+  parser.add_argument(
+      '--deflate',
+      dest='deflate_patterns',
+      action='append',
+      help='A glob matched against archive paths whose files are always deflated.'
+  )
+  parser.add_argument(
+      '--sample-size',
+      type=int,
+      default=0,
+      help='If positive, deflate this many leading bytes of each file not matched by a rule '
+      'and store the file if they do not compress well.'
+  )
+  parser.add_argument(
+      '--min-ratio',
+      type=float,
+      default=0.9,
+      help='The compressed-to-original size ratio a sample must beat to be deflated.'
+  )
+  parser.add_argument(
+      '--incremental',
+      action='store_true',
+      default=False,
+      help='Keep a manifest next to the output and, on later runs, copy entries whose inputs '
+      'did not change from the previous archive instead of compressing them again.'
+  )
   sys.exit(main(parser.parse_args()))
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+#
+# Copyright 2013 The Flutter Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+import zipfile
+
+ZIP_PY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'zip.py')
+
+
+class ZipTest(unittest.TestCase):
+
+  def setUp(self):
+    self.temp_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.temp_dir)
+    self.input_dir = os.path.join(self.temp_dir, 'input')
+    random.seed(0)
+    self.WriteFile('lib/libapp.so', bytes(random.getrandbits(8) for _ in range(300000)))
+    self.WriteFile('assets/text.txt', b'compressible ' * 50000)
+    self.WriteFile('assets/image.png', b'\x89PNG' + b'\x00' * 1000)
+    self.WriteFile('empty', b'')
+    os.symlink('libapp.so', os.path.join(self.input_dir, 'lib', 'link.so'))
+
+  def WriteFile(self, name, contents):
+    path = os.path.join(self.input_dir, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+      f.write(contents)
+
+  def Zip(self, output, *args):
+    output = os.path.join(self.temp_dir, output)
+    subprocess.check_call([
+        sys.executable, ZIP_PY, '-o', output, '-i', self.input_dir, 'root', '--reproducible',
+        '--sample-size', '4096'
+    ] + list(args))
+    return output
+
+  def ReadArchive(self, path):
+    with zipfile.ZipFile(path) as zip_file:
+      self.assertIsNone(zip_file.testzip())
+      return {info.filename: zip_file.read(info) for info in zip_file.infolist()}
+
+  def ReadInputs(self):
+    contents = {}
+    for root, _, files in os.walk(self.input_dir):
+      for file in files:
+        path = os.path.join(root, file)
+        name = os.path.join('root', os.path.relpath(path, self.input_dir))
+        if os.path.islink(path):
+          contents[name] = os.readlink(path).encode()
+        else:
+          with open(path, 'rb') as f:
+            contents[name] = f.read()
+    return contents
+
+  def test_parallel_output_matches_serial(self):
+    with open(self.Zip('serial.zip', '-j', '1'), 'rb') as f:
+      serial = f.read()
+    with open(self.Zip('parallel.zip', '-j', '4'), 'rb') as f:
+      parallel = f.read()
+    self.assertEqual(serial, parallel)
+    self.assertEqual(self.ReadArchive(os.path.join(self.temp_dir, 'serial.zip')), self.ReadInputs())
+
+  def CheckIncrementalRebuild(self, jobs):
+    output = self.Zip('incremental.zip', '--incremental', '-j', jobs)
+    self.assertTrue(os.path.exists(output + '.manifest.json'))
+
+    self.WriteFile('assets/text.txt', b'changed ' * 1000)
+    self.WriteFile('assets/new.txt', b'new')
+    os.remove(os.path.join(self.input_dir, 'empty'))
+    self.Zip('incremental.zip', '--incremental', '-j', jobs)
+    self.assertEqual(self.ReadArchive(output), self.ReadInputs())
+
+    # The result is the same archive a clean build produces.
+    with open(output, 'rb') as f:
+      incremental = f.read()
+    with open(self.Zip('clean.zip', '-j', jobs), 'rb') as f:
+      self.assertEqual(incremental, f.read())
+
+  def test_incremental_rebuild(self):
+    self.CheckIncrementalRebuild('1')
+
+  def test_parallel_incremental_rebuild(self):
+    self.CheckIncrementalRebuild('4')
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+#
+# Copyright 2013 The Flutter Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+#
+# A parser for gclient DEPS files that does not execute them.
+#
+# DEPS files are a restricted subset of Python: a series of top-level
+# assignments of literals, combined with `+` or `%`, and calls to `Var()` and
+# `Str()`. This module evaluates exactly that subset from the AST, so reading
+# DEPS takes milliseconds and can never run arbitrary code.
+#
+# Usage from other scripts:
+#
+#   deps_file = deps_parser.load('path/to/DEPS')
+#   for dep in deps_file.git_deps():
+#     print(dep.path, dep.url, dep.revision)
+
+import ast
+import collections
+import os
+import threading
+
+UPSTREAM_PREFIX = 'upstream_'
+
+# Default values for the variables gclient injects from the environment.
+DEFAULT_BUILTIN_VARS = {
+    'host_cpu': 'x64',
+    'host_os': 'linux',
+}
+
+GitDep = collections.namedtuple('GitDep', ['path', 'url', 'revision'])
+
+
+class DepsParseError(Exception):
+  pass
+
+
+class _Evaluator:
+  """Evaluates the expressions allowed in a DEPS file."""
+
+  def __init__(self, filename, deps_vars, builtin_vars):
+    self._filename = filename
+    self._vars = deps_vars
+    self._builtin_vars = builtin_vars
+
+  def error(self, node, message):
+    return DepsParseError('%s:%d: %s' % (self._filename, getattr(node, 'lineno', 0), message))
+
+  def lookup(self, node, name):
+    if name in self._vars:
+      return self._vars[name]
+    if name in self._builtin_vars:
+      return self._builtin_vars[name]
+    raise self.error(node, 'Var is not defined: %s' % name)
+
+  def evaluate(self, node):
+    if isinstance(node, ast.Dict):
+      if any(key is None for key in node.keys):
+        raise self.error(node, 'dictionary unpacking is not allowed')
+      return collections.OrderedDict(
+          (self.evaluate(key), self.evaluate(value)) for key, value in zip(node.keys, node.values)
+      )
+    if isinstance(node, ast.List):
+      return [self.evaluate(element) for element in node.elts]
+    if isinstance(node, ast.Tuple):
+      return tuple(self.evaluate(element) for element in node.elts)
+    if isinstance(node, ast.BinOp):
+      left = self.evaluate(node.left)
+      right = self.evaluate(node.right)
+      if isinstance(node.op, ast.Add):
+        return left + right
+      if isinstance(node.op, ast.Mod) and isinstance(left, str):
+        return left % right
+      raise self.error(node, 'unsupported operator: %s' % type(node.op).__name__)
+    if isinstance(node, ast.Call):
+      if (not isinstance(node.func, ast.Name) or node.func.id not in ('Var', 'Str') or
+          len(node.args) != 1 or node.keywords):
+        raise self.error(node, 'only Var(name) and Str(value) calls are allowed')
+      argument = self.evaluate(node.args[0])
+      if not isinstance(argument, str):
+        raise self.error(node, '%s() expects a string' % node.func.id)
+      if node.func.id == 'Var':
+        return self.lookup(node, argument)
+      return argument
+    try:
+      return ast.literal_eval(node)
+    except ValueError:
+      raise self.error(node, 'unsupported expression: %s' % type(node).__name__) from None
+
+
+class DepsFile:
+  """The evaluated contents of a DEPS file."""
+
+  def __init__(self, filename, scope):
+    self.filename = filename
+    self.scope = scope
+
+  @property
+  def vars(self):
+    return self.scope.get('vars', {})
+
+  @property
+  def deps(self):
+    return self.scope.get('deps', {})
+
+  def get_var(self, name, default=None):
+    return self.vars.get(name, default)
+
+  def git_deps(self):
+    """Returns the deps pinned to a git URL and revision, in DEPS order.
+
+    Packages (cipd, gcs) and unpinned deps are skipped.
+    """
+    result = []
+    for path, dep in self.deps.items():
+      if isinstance(dep, dict):
+        if dep.get('dep_type', 'git') != 'git' or 'url' not in dep:
+          continue
+        dep = dep['url']
+      if not isinstance(dep, str) or '@' not in dep:
+        continue
+      url, revision = dep.rsplit('@', 1)
+      result.append(GitDep(path, url, revision))
+    return result
+
+  def upstreams(self):
+    """Returns the `upstream_` vars, keyed by the name they follow the prefix with."""
+    return collections.OrderedDict((name[len(UPSTREAM_PREFIX):], value)
+                                   for name, value in self.vars.items()
+                                   if name.startswith(UPSTREAM_PREFIX))
+
+  def upstream_for(self, url):
+    """Returns the upstream URL of the mirror at |url|, or None if there is no mapping."""
+    dep_name = url.split('/')[-1].split('.')[0]
+    return self.vars.get(UPSTREAM_PREFIX + dep_name)
+
+
+def parse(content, filename='DEPS', builtin_vars=None):
+  """Evaluates the DEPS file |content| and returns a DepsFile."""
+  if builtin_vars is None:
+    builtin_vars = DEFAULT_BUILTIN_VARS
+  try:
+    module = ast.parse(content, filename)
+  except SyntaxError as error:
+    raise DepsParseError('%s:%s: %s' % (filename, error.lineno, error.msg)) from None
+
+  scope = collections.OrderedDict()
+  evaluator = _Evaluator(filename, {}, builtin_vars)
+  for statement in module.body:
+    if (not isinstance(statement, ast.Assign) or len(statement.targets) != 1 or
+        not isinstance(statement.targets[0], ast.Name)):
+      raise evaluator.error(statement, 'only top-level assignments are allowed')
+    name = statement.targets[0].id
+    scope[name] = evaluator.evaluate(statement.value)
+    if name == 'vars':
+      if not isinstance(scope[name], dict):
+        raise evaluator.error(statement, 'vars must be a dictionary')
+      evaluator = _Evaluator(filename, scope[name], builtin_vars)
+  return DepsFile(filename, scope)
+
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def load(path):
+  """Parses the DEPS file at |path|.
+
+  Results are cached for the lifetime of the process and are reparsed only
+  if the file's size or modification time changes.
+  """
+  path = os.path.abspath(path)
+  stat = os.stat(path)
+  key = (path, stat.st_size, stat.st_mtime_ns)
+  with _cache_lock:
+    if key in _cache:
+      return _cache[key]
+  with open(path, 'r') as file:
+    deps_file = parse(file.read(), path)
+  with _cache_lock:
+    _cache[key] = deps_file
+  return deps_file
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+#
+# Copyright 2013 The Flutter Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import os
+import unittest
+
+import deps_parser
+
+CHECKOUT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SAMPLE_DEPS = """
+vars = {
+  'chromium_git': 'https://chromium.googlesource.com',
+  'foo_rev': 'abc123',
+  'upstream_foo': 'https://github.com/example/foo.git',
+}
+
+deps = {
+  'src/third_party/foo':
+    Var('chromium_git') + '/external/foo.git' + '@' + Var('foo_rev'),
+  'src/third_party/bar': {
+    'url': '%s/bar.git@def456' % Var('chromium_git'),
+    'condition': 'host_os == "linux"',
+  },
+  'src/third_party/tool': {
+    'dep_type': 'cipd',
+    'packages': [{'package': 'tool/' + Var('host_os'), 'version': 'v1'}],
+  },
+}
+"""
+
+
+class DepsParserTest(unittest.TestCase):
+
+  def test_evaluates_vars_and_deps(self):
+    deps_file = deps_parser.parse(SAMPLE_DEPS)
+    self.assertEqual(deps_file.get_var('foo_rev'), 'abc123')
+    self.assertEqual(
+        deps_file.deps['src/third_party/foo'],
+        'https://chromium.googlesource.com/external/foo.git@abc123'
+    )
+    self.assertEqual(deps_file.deps['src/third_party/tool']['packages'][0]['package'], 'tool/linux')
+    self.assertEqual(
+        deps_file.git_deps(), [
+            deps_parser.GitDep(
+                'src/third_party/foo', 'https://chromium.googlesource.com/external/foo.git',
+                'abc123'
+            ),
+            deps_parser.GitDep(
+                'src/third_party/bar', 'https://chromium.googlesource.com/bar.git', 'def456'
+            ),
+        ]
+    )
+
+  def test_upstreams(self):
+    deps_file = deps_parser.parse(SAMPLE_DEPS)
+    self.assertEqual(dict(deps_file.upstreams()), {'foo': 'https://github.com/example/foo.git'})
+    self.assertEqual(
+        deps_file.upstream_for('https://chromium.googlesource.com/external/foo.git'),
+        'https://github.com/example/foo.git'
+    )
+    self.assertIsNone(deps_file.upstream_for('https://chromium.googlesource.com/bar.git'))
+
+  def test_rejects_code(self):
+    for content in [
+        'import os',
+        'vars = {}\nos.system("true")',
+        'deps = {"a": __import__("os").getcwd()}',
+        'deps = {"a": Var("missing")}',
+    ]:
+      with self.assertRaises(deps_parser.DepsParseError):
+        deps_parser.parse(content)
+
+  def test_loads_engine_deps(self):
+    deps_file = deps_parser.load(os.path.join(CHECKOUT_ROOT, 'DEPS'))
+    self.assertIn('dart_revision', deps_file.vars)
+    self.assertTrue(deps_file.git_deps())
+    self.assertIs(deps_file, deps_parser.load(os.path.join(CHECKOUT_ROOT, 'DEPS')))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -13,83 +13,72 @@
 # uploaded using GitHub actions to be used by the osv-scanner reusable action.
 
 import argparse
+import concurrent.futures
+import hashlib
 import json
 import os
 import re
 import shutil
 import subprocess
 import sys
+import tempfile
+import threading
+import deps_parser
 from compatibility_helper import byte_str_decode
 
 SCRIPT_DIR = os.path.dirname(sys.argv[0])
 CHECKOUT_ROOT = os.path.realpath(os.path.join(SCRIPT_DIR, '..'))
 CHROMIUM_README_FILE = 'third_party/accessibility/README.md'
-CHROMIUM_README_COMMIT_LINE = 4  # The fifth line will always contain the commit hash.
+# The README links the forked Chromium commit as [<sha>](<url>).
+CHROMIUM_README_COMMIT_PATTERN = re.compile(r'\[([0-9a-f]{40})\]')
 CHROMIUM = 'https://chromium.googlesource.com/chromium/src'
 DEP_CLONE_DIR = CHECKOUT_ROOT + '/clone-test'
 DEPS = os.path.join(CHECKOUT_ROOT, 'DEPS')
-UPSTREAM_PREFIX = 'upstream_'
+UPSTREAM_PREFIX = deps_parser.UPSTREAM_PREFIX
+# Only commits are needed to compute a merge-base, so clones and fetches skip
+# every tree and blob.
+PARTIAL_CLONE_FILTER = 'tree:0'
+DEFAULT_JOBS = 8
 
 
-# Used in parsing the DEPS file.
-class VarImpl:
-  _env_vars = {
-      'host_cpu': 'x64',
-      'host_os': 'linux',
-  }
-
-  def __init__(self, local_scope):
-    self._local_scope = local_scope
-
-  def lookup(self, var_name):
-    """Implements the Var syntax."""
-    if var_name in self._local_scope.get('vars', {}):
-      return self._local_scope['vars'][var_name]
-    # Inject default values for env variables.
-    if var_name in self._env_vars:
-      return self._env_vars[var_name]
-    raise Exception('Var is not defined: %s' % var_name)
-
-
-def extract_deps(deps_file):
-  local_scope = {}
-  var = VarImpl(local_scope)
-  global_scope = {
-      'Var': var.lookup,
-      'deps_os': {},
-  }
-  # Read the content.
-  with open(deps_file, 'r') as file:
-    deps_content = file.read()
+def extract_deps(deps_file, jobs=DEFAULT_JOBS, clone_dir=DEP_CLONE_DIR, cache_dir=None):
+  parsed_deps = deps_parser.load(deps_file)
 
-  # Eval the content.
-  exec(deps_content, global_scope, local_scope)
-
-  if not os.path.exists(DEP_CLONE_DIR):
-    os.mkdir(DEP_CLONE_DIR)  # Clone deps with upstream into temporary dir.
+  cache = AncestorCache(cache_dir) if cache_dir else None
+  if not cache and not os.path.exists(clone_dir):
+    os.mkdir(clone_dir)  # Clone deps with upstream into temporary dir.
 
   # Extract the deps and filter.
-  deps = local_scope.get('deps', {})
-  deps_list = local_scope.get('vars')
+  deps_list = parsed_deps.vars
+  # We currently do not support packages or cipd which are represented
+  # as dictionaries.
+  pinned_deps = [dep.rsplit('@', 1) for dep in parsed_deps.deps.values() if isinstance(dep, str)]
+
+  # Each dependency is resolved in its own directory, so they can all be
+  # resolved concurrently. Results are collected in DEPS order.
+  with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+    ancestor_results = list(
+        executor.map(
+            lambda dep: get_common_ancestor(dep, deps_list, clone_dir, cache),
+            pinned_deps,
+        )
+    )
+
   filtered_osv_deps = []
-  for _, dep in deps.items():
-    # We currently do not support packages or cipd which are represented
-    # as dictionaries.
-    if not isinstance(dep, str):
-      continue
-
-    dep_split = dep.rsplit('@', 1)
-    ancestor_result = get_common_ancestor([dep_split[0], dep_split[1]], deps_list)
+  for ancestor_result in ancestor_results:
     if ancestor_result:
       filtered_osv_deps.append({
           'package': {'name': ancestor_result[1], 'commit': ancestor_result[0]}
       })
 
-  try:
-    # Clean up cloned upstream dependency directory.
-    shutil.rmtree(DEP_CLONE_DIR)  # Use shutil.rmtree since dir could be non-empty.
-  except OSError as clone_dir_error:
-    print('Error cleaning up clone directory: %s : %s' % (DEP_CLONE_DIR, clone_dir_error.strerror))
+  if cache:
+    cache.save()
+  else:
+    try:
+      # Clean up cloned upstream dependency directory.
+      shutil.rmtree(clone_dir)  # Use shutil.rmtree since dir could be non-empty.
+    except OSError as clone_dir_error:
+      print('Error cleaning up clone directory: %s : %s' % (clone_dir, clone_dir_error.strerror))
 
   osv_result = {
       'packageSource': {'path': deps_file, 'type': 'lockfile'}, 'packages': filtered_osv_deps
@@ -106,30 +95,139 @@ def parse_readme():
   file_path = os.path.join(CHECKOUT_ROOT, CHROMIUM_README_FILE)
   with open(file_path) as file:
     # Read the content of the file opened.
-    content = file.readlines()
-    commit_line = content[CHROMIUM_README_COMMIT_LINE]
-    commit = re.search(r'(?<=\[).*(?=\])', commit_line)
+    content = file.read()
+    commit = CHROMIUM_README_COMMIT_PATTERN.search(content)
+    if not commit:
+      raise Exception('No commit hash found in %s' % file_path)
 
     osv_result = {
         'packageSource': {'path': file_path, 'type': 'lockfile'},
-        'packages': [{'package': {'name': CHROMIUM, 'commit': commit.group()}}]
+        'packages': [{'package': {'name': CHROMIUM, 'commit': commit.group(1)}}]
     }
 
     return osv_result
 
 
-def get_common_ancestor(dep, deps_list):
+def run_git(args, cwd):
+  output = subprocess.check_output(['git'] + args, cwd=cwd, stderr=subprocess.PIPE)
+  return byte_str_decode(output).strip()
+
+
+def has_commit(repo_dir, commit):
+  try:
+    run_git(['cat-file', '-e', commit + '^{commit}'], cwd=repo_dir)
+    return True
+  except subprocess.CalledProcessError:
+    return False
+
+
+def clone_dep(mirror, upstream, repo_dir):
+  """Makes a treeless, bare partial clone of |mirror| with |upstream| as a second remote."""
+  filter_flag = '--filter=' + PARTIAL_CLONE_FILTER
+  run_git(['clone', '--quiet', '--bare', filter_flag, '--', mirror, repo_dir],
+          cwd=os.path.dirname(repo_dir))
+  # Bare clones do not record a refspec, so later fetches would not update the
+  # mirror branches without one.
+  run_git(['config', 'remote.origin.fetch', '+refs/heads/*:refs/heads/*'], cwd=repo_dir)
+  run_git(['remote', 'add', 'upstream', upstream], cwd=repo_dir)
+  run_git(['config', 'remote.upstream.promisor', 'true'], cwd=repo_dir)
+  run_git(['config', 'remote.upstream.partialclonefilter', PARTIAL_CLONE_FILTER], cwd=repo_dir)
+
+
+def fetch_upstream_head(repo_dir):
+  """Fetches the commits of the upstream default branch (e.g. main/master/etc.)."""
+  run_git([
+      'fetch', '--quiet', '--filter=' + PARTIAL_CLONE_FILTER, 'upstream', '+HEAD:refs/upstream/HEAD'
+  ],
+          cwd=repo_dir)
+  return run_git(['rev-parse', 'refs/upstream/HEAD'], cwd=repo_dir)
+
+
+class AncestorCache:
+  """Persistent bare clones of dependencies, plus memoized merge-base results.
+
+  Clones are stored under a name derived from the mirror URL and are only
+  fetched into when they are missing a commit. Merge-bases are keyed on the
+  pinned mirror commit and the upstream HEAD, so a dependency whose pin and
+  upstream did not move is answered with a single ls-remote.
+  """
+
+  def __init__(self, cache_dir):
+    self.cache_dir = os.path.abspath(cache_dir)
+    self.memo_path = os.path.join(self.cache_dir, 'merge_bases.json')
+    if not os.path.exists(self.cache_dir):
+      os.makedirs(self.cache_dir)
+    try:
+      with open(self.memo_path) as memo_file:
+        self.memo = json.load(memo_file)
+    except (OSError, ValueError):
+      self.memo = {}
+    self._lock = threading.Lock()
+    self._repo_locks = {}
+
+  def _repo_lock(self, repo_dir):
+    with self._lock:
+      return self._repo_locks.setdefault(repo_dir, threading.Lock())
+
+  def repo_dir(self, mirror):
+    digest = hashlib.sha256(mirror.encode('utf-8')).hexdigest()[:16]
+    dep_name = mirror.split('/')[-1].split('.')[0]
+    return os.path.join(self.cache_dir, '%s-%s.git' % (dep_name, digest))
+
+  def get_common_ancestor(self, mirror, pinned, upstream):
+    upstream_head = run_git(['ls-remote', '--', upstream, 'HEAD'], cwd=self.cache_dir).split()[0]
+    key = '%s:%s' % (pinned, upstream_head)
+    with self._lock:
+      if key in self.memo:
+        return self.memo[key]
+
+    repo_dir = self.repo_dir(mirror)
+    with self._repo_lock(repo_dir):
+      if not os.path.exists(repo_dir):
+        # Clone next to the final location and move it into place, so that an
+        # interrupted clone never leaves a broken cache entry behind.
+        temp_repo_dir = tempfile.mkdtemp(prefix='.clone-', dir=self.cache_dir)
+        try:
+          clone_dep(mirror, upstream, temp_repo_dir)
+          os.rename(temp_repo_dir, repo_dir)
+        finally:
+          if os.path.exists(temp_repo_dir):
+            shutil.rmtree(temp_repo_dir)
+      else:
+        run_git(['remote', 'set-url', 'upstream', upstream], cwd=repo_dir)
+        if not has_commit(repo_dir, pinned):
+          run_git(['fetch', '--quiet', 'origin'], cwd=repo_dir)
+      if not has_commit(repo_dir, upstream_head):
+        fetch_upstream_head(repo_dir)
+      ancestor_commit = run_git(['merge-base', upstream_head, pinned], cwd=repo_dir)
+
+    with self._lock:
+      self.memo[key] = ancestor_commit
+    return ancestor_commit
+
+  def save(self):
+    temp_memo_path = self.memo_path + '.tmp'
+    with open(temp_memo_path, 'w') as memo_file:
+      json.dump(self.memo, memo_file, indent=2, sort_keys=True)
+    os.replace(temp_memo_path, self.memo_path)
+
+
+def get_common_ancestor(dep, deps_list, clone_dir=DEP_CLONE_DIR, cache=None):
   """
   Given an input of a mirrored dep,
   compare to the mapping of deps to their upstream
   in DEPS and find a common ancestor
   commit SHA value.
 
-  This is done by first cloning the mirrored dep,
-  then a branch which tracks the upstream.
-  From there,  git merge-base operates using the HEAD
-  commit SHA of the upstream branch and the pinned
-  SHA value of the mirrored branch
+  This is done by making a treeless, bare partial clone
+  of the mirrored dep and fetching only the commits
+  reachable from the upstream HEAD into it.
+  From there, git merge-base operates using the HEAD
+  commit SHA of the upstream and the pinned
+  SHA value of the mirrored branch.
+
+  If |cache| is given, the clone is kept and reused
+  across runs instead of being made in |clone_dir|.
   """
   # dep[0] contains the mirror repo.
   # dep[1] contains the mirror's pinned SHA.
@@ -141,45 +239,18 @@ def get_common_ancestor(dep, deps_list):
   try:
     # Get the upstream URL from the mapping in DEPS file.
     upstream = deps_list.get(UPSTREAM_PREFIX + dep_name)
-    temp_dep_dir = DEP_CLONE_DIR + '/' + dep_name
-    # Clone dependency from mirror.
-    subprocess.check_output(['git', 'clone', '--quiet', '--', dep[0], dep_name], cwd=DEP_CLONE_DIR)
-
-    # Create branch that will track the upstream dep.
     print('attempting to add upstream remote from: {upstream}'.format(upstream=upstream))
-    subprocess.check_output(['git', 'remote', 'add', 'upstream', upstream], cwd=temp_dep_dir)
-    subprocess.check_output(['git', 'fetch', '--quiet', 'upstream'], cwd=temp_dep_dir)
-    # Get name of the default branch for upstream (e.g. main/master/etc.).
-    default_branch = subprocess.check_output(
-        'git remote show upstream ' + "| sed -n \'/HEAD branch/s/.*: //p\'",
-        cwd=temp_dep_dir,
-        shell=True
-    )
-    default_branch = byte_str_decode(default_branch)
-    default_branch = default_branch.strip()
-
-    # Make upstream branch track the upstream dep.
-    subprocess.check_output([
-        'git', 'checkout', '--force', '-b', 'upstream', '--track', 'upstream/' + default_branch
-    ],
-                            cwd=temp_dep_dir)
-    # Get the most recent commit from default branch of upstream.
-    commit = subprocess.check_output(
-        'git for-each-ref ' + "--format=\'%(objectname:short)\' refs/heads/upstream",
-        cwd=temp_dep_dir,
-        shell=True
-    )
-    commit = byte_str_decode(commit)
-    commit = commit.strip()
-
-    # Perform merge-base on most recent default branch commit and pinned mirror commit.
-    ancestor_commit = subprocess.check_output(
-        'git merge-base {commit} {depUrl}'.format(commit=commit, depUrl=dep[1]),
-        cwd=temp_dep_dir,
-        shell=True
-    )
-    ancestor_commit = byte_str_decode(ancestor_commit)
-    ancestor_commit = ancestor_commit.strip()
+    if cache:
+      ancestor_commit = cache.get_common_ancestor(dep[0], dep[1], upstream)
+    else:
+      # Several deps may share a name, so each gets its own unique directory.
+      temp_dep_dir = tempfile.mkdtemp(prefix=dep_name + '-', dir=clone_dir)
+      clone_dep(dep[0], upstream, temp_dep_dir)
+      # Get the most recent commit from default branch of upstream.
+      commit = fetch_upstream_head(temp_dep_dir)
+
+      # Perform merge-base on most recent default branch commit and pinned mirror commit.
+      ancestor_commit = run_git(['merge-base', commit, dep[1]], cwd=temp_dep_dir)
     print('Ancestor commit: ' + ancestor_commit)
     return ancestor_commit, upstream
   except subprocess.CalledProcessError as error:
@@ -188,8 +259,8 @@ def get_common_ancestor(dep, deps_list):
             error.cmd, str(error.returncode)
         )
     )
-    if error.output:
-      print("Subprocess error output: '{0}'".format(error.output))
+    if error.stderr:
+      print("Subprocess error output: '{0}'".format(byte_str_decode(error.stderr)))
   return None
 
 
@@ -211,6 +282,20 @@ def parse_args(args):
       help='Output osv-scanner compatible deps file.',
       default=os.path.join(CHECKOUT_ROOT, 'osv-lockfile.json')
   )
+  parser.add_argument(
+      '--jobs',
+      '-j',
+      type=int,
+      help='Number of dependencies to resolve concurrently.',
+      default=DEFAULT_JOBS
+  )
+  parser.add_argument(
+      '--cache-dir',
+      type=str,
+      help='Directory in which to keep dependency clones and merge-base results between runs. '
+      'When omitted, dependencies are cloned into a temporary directory.',
+      default=None
+  )
 
   return parser.parse_args(args)
 
@@ -224,7 +309,7 @@ def write_manifest(deps, manifest_file):
 
 def main(argv):
   args = parse_args(argv)
-  deps = extract_deps(args.deps)
+  deps = extract_deps(args.deps, args.jobs, cache_dir=args.cache_dir)
   readme_deps = parse_readme()
   write_manifest([deps, readme_deps], args.output)
   return 0
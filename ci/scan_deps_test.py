@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+#
+# Copyright 2013 The Flutter Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+import scan_deps
+
+
+def git(args, cwd):
+  output = subprocess.check_output(
+      ['git', '-c', 'user.name=test', '-c', 'user.email=test@example.com'] + args,
+      cwd=cwd,
+      stderr=subprocess.DEVNULL
+  )
+  return output.decode('utf-8').strip()
+
+
+class ScanDepsTest(unittest.TestCase):
+
+  def setUp(self):
+    self.temp_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.temp_dir)
+
+  def _make_fixture(self, name):
+    """Creates an upstream repo and a mirror that diverged from it.
+
+    Returns the upstream URL, the mirror URL, the commit the mirror pins and
+    the last commit the two repositories share.
+    """
+    upstream = os.path.join(self.temp_dir, name + '-upstream.git')
+    mirror = os.path.join(self.temp_dir, 'mirrors', name + '.git')
+    work = os.path.join(self.temp_dir, name + '-work')
+    git(['init', '--quiet', '--bare', upstream], cwd=self.temp_dir)
+    git(['symbolic-ref', 'HEAD', 'refs/heads/main'], cwd=upstream)
+    git(['init', '--quiet', work], cwd=self.temp_dir)
+    git(['checkout', '--quiet', '-b', 'main'], cwd=work)
+    git(['commit', '--quiet', '--allow-empty', '-m', 'first ' + name], cwd=work)
+    shared = git(['rev-parse', 'HEAD'], cwd=work)
+    git(['push', '--quiet', upstream, 'main'], cwd=work)
+    git(['clone', '--quiet', '--bare', upstream, mirror], cwd=self.temp_dir)
+
+    # The upstream moves on after the mirror was taken...
+    git(['commit', '--quiet', '--allow-empty', '-m', 'upstream only'], cwd=work)
+    git(['push', '--quiet', upstream, 'main'], cwd=work)
+    # ...and the mirror carries a local patch that is pinned in DEPS.
+    git(['reset', '--quiet', '--hard', shared], cwd=work)
+    git(['commit', '--quiet', '--allow-empty', '-m', 'mirror only'], cwd=work)
+    pinned = git(['rev-parse', 'HEAD'], cwd=work)
+    git(['push', '--quiet', '--force', mirror, 'main'], cwd=work)
+    return upstream, mirror, pinned, shared
+
+  def _write_deps(self, fixtures):
+    deps_file = os.path.join(self.temp_dir, 'DEPS')
+    with open(deps_file, 'w') as file:
+      file.write('vars = {\n')
+      for name, (upstream, _, _, _) in fixtures.items():
+        file.write("  'upstream_%s': %r,\n" % (name, upstream))
+      file.write('}\ndeps = {\n')
+      for name, (_, mirror, pinned, _) in fixtures.items():
+        file.write("  'src/third_party/%s': %r,\n" % (name, mirror + '@' + pinned))
+      file.write("  'src/third_party/unknown': 'https://example.com/unknown.git@1234',\n")
+      file.write('}\n')
+    return deps_file
+
+  def test_extract_deps_finds_common_ancestors(self):
+    fixtures = {name: self._make_fixture(name) for name in ['alpha', 'beta']}
+    deps_file = self._write_deps(fixtures)
+
+    clone_dir = os.path.join(self.temp_dir, 'clones')
+    result = scan_deps.extract_deps(deps_file, jobs=2, clone_dir=clone_dir)
+
+    self.assertEqual(
+        result['packages'], [{'package': {'name': upstream, 'commit': shared}}
+                             for upstream, _, _, shared in fixtures.values()]
+    )
+    self.assertFalse(os.path.exists(clone_dir))
+
+  def test_extract_deps_reuses_cache(self):
+    fixtures = {'alpha': self._make_fixture('alpha')}
+    deps_file = self._write_deps(fixtures)
+    upstream, _, _, shared = fixtures['alpha']
+    expected = [{'package': {'name': upstream, 'commit': shared}}]
+    cache_dir = os.path.join(self.temp_dir, 'cache')
+
+    result = scan_deps.extract_deps(deps_file, cache_dir=cache_dir)
+    self.assertEqual(result['packages'], expected)
+    self.assertTrue(os.path.exists(os.path.join(cache_dir, 'merge_bases.json')))
+
+    # A second run is answered from the memo table without touching the clone.
+    for entry in os.listdir(cache_dir):
+      if entry.endswith('.git'):
+        shutil.rmtree(os.path.join(cache_dir, entry))
+    result = scan_deps.extract_deps(deps_file, cache_dir=cache_dir)
+    self.assertEqual(result['packages'], expected)
+
+
+if __name__ == '__main__':
+  unittest.main()
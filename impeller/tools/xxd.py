@@ -4,7 +4,16 @@
 
 import argparse
 import errno
+import hashlib
 import os
+import zlib
+
+# Both generated files start with this comment followed by a digest of the
+# inputs that produced them. When the digest matches, the outputs are left
+# untouched so that ninja (which restats action outputs) skips everything that
+# depends on them. Bump STAMP_VERSION whenever the generated code changes shape.
+STAMP_PREFIX = '// xxd-input-sha256: '
+STAMP_VERSION = 1
 
 
 def make_directories(path):
@@ -17,6 +26,99 @@ def make_directories(path):
       raise
 
 
+def compute_stamp(symbol_name, compression, data):
+  digest = hashlib.sha256()
+  digest.update(f'{STAMP_VERSION}:{compression}:'.encode('utf-8'))
+  digest.update(symbol_name.encode('utf-8'))
+  digest.update(b'\0')
+  digest.update(data)
+  return STAMP_PREFIX + digest.hexdigest()
+
+
+def read_stamp(path):
+  try:
+    with open(path, 'r') as output:
+      return output.readline().rstrip('\n')
+  except (OSError, UnicodeDecodeError):
+    return None
+
+
+def is_up_to_date(stamp, *outputs):
+  return all(read_stamp(output) == stamp for output in outputs)
+
+
+def write_byte_array(output, name, data):
+  output.write(f'alignas(std::max_align_t) const unsigned char {name}[] =\n')
+  output.write('{\n')
+  output.write(''.join(f'{byte},' for byte in data))
+  output.write('};\n')
+
+
+def write_raw_source(output, symbol_name, data):
+  output.write('#include <cstddef>\n')
+  write_byte_array(output, f'impeller_{symbol_name}_data', data)
+  output.write(f'const unsigned long impeller_{symbol_name}_length = {len(data)};\n')
+
+
+def write_raw_declarations(output, symbol_name):
+  output.write(f'extern const unsigned char impeller_{symbol_name}_data[];\n')
+  output.write(f'extern const unsigned long impeller_{symbol_name}_length;\n\n')
+
+
+# The compressed blob is inflated into a heap buffer the first time the
+# accessor is called. The buffer lives for the rest of the process, matching
+# the lifetime of the uncompressed static data it replaces.
+def write_zlib_source(output, symbol_name, data):
+  compressed = zlib.compress(data, 9)
+  output.write('#include <cstddef>\n')
+  output.write('#include <cstdlib>\n')
+  output.write('#include <mutex>\n')
+  output.write('#include "third_party/zlib/zlib.h"\n')
+  write_byte_array(output, f'impeller_{symbol_name}_compressed_data', compressed)
+  output.write(
+      f'const unsigned long impeller_{symbol_name}_compressed_length = {len(compressed)};\n'
+  )
+  output.write(f'const unsigned long impeller_{symbol_name}_length = {len(data)};\n\n')
+  output.write(f'const unsigned char* impeller_{symbol_name}_data() {{\n')
+  output.write('  static std::once_flag once;\n')
+  output.write('  static unsigned char* data = nullptr;\n')
+  output.write('  std::call_once(once, [] {\n')
+  output.write(
+      f'    uLongf length = impeller_{symbol_name}_length;\n'
+      '    auto buffer = static_cast<unsigned char*>(\n'
+      f'        std::malloc(impeller_{symbol_name}_length > 0 ? '
+      f'impeller_{symbol_name}_length : 1));\n'
+      '    if (buffer == nullptr) {\n'
+      '      return;\n'
+      '    }\n'
+      f'    if (uncompress(buffer, &length, impeller_{symbol_name}_compressed_data,\n'
+      f'                   impeller_{symbol_name}_compressed_length) != Z_OK ||\n'
+      f'        length != impeller_{symbol_name}_length) {{\n'
+      '      std::free(buffer);\n'
+      '      return;\n'
+      '    }\n'
+      '    data = buffer;\n'
+  )
+  output.write('  });\n')
+  output.write('  return data;\n')
+  output.write('}\n')
+
+
+def write_zlib_declarations(output, symbol_name):
+  output.write(f'extern const unsigned char impeller_{symbol_name}_compressed_data[];\n')
+  output.write(f'extern const unsigned long impeller_{symbol_name}_compressed_length;\n')
+  output.write(f'extern const unsigned long impeller_{symbol_name}_length;\n\n')
+  output.write('// Returns the uncompressed blob, inflating it on the first call. Returns\n')
+  output.write('// NULL if the embedded data could not be decompressed.\n')
+  output.write(f'const unsigned char* impeller_{symbol_name}_data(void);\n\n')
+
+
+WRITERS = {
+    'none': (write_raw_source, write_raw_declarations),
+    'zlib': (write_zlib_source, write_zlib_declarations),
+}
+
+
 # Dump the bytes of file into a C translation unit.
 # This can be used to embed the file contents into a binary.
 def main():
@@ -39,6 +141,14 @@ def main():
       required=True,
       help='The source file whose contents to embed in the output source file.'
   )
+  parser.add_argument(
+      '--compression',
+      type=str,
+      choices=sorted(WRITERS.keys()),
+      default='none',
+      help='How to store the embedded bytes. With "zlib", the data is exposed through an '
+      'accessor function that decompresses it on first use.'
+  )
 
   args = parser.parse_args()
 
@@ -51,31 +161,28 @@ def main():
   make_directories(os.path.dirname(output_header))
   make_directories(os.path.dirname(output_source))
 
-  with open(args.source, 'rb') as source, open(output_source, 'w') as output:
-    data_len = 0
+  with open(args.source, 'rb') as source:
+    data = source.read()
+
+  stamp = compute_stamp(args.symbol_name, args.compression, data)
+  if is_up_to_date(stamp, output_header, output_source):
+    return
+
+  write_source, write_declarations = WRITERS[args.compression]
+
+  with open(output_source, 'w') as output:
+    output.write(f'{stamp}\n')
     output.write(f'#include "{output_header_basename}"\n')
-    output.write('#include <cstddef>\n')
-    output.write(
-        f'alignas(std::max_align_t) const unsigned char impeller_{args.symbol_name}_data[] =\n'
-    )
-    output.write('{\n')
-    while True:
-      byte = source.read(1)
-      if not byte:
-        break
-      data_len += 1
-      output.write(f'{ord(byte)},')
-    output.write('};\n')
-    output.write(f'const unsigned long impeller_{args.symbol_name}_length = {data_len};\n')
+    write_source(output, args.symbol_name, data)
 
   with open(output_header, 'w') as output:
+    output.write(f'{stamp}\n')
     output.write('#pragma once\n')
     output.write('#ifdef __cplusplus\n')
     output.write('extern "C" {\n')
     output.write('#endif\n\n')
 
-    output.write(f'extern const unsigned char impeller_{args.symbol_name}_data[];\n')
-    output.write(f'extern const unsigned long impeller_{args.symbol_name}_length;\n\n')
+    write_declarations(output, args.symbol_name)
 
     output.write('#ifdef __cplusplus\n')
     output.write('}\n')
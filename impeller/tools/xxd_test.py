@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+#
+# Copyright 2013 The Flutter Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import os
+import re
+import shutil
+import sys
+import tempfile
+import unittest
+import zlib
+from unittest import mock
+
+import xxd
+
+# An mtime from long before any output could have been written by the test.
+OLD_MTIME = 1000000000
+
+
+class XxdTest(unittest.TestCase):
+
+  def setUp(self):
+    self.temp_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.temp_dir)
+    self.source = os.path.join(self.temp_dir, 'blob.bin')
+    self.header = os.path.join(self.temp_dir, 'gen', 'blob.h')
+    self.cc = os.path.join(self.temp_dir, 'gen', 'blob.cc')
+    self.WriteSource(b'\x00\x01blob contents\xff' * 64)
+
+  def ReadSourceData(self):
+    with open(self.source, 'rb') as f:
+      return f.read()
+
+  def WriteSource(self, data):
+    with open(self.source, 'wb') as f:
+      f.write(data)
+
+  def Run(self, *args):
+    argv = [
+        'xxd.py', '--symbol-name', 'blob', '--output-header', self.header, '--output-source',
+        self.cc, '--source', self.source
+    ] + list(args)
+    with mock.patch.object(sys, 'argv', argv):
+      xxd.main()
+
+  def ReadOutput(self, path):
+    with open(path) as f:
+      return f.read()
+
+  def ReadArray(self, name):
+    match = re.search(r'\b%s\[\] =\n\{\n([0-9,]*)\};' % name, self.ReadOutput(self.cc))
+    self.assertIsNotNone(match, name)
+    return bytes(int(byte) for byte in match.group(1).split(',') if byte)
+
+  def AgeOutputs(self):
+    for output in [self.header, self.cc]:
+      os.utime(output, (OLD_MTIME, OLD_MTIME))
+
+  def AssertOutputsRewritten(self, rewritten):
+    for output in [self.header, self.cc]:
+      self.assertEqual(os.stat(output).st_mtime != OLD_MTIME, rewritten, output)
+
+  def test_unchanged_input_is_not_rewritten(self):
+    self.Run()
+    self.AgeOutputs()
+    self.Run()
+    self.AssertOutputsRewritten(False)
+
+  def test_changed_input_is_rewritten(self):
+    self.Run()
+    self.AgeOutputs()
+    self.WriteSource(b'other contents')
+    self.Run()
+    self.AssertOutputsRewritten(True)
+
+  def test_changed_compression_is_rewritten(self):
+    self.Run()
+    self.AgeOutputs()
+    self.Run('--compression', 'zlib')
+    self.AssertOutputsRewritten(True)
+
+  def test_changed_stamp_version_is_rewritten(self):
+    self.Run()
+    self.AgeOutputs()
+    with mock.patch.object(xxd, 'STAMP_VERSION', xxd.STAMP_VERSION + 1):
+      self.Run()
+    self.AssertOutputsRewritten(True)
+
+  def test_raw_output(self):
+    self.Run()
+    self.assertEqual(self.ReadArray('impeller_blob_data'), self.ReadSourceData())
+    self.assertIn('extern const unsigned char impeller_blob_data[];', self.ReadOutput(self.header))
+
+  def test_zlib_output_round_trips(self):
+    self.Run('--compression', 'zlib')
+    compressed = self.ReadArray('impeller_blob_compressed_data')
+    self.assertLess(len(compressed), len(self.ReadSourceData()))
+    self.assertEqual(zlib.decompress(compressed), self.ReadSourceData())
+    self.assertIn(
+        'impeller_blob_compressed_length = %d;' % len(compressed), self.ReadOutput(self.cc)
+    )
+
+    header = self.ReadOutput(self.header)
+    self.assertIn('const unsigned char* impeller_blob_data(void);', header)
+    self.assertIn('extern const unsigned long impeller_blob_length;', header)
+    self.assertIn('const unsigned char* impeller_blob_data() {', self.ReadOutput(self.cc))
+
+
+if __name__ == '__main__':
+  unittest.main()
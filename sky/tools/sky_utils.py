@@ -10,6 +10,9 @@ import shutil
 import subprocess
 import sys
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', '..', 'build'))
+import copy_strategy  # pylint: disable=import-error,wrong-import-position
+
 
 def assert_directory(path, what):
   """Logs an error and exits with EX_NOINPUT if the specified directory doesn't exist."""
@@ -125,9 +128,13 @@ def buildroot_relative_path(path):
 
 
 def copy_binary(source_path, destination_path):
-  """Copies a binary, preserving POSIX permissions."""
+  """Copies a binary, preserving POSIX permissions.
+
+  Frameworks are lipo'd, stripped and signed in place after they are copied, so
+  the copy is a clone or a real copy but never a hardlink.
+  """
   assert_file(source_path, 'file to copy')
-  shutil.copy2(source_path, destination_path)
+  copy_strategy.copy_file(source_path, destination_path, preserve_times=True)
 
 
 def copy_tree(source_path, destination_path, symlinks=False):
@@ -135,7 +142,7 @@ def copy_tree(source_path, destination_path, symlinks=False):
   present, it is deleted first."""
   assert_directory(source_path, 'directory to copy')
   shutil.rmtree(destination_path, True)
-  shutil.copytree(source_path, destination_path, symlinks=symlinks)
+  copy_strategy.copy_tree(source_path, destination_path, preserve_times=True, symlinks=symlinks)
 
 
 def create_fat_macos_framework(args, dst, fat_framework, arm64_framework, x64_framework):
@@ -270,7 +277,7 @@ def log_error_items(items):
 def strip_binary(binary_path, unstripped_copy_path):
   """Makes a copy of an unstripped binary, then strips symbols from the binary."""
   assert_file(binary_path, 'binary to strip')
-  shutil.copyfile(binary_path, unstripped_copy_path)
+  copy_strategy.copy_file(binary_path, unstripped_copy_path)
   subprocess.check_call(['strip', '-x', '-S', binary_path])
 
 
@@ -234,7 +234,8 @@ def build_engine_executable_command(
   if coverage:
     coverage_flags = [
         '-t', executable, '-o',
-        os.path.join(build_dir, 'coverage', executable_name), '-f', 'html'
+        os.path.join(build_dir, 'coverage', executable_name), '-f', 'html', '--cache-dir',
+        os.path.join(build_dir, 'coverage', 'profile_cache')
     ]
     updated_flags = ['--args=%s' % ' '.join(flags)]
     test_command = [coverage_script] + coverage_flags + updated_flags
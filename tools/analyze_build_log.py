@@ -0,0 +1,361 @@
+#!/usr/bin/env python3
+#
+# Copyright 2013 The Flutter Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+#
+# Summarizes where the time in the last build of an out directory went.
+#
+# Reads <out>/.ninja_log and, when present, the <out>/gn_trace.json that
+# tools/gn asks GN to write, and reports:
+#
+#   * the critical path: the chain of actions that bounded the build's wall
+#     time,
+#   * the actions that serialized the build, i.e. ran while nothing else could,
+#   * cumulative and parallel-weighted time per GN target and per step type.
+#
+# With --trace it also writes a Chrome trace (chrome://tracing, Perfetto) of
+# the build with one row per concurrently running action.
+#
+# Usage:
+#
+#   ./flutter/tools/analyze_build_log.py out/host_debug_unopt
+#   ./flutter/tools/analyze_build_log.py out/host_debug_unopt --trace build_trace.json
+
+import argparse
+import bisect
+import collections
+import json
+import os
+import re
+import sys
+
+NINJA_LOG = '.ninja_log'
+GN_TRACE = 'gn_trace.json'
+
+# Ninja stores one line per output; all outputs of an edge share its timing
+# and command hash.
+Edge = collections.namedtuple('Edge', ['start', 'end', 'outputs', 'command_hash'])
+
+# obj/<dir>/<target>.<source>.o, the layout GN uses for compiled sources.
+OBJECT_PATTERN = re.compile(r'^obj/(?:(.*)/)?([^/.]+)\.[^/]+\.o(?:bj)?$')
+
+
+class BuildLogError(Exception):
+  pass
+
+
+def duration(edge):
+  return edge.end - edge.start
+
+
+def read_ninja_log(path):
+  """Returns the edges of the last build recorded in the ninja log at |path|.
+
+  Ninja appends to its log on every build and writes entries in the order
+  actions finish, so a build starts wherever the end times go backwards.
+  """
+  with open(path, 'r') as log:
+    header = log.readline()
+    match = re.match(r'# ninja log v(\d+)', header)
+    if not match or int(match.group(1)) < 5:
+      raise BuildLogError('%s: unsupported ninja log format: %r' % (path, header.strip()))
+    builds = [[]]
+    last_end = 0
+    for line in log:
+      fields = line.rstrip('\n').split('\t')
+      if len(fields) != 5:
+        continue
+      start, end, _, output, command_hash = fields
+      start, end = int(start), int(end)
+      if end < last_end:
+        builds.append([])
+      last_end = end
+      builds[-1].append((start, end, output, command_hash))
+
+  # An output rebuilt during the build is logged again; keep its last run.
+  entries = collections.OrderedDict()
+  for start, end, output, command_hash in builds[-1]:
+    entries.pop(output, None)
+    entries[output] = (start, end, command_hash)
+
+  edges = collections.OrderedDict()
+  for output, (start, end, command_hash) in entries.items():
+    key = (start, end, command_hash)
+    if key not in edges:
+      edges[key] = []
+    edges[key].append(output)
+  return [
+      Edge(start, end, tuple(sorted(outputs)), command_hash)
+      for (start, end, command_hash), outputs in edges.items()
+  ]
+
+
+def read_gn_trace(path):
+  """Returns the complete ("X") events of the GN trace at |path|."""
+  with open(path, 'r') as trace_file:
+    trace = json.load(trace_file)
+  if isinstance(trace, dict):
+    trace = trace.get('traceEvents', [])
+  return [event for event in trace if event.get('ph') == 'X' and 'dur' in event]
+
+
+def target_for_output(output):
+  """Returns the GN label, or the closest thing to one, that produced |output|."""
+  match = OBJECT_PATTERN.match(output)
+  if match:
+    return '//%s:%s' % (match.group(1) or '', match.group(2))
+  directory = os.path.dirname(output)
+  for prefix in ('gen/', 'obj/'):
+    if directory.startswith(prefix):
+      return '//' + directory[len(prefix):]
+  return output
+
+
+def step_type(output):
+  """Returns the extension that names the kind of action that wrote |output|."""
+  name = os.path.basename(output)
+  extension = os.path.splitext(name)[1]
+  return extension if extension else '(no extension)'
+
+
+def weighted_durations(edges):
+  """Returns each edge's parallel-weighted time and the time it ran alone.
+
+  The weighted time charges every moment of the build to the actions
+  running at that moment, split evenly between them, so the weighted times
+  add up to the build's wall time.
+  """
+  events = []
+  for index, edge in enumerate(edges):
+    events.append((edge.start, 1, index))
+    events.append((edge.end, 0, index))
+  # Ends sort before starts at the same instant so back-to-back actions do
+  # not count as overlapping.
+  events.sort()
+
+  weighted = [0.0] * len(edges)
+  alone = [0] * len(edges)
+  running = set()
+  last_time = events[0][0] if events else 0
+  for time, is_start, index in events:
+    if running and time > last_time:
+      share = (time - last_time) / len(running)
+      for running_index in running:
+        weighted[running_index] += share
+      if len(running) == 1:
+        alone[next(iter(running))] += time - last_time
+    last_time = time
+    if is_start:
+      running.add(index)
+    else:
+      running.discard(index)
+  return weighted, alone
+
+
+def critical_path(edges):
+  """Returns the chain of edges that bounded the build, first to last.
+
+  The ninja log does not record dependencies, so the chain is inferred from
+  timing: ninja starts an action as soon as its last input is ready, so the
+  action that finished most recently before another one started is taken to
+  be what it was waiting on.
+  """
+  if not edges:
+    return []
+  by_end = sorted(edges, key=lambda edge: (edge.end, duration(edge)))
+  ends = [edge.end for edge in by_end]
+  position = len(by_end) - 1
+  path = [by_end[position]]
+  while True:
+    # The latest edge, before the current one, that finished no later than
+    # the current one started. Ties go to the longest such edge.
+    position = bisect.bisect_right(ends, by_end[position].start, 0, position)
+    if position == 0:
+      break
+    position -= 1
+    path.append(by_end[position])
+  path.reverse()
+  return path
+
+
+def assign_rows(edges):
+  """Assigns every edge the lowest row that is free when it starts."""
+  rows = {}
+  row_ends = []
+  for edge in sorted(edges, key=lambda edge: (edge.start, -duration(edge))):
+    for row, row_end in enumerate(row_ends):
+      if row_end <= edge.start:
+        break
+    else:
+      row = len(row_ends)
+      row_ends.append(0)
+    row_ends[row] = edge.end
+    rows[edge] = row
+  return rows
+
+
+def summarize(edges, top=20):
+  """Returns the report for |edges| as a JSON-serializable dictionary."""
+  weighted, alone = weighted_durations(edges)
+  start = min((edge.start for edge in edges), default=0)
+  end = max((edge.end for edge in edges), default=0)
+
+  def group_by(key):
+    groups = collections.defaultdict(lambda: {'count': 0, 'cumulative_ms': 0, 'weighted_ms': 0.0})
+    for index, edge in enumerate(edges):
+      group = groups[key(edge.outputs[0])]
+      group['count'] += 1
+      group['cumulative_ms'] += duration(edge)
+      group['weighted_ms'] += weighted[index]
+    ordered = sorted(groups.items(), key=lambda item: (-item[1]['weighted_ms'], item[0]))
+    return [dict(name=name, **values) for name, values in ordered[:top]]
+
+  def describe(index):
+    edge = edges[index]
+    return {
+        'output': edge.outputs[0],
+        'start_ms': edge.start,
+        'end_ms': edge.end,
+        'duration_ms': duration(edge),
+        'weighted_ms': weighted[index],
+        'serial_ms': alone[index],
+    }
+
+  indices = {edge: index for index, edge in enumerate(edges)}
+  path = critical_path(edges)
+  serial = [index for index in range(len(edges)) if alone[index] > 0]
+  serial.sort(key=lambda index: (-alone[index], edges[index].outputs[0]))
+  slowest = sorted(range(len(edges)), key=lambda index: (-duration(edges[index]), index))
+  return {
+      'actions': len(edges),
+      'wall_ms': end - start,
+      'cumulative_ms': sum(duration(edge) for edge in edges),
+      'critical_path_ms': sum(duration(edge) for edge in path),
+      'critical_path': [describe(indices[edge]) for edge in path],
+      'serial_ms': sum(alone),
+      'serializing_actions': [describe(index) for index in serial[:top]],
+      'slowest_actions': [describe(index) for index in slowest[:top]],
+      'targets': group_by(target_for_output),
+      'step_types': group_by(step_type),
+  }
+
+
+def to_chrome_trace(edges, gn_events=None):
+  """Returns a Chrome trace of the build, with GN's own trace as a separate process."""
+  rows = assign_rows(edges)
+  events = [{
+      'name': 'process_name',
+      'ph': 'M',
+      'pid': 1,
+      'args': {'name': 'ninja'},
+  }]
+  for edge in sorted(edges, key=lambda edge: (edge.start, rows[edge])):
+    events.append({
+        'name': edge.outputs[0],
+        'cat': step_type(edge.outputs[0]),
+        'ph': 'X',
+        'ts': edge.start * 1000,
+        'dur': duration(edge) * 1000,
+        'pid': 1,
+        'tid': rows[edge],
+        'args': {'outputs': list(edge.outputs), 'target': target_for_output(edge.outputs[0])},
+    })
+  if gn_events:
+    # GN runs before ninja, on its own clock; start its events at zero.
+    origin = min(event['ts'] for event in gn_events)
+    events.append({'name': 'process_name', 'ph': 'M', 'pid': 0, 'args': {'name': 'gn gen'}})
+    for event in gn_events:
+      event = dict(event, pid=0, ts=event['ts'] - origin)
+      events.append(event)
+  return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+
+def format_seconds(milliseconds):
+  return '%8.1fs' % (milliseconds / 1000.0)
+
+
+def print_report(report, gn_events, file=sys.stdout):
+  print(
+      '%d actions, wall time %s, cumulative %s, critical path %s, serial %s' % (
+          report['actions'],
+          format_seconds(report['wall_ms']).strip(),
+          format_seconds(report['cumulative_ms']).strip(),
+          format_seconds(report['critical_path_ms']).strip(),
+          format_seconds(report['serial_ms']).strip(),
+      ),
+      file=file
+  )
+  if gn_events:
+    gn_start = min(event['ts'] for event in gn_events)
+    gn_wall = max(event['ts'] + event['dur'] for event in gn_events) - gn_start
+    print('gn gen: %s' % format_seconds(gn_wall / 1000.0).strip(), file=file)
+
+  print('\nCritical path:', file=file)
+  for action in report['critical_path']:
+    print('  %s  %s' % (format_seconds(action['duration_ms']), action['output']), file=file)
+
+  print('\nActions that ran alone (time with nothing else running):', file=file)
+  for action in report['serializing_actions']:
+    print('  %s  %s' % (format_seconds(action['serial_ms']), action['output']), file=file)
+
+  print('\nSlowest actions:', file=file)
+  for action in report['slowest_actions']:
+    print('  %s  %s' % (format_seconds(action['duration_ms']), action['output']), file=file)
+
+  for title, key in (('Targets', 'targets'), ('Step types', 'step_types')):
+    print('\n%s (weighted, cumulative, count):' % title, file=file)
+    for group in report[key]:
+      print(
+          '  %s %s %6d  %s' % (
+              format_seconds(group['weighted_ms']),
+              format_seconds(group['cumulative_ms']),
+              group['count'],
+              group['name'],
+          ),
+          file=file
+      )
+
+
+def main(argv):
+  parser = argparse.ArgumentParser(description='Analyzes the last build of an out directory.')
+  parser.add_argument('out_dir', help='The build directory, e.g. out/host_debug_unopt.')
+  parser.add_argument(
+      '--top', type=int, default=20, help='The number of entries to show in each list.'
+  )
+  parser.add_argument('--trace', help='Write a Chrome trace of the build to this path.')
+  parser.add_argument(
+      '--json', action='store_true', help='Print the report as JSON instead of text.'
+  )
+  args = parser.parse_args(argv)
+
+  log_path = os.path.join(args.out_dir, NINJA_LOG)
+  if not os.path.isfile(log_path):
+    print('No %s in %s; build it first.' % (NINJA_LOG, args.out_dir), file=sys.stderr)
+    return 1
+  try:
+    edges = read_ninja_log(log_path)
+  except BuildLogError as error:
+    print(error, file=sys.stderr)
+    return 1
+
+  gn_events = []
+  gn_trace_path = os.path.join(args.out_dir, GN_TRACE)
+  if os.path.isfile(gn_trace_path):
+    gn_events = read_gn_trace(gn_trace_path)
+
+  report = summarize(edges, args.top)
+  if args.json:
+    json.dump(report, sys.stdout, indent=2)
+    print()
+  else:
+    print_report(report, gn_events)
+
+  if args.trace:
+    with open(args.trace, 'w') as trace_file:
+      json.dump(to_chrome_trace(edges, gn_events), trace_file)
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+#
+# Copyright 2013 The Flutter Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import analyze_build_log
+
+# Two builds: the first one is superseded by the second, where a.o and b.o
+# compile in parallel, then libfoo.so links alone, then a snapshot and a stamp
+# run side by side.
+NINJA_LOG = """# ninja log v5
+0\t500\t0\tobj/stale/stale.x.o\t1
+0\t100\t0\tobj/flutter/fml/fml.a.o\taaa
+0\t300\t0\tobj/flutter/fml/fml.b.o\tbbb
+300\t700\t0\tlibfoo.so\tccc
+300\t700\t0\tlibfoo.so.TOC\tccc
+700\t800\t0\tgen/flutter/lib/stamp\tddd
+700\t1000\t0\tgen/flutter/lib/snapshot.bin\teee
+"""
+
+
+class AnalyzeBuildLogTest(unittest.TestCase):
+
+  def setUp(self):
+    self.out_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.out_dir)
+    with open(os.path.join(self.out_dir, '.ninja_log'), 'w') as log:
+      log.write(NINJA_LOG)
+    self.edges = analyze_build_log.read_ninja_log(os.path.join(self.out_dir, '.ninja_log'))
+
+  def test_reads_last_build(self):
+    self.assertEqual(len(self.edges), 5)
+    self.assertIn(('libfoo.so', 'libfoo.so.TOC'), [edge.outputs for edge in self.edges])
+    self.assertNotIn(('obj/stale/stale.x.o',), [edge.outputs for edge in self.edges])
+
+  def test_summarize(self):
+    report = analyze_build_log.summarize(self.edges)
+    self.assertEqual(report['wall_ms'], 1000)
+    self.assertEqual(report['cumulative_ms'], 1200)
+    self.assertEqual([action['output'] for action in report['critical_path']],
+                     ['obj/flutter/fml/fml.b.o', 'libfoo.so', 'gen/flutter/lib/snapshot.bin'])
+    self.assertEqual(report['critical_path_ms'], 1000)
+    # libfoo.so and the end of fml.b.o and snapshot.bin had the build to themselves.
+    serializing = [
+        (action['output'], action['serial_ms']) for action in report['serializing_actions']
+    ]
+    self.assertEqual(
+        serializing, [
+            ('libfoo.so', 400),
+            ('gen/flutter/lib/snapshot.bin', 200),
+            ('obj/flutter/fml/fml.b.o', 200),
+        ]
+    )
+    weighted = sum(group['weighted_ms'] for group in report['targets'])
+    self.assertAlmostEqual(weighted, report['wall_ms'])
+    self.assertEqual(report['targets'][0]['name'], 'libfoo.so')
+    self.assertIn('//flutter/fml:fml', [group['name'] for group in report['targets']])
+
+  def test_chrome_trace(self):
+    gn_events = [{'name': 'Load //BUILD.gn', 'ph': 'X', 'ts': 5000, 'dur': 20, 'pid': 7}]
+    trace = analyze_build_log.to_chrome_trace(self.edges, gn_events)
+    ninja_events = [
+        event for event in trace['traceEvents'] if event['ph'] == 'X' and event['pid'] == 1
+    ]
+    self.assertEqual(len(ninja_events), 5)
+    # Overlapping actions never share a row.
+    self.assertEqual(
+        sorted(event['tid'] for event in ninja_events if event['ts'] < 300 * 1000), [0, 1]
+    )
+    gn_event = [event for event in trace['traceEvents'] if event['ph'] == 'X' and event['pid'] == 0]
+    self.assertEqual(gn_event[0]['ts'], 0)
+
+  def test_main(self):
+    trace_path = os.path.join(self.out_dir, 'trace.json')
+    self.assertEqual(analyze_build_log.main([self.out_dir, '--json', '--trace', trace_path]), 0)
+    self.assertTrue(os.path.isfile(trace_path))
+
+
+if __name__ == '__main__':
+  unittest.main()
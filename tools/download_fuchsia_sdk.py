@@ -5,18 +5,45 @@
 
 # The return code of this script will always be 0, even if there is an error,
 # unless the --fail-loudly flag is passed.
+#
+# The SDK archive is extracted while it downloads. The archive is kept next to
+# the SDK with a record of its checksum, so a later run for the same SDK path
+# reuses it, and an interrupted download is resumed. Running again with the
+# same --fuchsia-sdk-path once the SDK is extracted does nothing.
 
 import argparse
-import tarfile
+import base64
+import concurrent.futures
+import hashlib
+import http.client
 import json
 import os
 import shutil
 import subprocess
 import sys
+import tarfile
+import time
+import urllib.error
+import urllib.request
 
 SRC_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 FUCHSIA_SDK_DIR = os.path.join(SRC_ROOT, 'fuchsia', 'sdk')
 FLUTTER_DIR = os.path.join(SRC_ROOT, 'flutter')
+GCS_BASE_URL = 'https://storage.googleapis.com/fuchsia-artifacts'
+
+CHUNK_SIZE = 1 << 20
+DOWNLOAD_RETRIES = 3
+URL_TIMEOUT = 60
+
+RECORD_VERSION = 1
+RECORD_SUFFIX = '.json'
+PARTIAL_SUFFIX = '.partial'
+# Records which SDK path an extracted SDK came from.
+SDK_STAMP = '.download_stamp.json'
+
+
+class DownloadError(Exception):
+  pass
 
 
 # Prints to stderr.
@@ -28,54 +55,186 @@ def FileNameForSdkPath(sdk_path):
   return sdk_path.split('/')[-1]
 
 
-def DownloadFuchsiaSDKFromGCS(sdk_path, verbose):
-  file = FileNameForSdkPath(sdk_path)
-  url = 'https://storage.googleapis.com/fuchsia-artifacts/{}'.format(sdk_path)
-  dest = os.path.join(FUCHSIA_SDK_DIR, file)
-
-  if verbose:
-    print('Fuchsia SDK url: "%s"' % url)
-    print('Fuchsia SDK destination path: "%s"' % dest)
-
-  if os.path.isfile(dest):
-    os.unlink(dest)
-
-  # Ensure destination folder exists.
-  os.makedirs(FUCHSIA_SDK_DIR, exist_ok=True)
-  curl_command = [
-      'curl',
-      '--retry',
-      '3',
-      '--continue-at',
-      '-',
-      '--location',
-      '--output',
-      dest,
-      url,
-  ]
-  if verbose:
-    print('Running: "%s"' % (' '.join(curl_command)))
-  curl_result = subprocess.run(
-      curl_command,
-      stdout=subprocess.PIPE,
-      stderr=subprocess.PIPE,
-      universal_newlines=True,
-  )
-  if curl_result.returncode == 0 and verbose:
-    print('curl output:stdout:\n{}\nstderr:\n{}'.format(
-        curl_result.stdout,
-        curl_result.stderr,
-    ))
-  elif curl_result.returncode != 0:
-    eprint(
-        'Failed to download: stdout:\n{}\nstderr:\n{}'.format(
-            curl_result.stdout,
-            curl_result.stderr,
-        )
-    )
+def ReadRecord(path):
+  """Returns the JSON record at |path|, or None if it is missing or from another version."""
+  try:
+    with open(path) as f:
+      record = json.load(f)
+  except (OSError, ValueError):
+    return None
+  if not isinstance(record, dict) or record.get('version') != RECORD_VERSION:
+    return None
+  return record
+
+
+def WriteRecord(path, **fields):
+  fields['version'] = RECORD_VERSION
+  temp_path = path + '.tmp'
+  with open(temp_path, 'w') as f:
+    json.dump(fields, f, sort_keys=True)
+  os.replace(temp_path, path)
+
+
+def RemoveIfExists(path):
+  try:
+    os.unlink(path)
+  except FileNotFoundError:
+    pass
+
+
+def HashFile(path):
+  sha256 = hashlib.sha256()
+  with open(path, 'rb') as f:
+    for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+      sha256.update(chunk)
+  return sha256.hexdigest()
+
+
+def IsCachedArchiveValid(archive, sdk_path):
+  """Whether |archive| is a complete download of |sdk_path| that still matches its checksum."""
+  record = ReadRecord(archive + RECORD_SUFFIX)
+  if record is None or record.get('sdk_path') != sdk_path or not os.path.isfile(archive):
+    return False
+  return HashFile(archive) == record.get('sha256')
+
+
+def IsSdkUpToDate(sdk_dest, sdk_path):
+  record = ReadRecord(os.path.join(sdk_dest, SDK_STAMP))
+  return record is not None and record.get('sdk_path') == sdk_path
+
+
+def ParseGoogHash(header):
+  """Returns the hex MD5 in an x-goog-hash header like 'crc32c=...,md5=...', or None."""
+  for part in header.split(','):
+    name, _, value = part.strip().partition('=')
+    if name == 'md5':
+      try:
+        return base64.b64decode(value).hex()
+      except ValueError:
+        return None
+  return None
+
+
+def _ContentRangeStart(response):
+  # Content-Range: bytes <start>-<end>/<size>
+  content_range = response.headers.get('Content-Range', '')
+  try:
+    return int(content_range.split()[1].split('-')[0])
+  except (IndexError, ValueError):
     return None
 
-  return dest
+
+def _OpenArchiveUrl(url, offset, etag):
+  headers = {}
+  if offset:
+    headers['Range'] = 'bytes=%d-' % offset
+    if etag:
+      # Sends the whole archive instead of the rest of it if it has changed.
+      headers['If-Range'] = etag
+  request = urllib.request.Request(url, headers=headers)
+  return urllib.request.urlopen(request, timeout=URL_TIMEOUT)
+
+
+def DownloadArchive(url, archive, sdk_path, sink, verbose, retry_delay=1.0):
+  """Downloads |url| to |archive|, writing the archive to |sink| as it arrives.
+
+  The download goes to |archive|.partial first. A partial download of the same
+  |sdk_path|, left by an earlier run or by a dropped connection, is resumed
+  with a range request, and the bytes that were already downloaded are replayed
+  into |sink| so that it always sees the whole archive. If |sink| stops
+  reading, the download still completes so that the archive is cached for the
+  next run. Returns the SHA-256 of the archive.
+  """
+  partial = archive + PARTIAL_SUFFIX
+  record_path = partial + RECORD_SUFFIX
+  record = ReadRecord(record_path)
+  if record is None or record.get('sdk_path') != sdk_path or not os.path.isfile(partial):
+    record = {}
+    RemoveIfExists(partial)
+  etag = record.get('etag')
+  expected_md5 = record.get('md5')
+  sha256 = hashlib.sha256()
+  md5 = hashlib.md5()
+
+  def Consume(chunk):
+    nonlocal sink
+    sha256.update(chunk)
+    md5.update(chunk)
+    if sink is not None:
+      try:
+        sink.write(chunk)
+      except OSError:
+        # The reader has gone away, most likely because extracting failed.
+        sink = None
+
+  # |offset| bytes of the archive are in |partial|, the first |streamed| of
+  # which went to |sink|.
+  offset = os.path.getsize(partial) if record else 0
+  streamed = 0
+  failures = 0
+  with open(partial, 'ab') as output:
+    while True:
+      try:
+        with _OpenArchiveUrl(url, offset, etag) as response:
+          if response.status == 206:
+            if _ContentRangeStart(response) != offset:
+              raise DownloadError('%s sent an unexpected range' % url)
+          elif offset:
+            # The server sent the whole archive, so it can't resume this download.
+            if streamed:
+              raise DownloadError('%s changed while it was downloading' % url)
+            output.truncate(0)
+            offset = 0
+          etag = response.headers.get('ETag') or etag
+          goog_hash = ','.join(response.headers.get_all('x-goog-hash') or [])
+          expected_md5 = ParseGoogHash(goog_hash) or expected_md5
+          WriteRecord(record_path, sdk_path=sdk_path, etag=etag, md5=expected_md5)
+
+          if streamed < offset:
+            if verbose:
+              print('Resuming the download of "%s" at byte %d' % (url, offset))
+            with open(partial, 'rb') as existing:
+              for chunk in iter(lambda: existing.read(min(CHUNK_SIZE, offset - streamed)), b''):
+                Consume(chunk)
+                streamed += len(chunk)
+          content_length = response.headers.get('Content-Length')
+          end = offset + int(content_length) if content_length else None
+          for chunk in iter(lambda: response.read(CHUNK_SIZE), b''):
+            output.write(chunk)
+            offset += len(chunk)
+            Consume(chunk)
+            streamed = offset
+          # Reads of a dropped connection just come up short.
+          if end is not None and offset < end:
+            raise http.client.IncompleteRead(b'', end - offset)
+        break
+      except urllib.error.HTTPError as error:
+        if error.code == 416 and offset and not streamed:
+          # The partial download can't be resumed, so start it again.
+          output.truncate(0)
+          offset = 0
+          continue
+        if error.code < 500:
+          raise DownloadError('Failed to download %s: %s' % (url, error)) from None
+        failure = error
+      except (OSError, http.client.HTTPException) as error:
+        failure = error
+      failures += 1
+      if failures > DOWNLOAD_RETRIES:
+        raise DownloadError('Failed to download %s: %s' % (url, failure))
+      if verbose:
+        print('Retrying the download of "%s" after: %s' % (url, failure))
+      output.flush()
+      time.sleep(retry_delay * failures)
+
+  if expected_md5 and md5.hexdigest() != expected_md5:
+    RemoveIfExists(partial)
+    RemoveIfExists(record_path)
+    raise DownloadError('%s does not match its MD5 checksum' % url)
+  os.replace(partial, archive)
+  WriteRecord(archive + RECORD_SUFFIX, sdk_path=sdk_path, sha256=sha256.hexdigest())
+  RemoveIfExists(record_path)
+  return sha256.hexdigest()
 
 
 def OnErrorRmTree(func, path, exc_info):
@@ -97,22 +256,107 @@ def OnErrorRmTree(func, path, exc_info):
     raise
 
 
-def ExtractGzipArchive(archive, host_os, verbose):
-  sdk_dest = os.path.join(FUCHSIA_SDK_DIR, host_os)
-  if os.path.isdir(sdk_dest):
-    shutil.rmtree(sdk_dest, onerror=OnErrorRmTree)
+def _Drain(stream):
+  while stream.read(CHUNK_SIZE):
+    pass
 
-  extract_dest = os.path.join(FUCHSIA_SDK_DIR, 'temp')
-  if os.path.isdir(extract_dest):
-    shutil.rmtree(extract_dest, onerror=OnErrorRmTree)
-  os.makedirs(extract_dest, exist_ok=True)
 
-  if verbose:
-    print('Extracting "%s" to "%s"' % (archive, extract_dest))
+def ExtractTarStream(stream, extract_dest, pigz=None):
+  """Extracts the gzipped tar read from |stream| into |extract_dest|.
 
-  with tarfile.open(archive, 'r') as z:
-    z.extractall(extract_dest)
+  Reads |stream| to its end. With the path to |pigz|, decompresses in a pigz
+  process instead of in Python.
+  """
+  if pigz is None:
+    with tarfile.open(fileobj=stream, mode='r|gz') as tar:
+      tar.extractall(extract_dest)
+    _Drain(stream)
+    return
+
+  pigz_command = [pigz, '--decompress', '--stdout']
+  process = subprocess.Popen(pigz_command, stdin=stream, stdout=subprocess.PIPE)
+  # Only pigz reads |stream| from now on, so a writer sees it if pigz exits.
+  stream.close()
+  try:
+    with tarfile.open(fileobj=process.stdout, mode='r|') as tar:
+      tar.extractall(extract_dest)
+    _Drain(process.stdout)
+  finally:
+    process.stdout.close()
+    returncode = process.wait()
+  if returncode != 0:
+    raise subprocess.CalledProcessError(returncode, pigz)
+
+
+def _DownloadAndExtract(url, archive, sdk_path, extract_dest, pigz, verbose, retry_delay):
+  read_fd, write_fd = os.pipe()
+  sink = os.fdopen(write_fd, 'wb')
+
+  def Download():
+    try:
+      return DownloadArchive(url, archive, sdk_path, sink, verbose, retry_delay)
+    finally:
+      try:
+        sink.close()
+      except OSError:
+        pass
+
+  with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+    download = executor.submit(Download)
+    try:
+      with os.fdopen(read_fd, 'rb') as stream:
+        ExtractTarStream(stream, extract_dest, pigz)
+    finally:
+      # A failed download truncates the stream, so its error explains any
+      # extraction error. Otherwise this waits for the archive to be cached.
+      sha256 = download.result()
+  return sha256
+
+
+def FetchFuchsiaSdk(
+    sdk_path,
+    host_os,
+    verbose,
+    base_url=GCS_BASE_URL,
+    sdk_dir=FUCHSIA_SDK_DIR,
+    pigz=None,
+    retry_delay=1.0,
+):
+  """Downloads the SDK at |sdk_path| and extracts it to |sdk_dir|/|host_os|.
+
+  Does nothing if that SDK is already there. A cached archive that still
+  matches its checksum is extracted without downloading it again; otherwise
+  the archive is extracted as it downloads.
+  """
+  sdk_dest = os.path.join(sdk_dir, host_os)
+  if IsSdkUpToDate(sdk_dest, sdk_path):
+    if verbose:
+      print('Fuchsia SDK "%s" is already in "%s"' % (sdk_path, sdk_dest))
+    return
+
+  url = '{}/{}'.format(base_url, sdk_path)
+  archive = os.path.join(sdk_dir, FileNameForSdkPath(sdk_path))
+  extract_dest = os.path.join(sdk_dir, 'temp')
+  if os.path.isdir(extract_dest):
+    shutil.rmtree(extract_dest, onerror=OnErrorRmTree)
+  os.makedirs(extract_dest)
+
+  if IsCachedArchiveValid(archive, sdk_path):
+    if verbose:
+      print('Extracting cached "%s" to "%s"' % (archive, extract_dest))
+    with open(archive, 'rb') as stream:
+      ExtractTarStream(stream, extract_dest, pigz)
+    sha256 = ReadRecord(archive + RECORD_SUFFIX)['sha256']
+  else:
+    RemoveIfExists(archive + RECORD_SUFFIX)
+    RemoveIfExists(archive)
+    if verbose:
+      print('Downloading "%s" to "%s" and extracting it to "%s"' % (url, archive, extract_dest))
+    sha256 = _DownloadAndExtract(url, archive, sdk_path, extract_dest, pigz, verbose, retry_delay)
 
+  WriteRecord(os.path.join(extract_dest, SDK_STAMP), sdk_path=sdk_path, sha256=sha256)
+  if os.path.isdir(sdk_dest):
+    shutil.rmtree(sdk_dest, onerror=OnErrorRmTree)
   shutil.move(extract_dest, sdk_dest)
 
 
@@ -136,6 +380,13 @@ def Main():
 
   parser.add_argument('--fuchsia-sdk-path', help='The path in gcs to the fuchsia sdk to download')
 
+  parser.add_argument(
+      '--no-pigz',
+      action='store_true',
+      default=False,
+      help='Decompress the sdk in Python even if pigz is available'
+  )
+
   args = parser.parse_args()
   fail_loudly = 1 if args.fail_loudly else 0
   verbose = args.verbose
@@ -146,15 +397,14 @@ def Main():
     eprint('sdk_path can not be empty')
     return fail_loudly
 
-  archive = DownloadFuchsiaSDKFromGCS(fuchsia_sdk_path, verbose)
-  if archive is None:
-    eprint('Failed to download SDK from %s' % fuchsia_sdk_path)
+  pigz = None if args.no_pigz else shutil.which('pigz')
+  try:
+    FetchFuchsiaSdk(fuchsia_sdk_path, host_os, verbose, pigz=pigz)
+  except (DownloadError, OSError, tarfile.TarError, subprocess.CalledProcessError) as error:
+    eprint('Failed to download and extract SDK from %s: %s' % (fuchsia_sdk_path, error))
     return fail_loudly
 
-  ExtractGzipArchive(archive, host_os, verbose)
-
-  success = True
-  return 0 if success else fail_loudly
+  return 0
 
 
 if __name__ == '__main__':
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+#
+# Copyright 2013 The Flutter Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import base64
+import hashlib
+import http.server
+import io
+import os
+import random
+import shutil
+import tarfile
+import tempfile
+import threading
+import unittest
+
+import download_fuchsia_sdk
+
+SDK_PATH = 'development/1234/sdk/linux-amd64/core.tar.gz'
+
+
+def MakeArchive(files):
+  data = io.BytesIO()
+  with tarfile.open(fileobj=data, mode='w:gz') as tar:
+    for name, contents in sorted(files.items()):
+      info = tarfile.TarInfo(name)
+      info.size = len(contents)
+      tar.addfile(info, io.BytesIO(contents))
+  return data.getvalue()
+
+
+class ArchiveServer(http.server.ThreadingHTTPServer):
+  """Serves one archive like GCS does, with ranges, an ETag and an MD5 hash."""
+
+  def __init__(self, archive):
+    super().__init__(('127.0.0.1', 0), ArchiveHandler)
+    self.archive = archive
+    self.md5 = None
+    self.requests = []
+    # Connections are dropped after this many bytes of the body, once each.
+    self.drop_after = []
+    self.supports_ranges = True
+
+  @property
+  def base_url(self):
+    return 'http://127.0.0.1:%d' % self.server_address[1]
+
+  @property
+  def etag(self):
+    return '"%s"' % hashlib.sha256(self.archive).hexdigest()
+
+
+class ArchiveHandler(http.server.BaseHTTPRequestHandler):
+
+  def do_GET(self):
+    server = self.server
+    server.requests.append((self.path, self.headers.get('Range')))
+    if self.path != '/' + SDK_PATH:
+      self.send_error(404)
+      return
+
+    archive = server.archive
+    start = 0
+    requested_range = self.headers.get('Range')
+    if (requested_range and server.supports_ranges and
+        self.headers.get('If-Range', server.etag) == server.etag):
+      start = int(requested_range[len('bytes='):].rstrip('-'))
+      if start >= len(archive):
+        self.send_error(416)
+        return
+      self.send_response(206)
+      self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, len(archive) - 1, len(archive)))
+    else:
+      self.send_response(200)
+    md5 = server.md5 or hashlib.md5(archive).digest()
+    self.send_header('x-goog-hash', 'crc32c=AAAAAA==')
+    self.send_header('x-goog-hash', 'md5=' + base64.b64encode(md5).decode())
+    self.send_header('ETag', server.etag)
+    self.send_header('Content-Length', str(len(archive) - start))
+    self.end_headers()
+
+    body = archive[start:]
+    if server.drop_after:
+      body = body[:server.drop_after.pop(0)]
+    self.wfile.write(body)
+
+  def log_message(self, *args):
+    pass
+
+
+class DownloadFuchsiaSdkTest(unittest.TestCase):
+
+  def setUp(self):
+    self.temp_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.temp_dir)
+    self.sdk_dir = os.path.join(self.temp_dir, 'sdk')
+    os.makedirs(self.sdk_dir)
+
+    random.seed(0)
+    self.files = {
+        'meta/manifest.json': b'{"id": "1234"}',
+        'tools/x64/ffx': bytes(random.getrandbits(8) for _ in range(400000)),
+    }
+    self.server = ArchiveServer(MakeArchive(self.files))
+    thread = threading.Thread(target=self.server.serve_forever)
+    thread.start()
+    self.addCleanup(thread.join)
+    self.addCleanup(self.server.server_close)
+    self.addCleanup(self.server.shutdown)
+
+  def Fetch(self, sdk_path=SDK_PATH, pigz=None):
+    download_fuchsia_sdk.FetchFuchsiaSdk(
+        sdk_path,
+        'linux',
+        False,
+        base_url=self.server.base_url,
+        sdk_dir=self.sdk_dir,
+        pigz=pigz,
+        retry_delay=0,
+    )
+
+  def AssertSdkExtracted(self):
+    sdk_dest = os.path.join(self.sdk_dir, 'linux')
+    for name, contents in self.files.items():
+      with open(os.path.join(sdk_dest, name), 'rb') as f:
+        self.assertEqual(f.read(), contents)
+    self.assertTrue(download_fuchsia_sdk.IsSdkUpToDate(sdk_dest, SDK_PATH))
+    self.assertFalse(os.path.exists(os.path.join(self.sdk_dir, 'temp')))
+
+  def test_download_and_rerun(self):
+    self.Fetch()
+    self.AssertSdkExtracted()
+    self.assertEqual(self.server.requests, [('/' + SDK_PATH, None)])
+    self.assertEqual(sorted(os.listdir(self.sdk_dir)), ['core.tar.gz', 'core.tar.gz.json', 'linux'])
+
+    # The same SDK path is already extracted.
+    self.Fetch()
+    self.assertEqual(len(self.server.requests), 1)
+
+  def test_reuses_valid_cached_archive(self):
+    self.Fetch()
+    shutil.rmtree(os.path.join(self.sdk_dir, 'linux'))
+    self.Fetch()
+    self.AssertSdkExtracted()
+    self.assertEqual(len(self.server.requests), 1)
+
+    # A corrupted archive is downloaded again.
+    shutil.rmtree(os.path.join(self.sdk_dir, 'linux'))
+    with open(os.path.join(self.sdk_dir, 'core.tar.gz'), 'r+b') as f:
+      f.write(b'corrupt')
+    self.Fetch()
+    self.AssertSdkExtracted()
+    self.assertEqual(len(self.server.requests), 2)
+
+  def test_resumes_partial_download(self):
+    archive = os.path.join(self.sdk_dir, 'core.tar.gz')
+    with open(archive + '.partial', 'wb') as f:
+      f.write(self.server.archive[:100000])
+    download_fuchsia_sdk.WriteRecord(
+        archive + '.partial.json', sdk_path=SDK_PATH, etag=self.server.etag, md5=None
+    )
+
+    self.Fetch()
+    self.AssertSdkExtracted()
+    self.assertEqual(self.server.requests, [('/' + SDK_PATH, 'bytes=100000-')])
+    self.assertFalse(os.path.exists(archive + '.partial'))
+    self.assertTrue(download_fuchsia_sdk.IsCachedArchiveValid(archive, SDK_PATH))
+
+  def test_restarts_download_of_another_sdk(self):
+    archive = os.path.join(self.sdk_dir, 'core.tar.gz')
+    with open(archive + '.partial', 'wb') as f:
+      f.write(b'x' * 1000)
+    download_fuchsia_sdk.WriteRecord(
+        archive + '.partial.json', sdk_path='other/core.tar.gz', etag='"other"', md5=None
+    )
+    self.Fetch()
+    self.AssertSdkExtracted()
+    self.assertEqual(self.server.requests, [('/' + SDK_PATH, None)])
+
+  def test_resumes_after_dropped_connections(self):
+    self.server.drop_after = [150000, 100000]
+    self.Fetch()
+    self.AssertSdkExtracted()
+    self.assertEqual([request_range for _, request_range in self.server.requests],
+                     [None, 'bytes=150000-', 'bytes=250000-'])
+
+  def test_server_without_ranges(self):
+    self.server.drop_after = [150000]
+    self.server.supports_ranges = False
+    with self.assertRaisesRegex(download_fuchsia_sdk.DownloadError, 'changed'):
+      self.Fetch()
+    self.assertFalse(os.path.exists(os.path.join(self.sdk_dir, 'linux')))
+
+  def test_checksum_mismatch(self):
+    self.server.md5 = hashlib.md5(b'something else').digest()
+    with self.assertRaisesRegex(download_fuchsia_sdk.DownloadError, 'MD5'):
+      self.Fetch()
+    self.assertEqual(os.listdir(self.sdk_dir), ['temp'])
+
+  def test_missing_sdk(self):
+    with self.assertRaisesRegex(download_fuchsia_sdk.DownloadError, '404'):
+      self.Fetch(sdk_path='development/missing/core.tar.gz')
+    self.assertEqual(len(self.server.requests), 1)
+
+  @unittest.skipUnless(shutil.which('pigz') or shutil.which('gzip'), 'needs pigz or gzip')
+  def test_external_decompressor(self):
+    # gzip takes the same arguments as pigz.
+    self.Fetch(pigz=shutil.which('pigz') or shutil.which('gzip'))
+    self.AssertSdkExtracted()
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -8,7 +8,7 @@
 """
 
 import argparse
-import errno
+import concurrent.futures
 import os
 import platform
 import re
@@ -16,15 +16,27 @@ import shutil
 import subprocess
 import sys
 import tempfile
+import threading
 
 from gather_flutter_runner_artifacts import CreateMetaPackage, CopyPath
 from gen_package import CreateFarPackage
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'build'))
+import copy_strategy  # pylint: disable=import-error,wrong-import-position
+
 _script_dir = os.path.abspath(os.path.join(os.path.realpath(__file__), '..'))
 _src_root_dir = os.path.join(_script_dir, '..', '..', '..')
 _out_dir = os.path.join(_src_root_dir, 'out', 'ci')
 _bucket_directory = os.path.join(_out_dir, 'fuchsia_bucket')
 
+# The number of variants that are packaged at the same time while the next
+# variant builds.
+_packaging_jobs = 2
+
+# Guards the parts of the bucket that every variant writes to: the per-arch
+# deps directories, the CIPD YAML and the license files.
+_shared_bucket_lock = threading.Lock()
+
 
 def IsLinux():
   return platform.system() == 'Linux'
@@ -93,19 +105,53 @@ def RemoveDirectoryIfExists(path):
 
 
 def CopyFiles(source, destination):
-  try:
-    shutil.copytree(source, destination)
-  except OSError as error:
-    if error.errno == errno.ENOTDIR:
-      shutil.copy(source, destination)
-    else:
-      raise
+  copy_strategy.copy_path(source, destination, allow_hardlink=True)
+
+
+class FileIndex:
+  """Maps file names to their paths under a directory, built in one walk.
+
+  The walk happens on the first lookup, so the index reflects the directory
+  as it was then. When a name appears more than once, the shallowest path
+  wins, and paths at the same depth are ordered alphabetically.
+  """
+
+  def __init__(self, root):
+    self.root = root
+    self._lock = threading.Lock()
+    self._paths = None
+
+  def _Build(self):
+    paths = {}
+    for root, dirs, files in os.walk(self.root):
+      for name in files:
+        paths.setdefault(name, []).append(os.path.join(root, name))
+    for candidates in paths.values():
+      candidates.sort(key=lambda path: (path.count(os.sep), path))
+    return paths
+
+  def Find(self, name):
+    with self._lock:
+      if self._paths is None:
+        self._paths = self._Build()
+    candidates = self._paths.get(name)
+    return candidates[0] if candidates else None
+
+
+_file_indexes = {}
+_file_indexes_lock = threading.Lock()
+
+
+def GetFileIndex(path):
+  path = os.path.abspath(path)
+  with _file_indexes_lock:
+    if path not in _file_indexes:
+      _file_indexes[path] = FileIndex(path)
+    return _file_indexes[path]
 
 
 def FindFile(name, path):
-  for root, dirs, files in os.walk(path):
-    if name in files:
-      return os.path.join(root, name)
+  return GetFileIndex(path).Find(name)
 
 
 def FindFileAndCopyTo(file_name, source, dest_parent, dst_name=None):
@@ -171,10 +217,18 @@ def CopyToBucketWithMode(source, destination, aot, product, runner_type, api_lev
 
 def CopyToBucket(src, dst, product=False):
   api_level = ReadTargetAPILevel()
-  CopyToBucketWithMode(src, dst, False, product, 'flutter', api_level)
-  CopyToBucketWithMode(src, dst, True, product, 'flutter', api_level)
-  CopyToBucketWithMode(src, dst, False, product, 'dart', api_level)
-  CopyToBucketWithMode(src, dst, True, product, 'dart', api_level)
+
+  # pm writes meta.far and its other outputs straight into the destination,
+  # which the flutter and dart runners of a mode share. Each mode therefore
+  # packages its runners in order, and the jit and aot modes run concurrently.
+  def CopyToBucketWithRunners(aot):
+    CopyToBucketWithMode(src, dst, aot, product, 'flutter', api_level)
+    CopyToBucketWithMode(src, dst, aot, product, 'dart', api_level)
+
+  with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+    futures = [executor.submit(CopyToBucketWithRunners, aot) for aot in [False, True]]
+  for future in futures:
+    future.result()
 
 
 def ReadTargetAPILevel():
@@ -211,23 +265,25 @@ def CopyBuildToBucket(runtime_mode, arch, optimized, product):
   deps_dir = 'flutter/%s/deps/' % (arch)
 
   CopyToBucket(out_dir, bucket_dir, product)
-  CopyVulkanDepsToBucket(out_dir, deps_dir, arch)
-  CopyIcuDepsToBucket(out_dir, deps_dir)
 
-  # Copy the CIPD YAML template from the source directory to be next to the bucket
-  # we are about to package.
-  cipd_yaml = os.path.join(_script_dir, 'fuchsia.cipd.yaml')
-  CopyFiles(cipd_yaml, os.path.join(_bucket_directory, 'fuchsia.cipd.yaml'))
+  with _shared_bucket_lock:
+    CopyVulkanDepsToBucket(out_dir, deps_dir, arch)
+    CopyIcuDepsToBucket(out_dir, deps_dir)
+
+    # Copy the CIPD YAML template from the source directory to be next to the bucket
+    # we are about to package.
+    cipd_yaml = os.path.join(_script_dir, 'fuchsia.cipd.yaml')
+    CopyFiles(cipd_yaml, os.path.join(_bucket_directory, 'fuchsia.cipd.yaml'))
 
-  # Copy the license files from the source directory to be next to the bucket we
-  # are about to package.
-  bucket_root = os.path.join(_bucket_directory, 'flutter')
-  licenses_root = os.path.join(_src_root_dir, 'flutter/ci/licenses_golden')
-  license_files = ['licenses_flutter', 'licenses_fuchsia', 'licenses_skia']
-  for license in license_files:
-    src_path = os.path.join(licenses_root, license)
-    dst_path = os.path.join(bucket_root, license)
-    CopyPath(src_path, dst_path)
+    # Copy the license files from the source directory to be next to the bucket we
+    # are about to package.
+    bucket_root = os.path.join(_bucket_directory, 'flutter')
+    licenses_root = os.path.join(_src_root_dir, 'flutter/ci/licenses_golden')
+    license_files = ['licenses_flutter', 'licenses_fuchsia', 'licenses_skia']
+    for license in license_files:
+      src_path = os.path.join(licenses_root, license)
+      dst_path = os.path.join(bucket_root, license)
+      CopyPath(src_path, dst_path)
 
 
 def CheckCIPDPackageExists(package_name, tag):
@@ -331,6 +387,17 @@ def BuildTarget(
   return
 
 
+def RaisePackagingErrors(packaging, finished_only=False):
+  """Re-raises the error of the first packaging job in |packaging| that failed.
+
+  With |finished_only|, jobs that are still queued or running are skipped
+  instead of waited for.
+  """
+  for future in packaging:
+    if not finished_only or future.done():
+      future.result()
+
+
 def main():
   parser = argparse.ArgumentParser()
 
@@ -441,30 +508,49 @@ def main():
   enable_lto = not args.no_lto
   enable_legacy = not args.no_legacy
 
-  # Build buckets
-  for arch in archs:
-    for i in range(len(runtime_modes)):
-      runtime_mode = runtime_modes[i]
-      product = product_modes[i]
-      if build_mode == 'all' or runtime_mode == build_mode:
-        if not args.skip_build:
-          BuildTarget(
-              runtime_mode, arch, optimized, enable_lto, enable_legacy, args.asan,
-              not args.no_dart_version_git_info, not args.no_prebuilt_dart_sdk,
-              args.targets.split(",") if args.targets else ['flutter']
-          )
-        CopyBuildToBucket(runtime_mode, arch, optimized, product)
-
-        # This is a hack. The recipe for building and uploading Fuchsia to CIPD
-        # builds both a debug build (debug without ASAN) and unoptimized debug
-        # build (debug with ASAN). To copy both builds into CIPD, the recipe
-        # runs build_fuchsia_artifacts.py in optimized mode and tells
-        # build_fuchsia_artifacts.py to also copy_unoptimized_debug_artifacts.
-        #
-        # TODO(akbiggs): Consolidate Fuchsia's building and copying logic to
-        # avoid ugly hacks like this.
-        if args.copy_unoptimized_debug_artifacts and runtime_mode == 'debug' and optimized:
-          CopyBuildToBucket(runtime_mode, arch, not optimized, product)
+  # Build buckets. Variants build one after another, since each ninja build
+  # already uses every core, and each variant is packaged in the background
+  # while the next one builds.
+  with concurrent.futures.ThreadPoolExecutor(max_workers=_packaging_jobs) as packager:
+    packaging = []
+    try:
+      for arch in archs:
+        for i in range(len(runtime_modes)):
+          runtime_mode = runtime_modes[i]
+          product = product_modes[i]
+          if build_mode == 'all' or runtime_mode == build_mode:
+            if not args.skip_build:
+              BuildTarget(
+                  runtime_mode, arch, optimized, enable_lto, enable_legacy, args.asan,
+                  not args.no_dart_version_git_info, not args.no_prebuilt_dart_sdk,
+                  args.targets.split(",") if args.targets else ['flutter']
+              )
+            # Stop before the next build if packaging an earlier variant failed.
+            RaisePackagingErrors(packaging, finished_only=True)
+            packaging.append(
+                packager.submit(CopyBuildToBucket, runtime_mode, arch, optimized, product)
+            )
+
+            # This is a hack. The recipe for building and uploading Fuchsia to CIPD
+            # builds both a debug build (debug without ASAN) and unoptimized debug
+            # build (debug with ASAN). To copy both builds into CIPD, the recipe
+            # runs build_fuchsia_artifacts.py in optimized mode and tells
+            # build_fuchsia_artifacts.py to also copy_unoptimized_debug_artifacts.
+            #
+            # TODO(akbiggs): Consolidate Fuchsia's building and copying logic to
+            # avoid ugly hacks like this.
+            if args.copy_unoptimized_debug_artifacts and runtime_mode == 'debug' and optimized:
+              packaging.append(
+                  packager.submit(CopyBuildToBucket, runtime_mode, arch, not optimized, product)
+              )
+
+      RaisePackagingErrors(packaging)
+    except BaseException:
+      # Don't start packaging any more variants; the executor still waits for
+      # the ones that are running.
+      for future in packaging:
+        future.cancel()
+      raise
 
   # Set revision to HEAD if empty and remove upload. This is to support
   # presubmit workflows.
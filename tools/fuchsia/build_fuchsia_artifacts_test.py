@@ -1,5 +1,8 @@
 #!/usr/bin/env vpython3
 
+import os
+import shutil
+import tempfile
 import unittest
 
 import build_fuchsia_artifacts
@@ -10,6 +13,26 @@ class BuildFuchsiaArtifactsTest(unittest.TestCase):
   def test_read_fuchsia_target_api_level(self):
     self.assertGreater(int(build_fuchsia_artifacts.ReadTargetAPILevel()), 21)
 
+  def test_find_file(self):
+    root = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, root)
+    for path in ['b/gen_snapshot', 'a/gen_snapshot', 'a/b/c/flutter_tester', 'z/x/gen_snapshot']:
+      os.makedirs(os.path.join(root, os.path.dirname(path)), exist_ok=True)
+      open(os.path.join(root, path), 'w').close()
+
+    self.assertEqual(
+        build_fuchsia_artifacts.FindFile('gen_snapshot', root),
+        os.path.join(root, 'a', 'gen_snapshot')
+    )
+    self.assertEqual(
+        build_fuchsia_artifacts.FindFile('flutter_tester', root + '/'),
+        os.path.join(root, 'a', 'b', 'c', 'flutter_tester')
+    )
+    self.assertIsNone(build_fuchsia_artifacts.FindFile('libzircon_ffi.so', root))
+    # Lookups are answered from the index built by the first one.
+    open(os.path.join(root, 'libzircon_ffi.so'), 'w').close()
+    self.assertIsNone(build_fuchsia_artifacts.FindFile('libzircon_ffi.so', root))
+
 
 if __name__ == '__main__':
   unittest.main()
@@ -12,16 +12,20 @@
 """
 
 import argparse
-import errno
 import hashlib
 import json
 import os
-import re
-import shutil
-import subprocess
 import sys
 import time
 
+from elf_build_id import ReadBuildId
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'build'))
+import copy_strategy  # pylint: disable=import-error,wrong-import-position
+
+# The version of the copy record kept in the completion file.
+RECORD_VERSION = 1
+
 
 def HashFile(filepath):
   """Calculates the hash of a file without reading it all in memory at once."""
@@ -40,21 +44,69 @@ def Touch(fname):
     os.utime(fname, None)
 
 
-def GetBuildIdParts(exec_path, read_elf):
-  sha1_pattern = re.compile(r'[0-9a-fA-F\-]+')
-  file_out = subprocess.check_output([read_elf, '-n', exec_path])
-  build_id_line = file_out.splitlines()[-1].split()
-  if (build_id_line[0] != b'Build' or build_id_line[1] != b'ID:' or
-      not sha1_pattern.match(str(build_id_line[-1])) or not len(build_id_line[-1]) > 2):
-    raise Exception(
-        'Expected the last line of llvm-readelf to match "Build ID <Hex String>" Got: %s' % file_out
-    )
-
-  build_id = build_id_line[-1]
+def FileFingerprint(path):
+  stat = os.stat(path)
   return {
-      'build_id': build_id.decode('utf-8'), 'prefix_dir': build_id[:2].decode('utf-8'),
-      'exec_name': build_id[2:].decode('utf-8')
+      'path': os.path.abspath(path),
+      'size': stat.st_size,
+      'mtime_ns': stat.st_mtime_ns,
+      'inode': stat.st_ino,
+  }
+
+
+def ReadCopyRecord(record_path):
+  """Returns the record of the last copy, or None if there is no usable one."""
+  try:
+    with open(record_path, 'r') as f:
+      record = json.load(f)
+  except (OSError, ValueError):
+    return None
+  if not isinstance(record, dict) or record.get('version') != RECORD_VERSION:
+    return None
+  return record
+
+
+def WriteCopyRecord(record_path, exec_path, dbg_file_path):
+  record = {
+      'version': RECORD_VERSION,
+      'source': FileFingerprint(exec_path),
+      'destination': FileFingerprint(dbg_file_path),
   }
+  with open(record_path, 'w') as f:
+    json.dump(record, f, sort_keys=True)
+
+
+def IsCopyUpToDate(record, exec_path):
+  """Returns whether neither the executable nor its copy changed since |record|."""
+  if record is None:
+    return False
+  try:
+    return (
+        record['source'] == FileFingerprint(exec_path) and
+        record['destination'] == FileFingerprint(record['destination']['path'])
+    )
+  except (OSError, KeyError, TypeError):
+    return False
+
+
+def NeedsCopy(exec_path, dbg_file_path):
+  """Returns whether |dbg_file_path|, named after the build ID of |exec_path|, is stale."""
+  if not os.path.exists(dbg_file_path):
+    return True
+  if os.path.samefile(exec_path, dbg_file_path):
+    return False
+  if os.path.getsize(exec_path) != os.path.getsize(dbg_file_path):
+    return True
+  # The build ID and the size match, so only the contents can tell.
+  return HashFile(exec_path) != HashFile(dbg_file_path)
+
+
+def GetBuildIdParts(exec_path):
+  build_id = ReadBuildId(exec_path)
+  if build_id is None or len(build_id) <= 2:
+    raise Exception('Expected %s to have a build ID, got: %s' % (exec_path, build_id))
+
+  return {'build_id': build_id, 'prefix_dir': build_id[:2], 'exec_name': build_id[2:]}
 
 
 def main():
@@ -94,29 +146,26 @@ def main():
       action='store_false',
       help='Executable at the specified path is unstripped.'
   )
-  parser.add_argument(
-      '--read-elf',
-      dest='read_elf',
-      action='store',
-      required=True,
-      help='Path to read-elf executable.'
-  )
 
   args = parser.parse_args()
   assert os.path.exists(args.exec_path), ('exec_path "%s" does not exist' % args.exec_path)
   assert os.path.exists(args.dest), ('dest "%s" does not exist' % args.dest)
-  assert os.path.exists(args.read_elf), ('read_elf "%s" does not exist' % args.read_elf)
 
-  parts = GetBuildIdParts(args.exec_path, args.read_elf)
+  # Note this needs to be in sync with fuchsia_debug_symbols.gni
+  completion_file = os.path.join(args.dest, '.%s_dbg_success' % args.exec_name)
+
+  # The completion file records the executable and the copy made from it. If
+  # neither changed since, there is nothing to do, not even reading the
+  # build ID.
+  if IsCopyUpToDate(ReadCopyRecord(completion_file), args.exec_path):
+    Touch(completion_file)
+    return 0
+
+  parts = GetBuildIdParts(args.exec_path)
   dbg_prefix_base = os.path.join(args.dest, parts['prefix_dir'])
 
   # Multiple processes may be trying to create the same directory.
-  # TODO(dnfield): use exist_ok when we upgrade to python 3, rather than try
-  try:
-    os.makedirs(dbg_prefix_base)
-  except OSError as e:
-    if e.errno != errno.EEXIST:
-      raise
+  os.makedirs(dbg_prefix_base, exist_ok=True)
 
   if not os.path.exists(dbg_prefix_base):
     print('Unable to create directory: %s.' % dbg_prefix_base)
@@ -128,17 +177,13 @@ def main():
   dbg_file_name = '%s%s' % (parts['exec_name'], dbg_suffix)
   dbg_file_path = os.path.join(dbg_prefix_base, dbg_file_name)
 
-  # If the debug file hasn't changed, don't rewrite the debug and completion
-  # file, speeding up incremental builds.
-  if os.path.exists(dbg_file_path) and HashFile(args.exec_path) == HashFile(dbg_file_path):
-    return 0
-
-  shutil.copyfile(args.exec_path, dbg_file_path)
-
-  # Note this needs to be in sync with fuchsia_debug_symbols.gni
-  completion_file = os.path.join(args.dest, '.%s_dbg_success' % args.exec_name)
-  Touch(completion_file)
+  # The debug file is named after the build ID, so it is replaced only if it
+  # holds different contents. Executables are replaced rather than edited in
+  # place, so the copy may share their inode.
+  if NeedsCopy(args.exec_path, dbg_file_path):
+    copy_strategy.copy_file(args.exec_path, dbg_file_path, allow_hardlink=True)
 
+  WriteCopyRecord(completion_file, args.exec_path, dbg_file_path)
   return 0
 
 
@@ -8,43 +8,20 @@
 """
 
 import argparse
-import errno
 import json
 import os
 import platform
-import shutil
 import subprocess
 import sys
 
-
-def EnsureParentExists(path):
-  dir_name, _ = os.path.split(path)
-  if not os.path.exists(dir_name):
-    os.makedirs(dir_name)
-
-
-def SameStat(s1, s2):
-  return s1.st_ino == s2.st_ino and s1.st_dev == s2.st_dev
-
-
-def SameFile(f1, f2):
-  if not os.path.exists(f2):
-    return False
-  s1 = os.stat(f1)
-  s2 = os.stat(f2)
-  return SameStat(s1, s2)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'build'))
+import copy_strategy  # pylint: disable=import-error,wrong-import-position
 
 
+# Like the toolchain's copy tool, this links rather than copies where it can;
+# ninja tracks the sources, so the outputs are never edited in place.
 def CopyPath(src, dst):
-  try:
-    EnsureParentExists(dst)
-    shutil.copytree(src, dst)
-  except OSError as exc:
-    if exc.errno == errno.ENOTDIR:
-      if not SameFile(src, dst):
-        shutil.copyfile(src, dst)
-    else:
-      raise
+  copy_strategy.copy_path(src, dst, allow_hardlink=True)
 
 
 def main():
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+#
+# Copyright 2013 The Flutter Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+""" Reads the GNU build ID of an ELF file without running llvm-readelf.
+
+    The build ID is the descriptor of the NT_GNU_BUILD_ID note. It is looked
+    up through the PT_NOTE program headers first, which stripped executables
+    keep, and then through the SHT_NOTE section headers, which is all that
+    separated debug files have. 32 and 64-bit files of either byte order are
+    supported.
+
+    Usage:
+      ./elf_build_id.py path/to/executable
+"""
+
+import collections
+import mmap
+import os
+import struct
+import sys
+
+ELF_MAGIC = b'\x7fELF'
+ELFCLASS32 = 1
+ELFCLASS64 = 2
+ELFDATA2LSB = 1
+ELFDATA2MSB = 2
+
+PT_NOTE = 4
+SHT_NOTE = 7
+NT_GNU_BUILD_ID = 3
+GNU_NOTE_NAME = b'GNU\x00'
+
+# The layout of the parts of an ELF file that lead to its notes, per class.
+_Layout = collections.namedtuple(
+    '_Layout', [
+        'header',
+        'program_header',
+        'section_header',
+        'program_header_fields',
+        'section_header_fields',
+    ]
+)
+
+_LAYOUTS = {
+    # e_type through e_shstrndx, after the 16 bytes of e_ident.
+    ELFCLASS32:
+        _Layout(
+            header='HHIIIIIHHHHHH',
+            program_header='IIIIIIII',
+            section_header='IIIIIIIIII',
+            # (type, offset, size, alignment) indices.
+            program_header_fields=(0, 1, 4, 7),
+            section_header_fields=(1, 4, 5, 8),
+        ),
+    ELFCLASS64:
+        _Layout(
+            header='HHIQQQIHHHHHH',
+            program_header='IIQQQQQQ',
+            section_header='IIQQQQIIQQ',
+            program_header_fields=(0, 2, 5, 7),
+            section_header_fields=(1, 4, 5, 8),
+        ),
+}
+
+
+class ElfError(Exception):
+  pass
+
+
+def _Align(value, alignment):
+  return (value + alignment - 1) & ~(alignment - 1)
+
+
+def _Unpack(data, fmt, offset):
+  try:
+    return struct.unpack_from(fmt, data, offset)
+  except struct.error:
+    raise ElfError('Truncated ELF file') from None
+
+
+def _FindBuildIdNote(data, byte_order, offset, size, alignment):
+  """Returns the build ID in the notes at |offset|, or None if there is none."""
+  # Notes are padded to 4 bytes, except in segments and sections aligned to 8.
+  alignment = 8 if alignment == 8 else 4
+  end = offset + size
+  if end > len(data):
+    raise ElfError('Note data extends past the end of the file')
+  while offset + 12 <= end:
+    name_size, desc_size, note_type = _Unpack(data, byte_order + 'III', offset)
+    name_start = offset + 12
+    desc_start = name_start + _Align(name_size, alignment)
+    offset = desc_start + _Align(desc_size, alignment)
+    if desc_start + desc_size > end:
+      raise ElfError('Malformed note')
+    if note_type == NT_GNU_BUILD_ID and data[name_start:name_start + name_size] == GNU_NOTE_NAME:
+      return data[desc_start:desc_start + desc_size]
+  return None
+
+
+def _ReadTable(data, byte_order, fmt, table_offset, entry_size, count):
+  entry_format = byte_order + fmt
+  if count and entry_size < struct.calcsize(entry_format):
+    raise ElfError('Header table entries are too small')
+  return [_Unpack(data, entry_format, table_offset + i * entry_size) for i in range(count)]
+
+
+def ReadBuildIdFromData(data):
+  """Returns the build ID in the ELF image |data| as bytes, or None if it has none."""
+  if len(data) < 16 or data[:4] != ELF_MAGIC:
+    raise ElfError('Not an ELF file')
+  elf_class = data[4]
+  if elf_class not in _LAYOUTS:
+    raise ElfError('Unknown ELF class %d' % elf_class)
+  byte_order = {ELFDATA2LSB: '<', ELFDATA2MSB: '>'}.get(data[5])
+  if byte_order is None:
+    raise ElfError('Unknown ELF data encoding %d' % data[5])
+  layout = _LAYOUTS[elf_class]
+
+  # e_phoff, e_shoff, e_phentsize, e_phnum, e_shentsize and e_shnum.
+  header = _Unpack(data, byte_order + layout.header, 16)
+  program_header_offset, section_header_offset = header[4], header[5]
+  program_header_size, program_header_count = header[8], header[9]
+  section_header_size, section_header_count = header[10], header[11]
+
+  program_headers = _ReadTable(
+      data, byte_order, layout.program_header, program_header_offset, program_header_size,
+      program_header_count
+  )
+  for header in program_headers:
+    segment_type, offset, size, alignment = (header[i] for i in layout.program_header_fields)
+    if segment_type == PT_NOTE and size:
+      try:
+        build_id = _FindBuildIdNote(data, byte_order, offset, size, alignment)
+      except ElfError:
+        # Separated debug files keep the program headers of the executable,
+        # which may no longer describe their contents; the sections do.
+        continue
+      if build_id is not None:
+        return build_id
+
+  if section_header_offset and section_header_count == 0:
+    # With 0xff00 sections or more, the count is in the first section header.
+    first = _ReadTable(
+        data, byte_order, layout.section_header, section_header_offset, section_header_size, 1
+    )
+    section_header_count = first[0][layout.section_header_fields[2]]
+  section_headers = _ReadTable(
+      data, byte_order, layout.section_header, section_header_offset, section_header_size,
+      section_header_count
+  )
+  for header in section_headers:
+    section_type, offset, size, alignment = (header[i] for i in layout.section_header_fields)
+    if section_type == SHT_NOTE:
+      build_id = _FindBuildIdNote(data, byte_order, offset, size, alignment)
+      if build_id is not None:
+        return build_id
+  return None
+
+
+def ReadBuildId(path):
+  """Returns the build ID of the ELF file at |path| as a hex string, or None if it has none.
+
+  Raises ElfError if the file is not a well-formed ELF file.
+  """
+  with open(path, 'rb') as f:
+    if os.fstat(f.fileno()).st_size < 16:
+      raise ElfError('%s: Not an ELF file' % path)
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+      try:
+        build_id = ReadBuildIdFromData(data)
+      except ElfError as error:
+        raise ElfError('%s: %s' % (path, error)) from None
+  return build_id.hex() if build_id is not None else None
+
+
+def main():
+  if len(sys.argv) != 2:
+    print('usage: elf_build_id.py path', file=sys.stderr)
+    return 1
+  try:
+    build_id = ReadBuildId(sys.argv[1])
+  except ElfError as error:
+    print(error, file=sys.stderr)
+    return 1
+  if build_id is None:
+    print('%s has no build ID' % sys.argv[1], file=sys.stderr)
+    return 1
+  print(build_id)
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
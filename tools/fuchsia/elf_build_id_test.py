@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+#
+# Copyright 2013 The Flutter Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+import elf_build_id
+
+BUILD_ID = bytes(range(0xa0, 0xb4))
+
+
+def Note(byte_order, name, note_type, desc, alignment=4):
+
+  def Pad(data):
+    return data + b'\x00' * (-len(data) % alignment)
+
+  return struct.pack(byte_order + 'III', len(name), len(desc), note_type) + Pad(name) + Pad(desc)
+
+
+def MakeElf(elf_class, byte_order, notes, in_segment=True, in_section=True, alignment=4):
+  """Returns an ELF image whose notes are reachable from a PT_NOTE and/or a SHT_NOTE."""
+  is_64 = elf_class == elf_build_id.ELFCLASS64
+  layout = elf_build_id._LAYOUTS[elf_class]
+  header_size = 64 if is_64 else 52
+  program_header_size = struct.calcsize(byte_order + layout.program_header)
+  section_header_size = struct.calcsize(byte_order + layout.section_header)
+
+  program_headers_offset = header_size
+  program_header_count = 1 if in_segment else 0
+  notes_offset = program_headers_offset + program_header_count * program_header_size
+  section_headers_offset = notes_offset + len(notes)
+  section_header_count = 2 if in_section else 0
+
+  data_encoding = elf_build_id.ELFDATA2LSB if byte_order == '<' else elf_build_id.ELFDATA2MSB
+  image = elf_build_id.ELF_MAGIC + bytes([elf_class, data_encoding, 1]) + b'\x00' * 9
+  image += struct.pack(
+      byte_order + layout.header, 2, 62, 1, 0, program_headers_offset if in_segment else 0,
+      section_headers_offset if in_section else 0, 0, header_size, program_header_size,
+      program_header_count, section_header_size, section_header_count, 0
+  )
+  if in_segment:
+    if is_64:
+      fields = (elf_build_id.PT_NOTE, 4, notes_offset, 0, 0, len(notes), len(notes), alignment)
+    else:
+      fields = (elf_build_id.PT_NOTE, notes_offset, 0, 0, len(notes), len(notes), 4, alignment)
+    image += struct.pack(byte_order + layout.program_header, *fields)
+  image += notes
+  if in_section:
+    image += b'\x00' * section_header_size
+    image += struct.pack(
+        byte_order + layout.section_header, 1, elf_build_id.SHT_NOTE, 2, 0, notes_offset,
+        len(notes), 0, 0, alignment, 0
+    )
+  return image
+
+
+class ElfBuildIdTest(unittest.TestCase):
+
+  def setUp(self):
+    self.temp_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.temp_dir)
+
+  def WriteFixture(self, name, image):
+    path = os.path.join(self.temp_dir, name)
+    with open(path, 'wb') as f:
+      f.write(image)
+    return path
+
+  def test_classes_and_byte_orders(self):
+    for elf_class in [elf_build_id.ELFCLASS32, elf_build_id.ELFCLASS64]:
+      for byte_order in ['<', '>']:
+        notes = Note(byte_order, b'GNU\x00', 1, b'\x00' * 16)
+        notes += Note(byte_order, b'GNU\x00', elf_build_id.NT_GNU_BUILD_ID, BUILD_ID)
+        path = self.WriteFixture(
+            'elf%d%s' % (elf_class, byte_order), MakeElf(elf_class, byte_order, notes)
+        )
+        self.assertEqual(elf_build_id.ReadBuildId(path), BUILD_ID.hex())
+
+  def test_note_locations(self):
+    notes = Note('<', b'GNU\x00', elf_build_id.NT_GNU_BUILD_ID, BUILD_ID)
+    for in_segment, in_section in [(True, False), (False, True)]:
+      image = MakeElf(elf_build_id.ELFCLASS64, '<', notes, in_segment, in_section)
+      path = self.WriteFixture('elf-%s-%s' % (in_segment, in_section), image)
+      self.assertEqual(elf_build_id.ReadBuildId(path), BUILD_ID.hex())
+
+  def test_eight_byte_aligned_notes(self):
+    notes = Note('<', b'GNU\x00', 5, b'\x00' * 12, alignment=8)
+    notes += Note('<', b'GNU\x00', elf_build_id.NT_GNU_BUILD_ID, BUILD_ID, alignment=8)
+    path = self.WriteFixture(
+        'aligned', MakeElf(elf_build_id.ELFCLASS64, '<', notes, in_section=False, alignment=8)
+    )
+    self.assertEqual(elf_build_id.ReadBuildId(path), BUILD_ID.hex())
+
+  def test_ignores_other_owners(self):
+    notes = Note('<', b'Go\x00\x00', elf_build_id.NT_GNU_BUILD_ID, b'\x01' * 8)
+    path = self.WriteFixture('no_build_id', MakeElf(elf_build_id.ELFCLASS64, '<', notes))
+    self.assertIsNone(elf_build_id.ReadBuildId(path))
+
+  def test_rejects_bad_files(self):
+    notes = Note('<', b'GNU\x00', elf_build_id.NT_GNU_BUILD_ID, BUILD_ID)
+    image = MakeElf(elf_build_id.ELFCLASS64, '<', notes, in_segment=False)
+    for name, contents in [
+        ('empty', b''),
+        ('text', b'#!/bin/sh\necho not an executable\n'),
+        ('truncated', image[:len(image) - 8]),
+    ]:
+      with self.assertRaises(elf_build_id.ElfError):
+        elf_build_id.ReadBuildId(self.WriteFixture(name, contents))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -8,7 +8,6 @@
 """
 
 import argparse
-import errno
 import json
 import os
 import platform
@@ -16,27 +15,19 @@ import shutil
 import subprocess
 import sys
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'build'))
+import copy_strategy  # pylint: disable=import-error,wrong-import-position
+
 _ARTIFACT_PATH_TO_DST = {
     'flutter_jit_runner': 'flutter_jit_runner', 'icudtl.dat': 'data/icudtl.dat',
     'dart_runner': 'dart_runner', 'flutter_patched_sdk': 'flutter_patched_sdk'
 }
 
 
-def EnsureParentExists(path):
-  dir_name, _ = os.path.split(path)
-  if not os.path.exists(dir_name):
-    os.makedirs(dir_name)
-
-
+# Artifacts are only read once gathered, so they may share inodes with the
+# build outputs.
 def CopyPath(src, dst):
-  try:
-    EnsureParentExists(dst)
-    shutil.copytree(src, dst)
-  except OSError as exc:
-    if exc.errno == errno.ENOTDIR:
-      shutil.copy(src, dst)
-    else:
-      raise
+  copy_strategy.copy_path(src, dst, allow_hardlink=True)
 
 
 def CreateMetaPackage(dst_root, far_name):
@@ -47,8 +38,14 @@ def CreateMetaPackage(dst_root, far_name):
   content['name'] = far_name
   content['version'] = '0'
   package = os.path.join(meta, 'package')
+  # Leave an identical file alone, so the package is not rebuilt for it.
+  serialized = json.dumps(content)
+  if os.path.isfile(package):
+    with open(package, 'r') as in_file:
+      if in_file.read() == serialized:
+        return
   with open(package, 'w') as out_file:
-    json.dump(content, out_file)
+    out_file.write(serialized)
 
 
 def GatherArtifacts(src_root, dst_root, create_meta_package=True):
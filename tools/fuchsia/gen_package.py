@@ -16,27 +16,125 @@ import sys
 
 from gather_flutter_runner_artifacts import CreateMetaPackage
 
-
-# Generates the manifest and returns the file.
+# The version of the records that let unchanged packages skip pm, and the
+# suffix that the package directory gets for them.
+PM_CACHE_VERSION = 1
+PM_CACHE_SUFFIX = '.pm_cache.json'
+
+
+def _ListPackageFiles(directory, rel_prefix, abs_prefix, entries):
+  with os.scandir(directory) as it:
+    for entry in it:
+      rel_path = rel_prefix + entry.name
+      if entry.is_dir():
+        # Like os.walk, symlinks to directories are neither listed nor followed.
+        if not entry.is_symlink():
+          _ListPackageFiles(entry.path, rel_path + os.sep, abs_prefix, entries)
+      else:
+        entries.append((rel_path, abs_prefix + rel_path))
+
+
+def ListPackageFiles(package_dir):
+  """Returns (path in the package, absolute path) for every file under |package_dir|, sorted."""
+  package_dir = os.path.abspath(package_dir)
+  entries = []
+  _ListPackageFiles(package_dir, '', package_dir + os.sep, entries)
+  entries.sort()
+  return entries
+
+
+def WriteIfChanged(path, content):
+  """Writes |content| to |path| unless it already holds it. Returns whether it wrote."""
+  try:
+    with open(path, 'r') as f:
+      if f.read() == content:
+        return False
+  except OSError:
+    pass
+  with open(path, 'w') as f:
+    f.write(content)
+  return True
+
+
+# Generates the manifest and returns the file. The manifest keeps its
+# modification time when the package contents are unchanged.
 def GenerateManifest(package_dir):
-  full_paths = []
-  for root, dirs, files in os.walk(package_dir):
-    for f in files:
-      common_prefix = os.path.commonprefix([root, package_dir])
-      rel_path = os.path.relpath(os.path.join(root, f), common_prefix)
-      from_package = os.path.abspath(os.path.join(package_dir, rel_path))
-      assert from_package, 'Failed to create from_package for %s' % os.path.join(root, f)
-      full_paths.append('%s=%s' % (rel_path, from_package))
-
-  parent_dir = os.path.abspath(os.path.join(package_dir, os.pardir))
-  manifest_file_name = os.path.basename(package_dir) + '.manifest'
-  manifest_path = os.path.join(parent_dir, manifest_file_name)
-  with open(manifest_path, 'w') as f:
-    for item in full_paths:
-      f.write("%s\n" % item)
+  package_dir = os.path.abspath(package_dir)
+  content = ''.join('%s=%s\n' % entry for entry in ListPackageFiles(package_dir))
+  manifest_path = package_dir + '.manifest'
+  WriteIfChanged(manifest_path, content)
   return manifest_path
 
 
+def FileFingerprint(path):
+  stat = os.stat(path)
+  return [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+
+
+def PackageInputsFingerprint(manifest_path, pm_commands, extra_inputs):
+  """Fingerprints everything pm reads to build and archive a package.
+
+  That is the files listed in the manifest, |extra_inputs| such as pm itself
+  and the signing key, and the commands. Returns None if an input is missing,
+  which pm will report.
+  """
+  try:
+    with open(manifest_path, 'r') as manifest:
+      entries = [line.rstrip('\n').split('=', 1) for line in manifest if line.strip()]
+    return {
+        'version': PM_CACHE_VERSION,
+        'commands': pm_commands,
+        'files': [[dst, src, FileFingerprint(src)] for dst, src in entries],
+        'inputs': [[path, FileFingerprint(path)] for path in extra_inputs],
+    }
+  except (OSError, ValueError):
+    return None
+
+
+def IsPackageUpToDate(record_path, inputs, outputs):
+  """Returns whether the last pm run had |inputs| and its |outputs| are untouched."""
+  try:
+    with open(record_path, 'r') as f:
+      record = json.load(f)
+    return (
+        record['inputs'] == inputs and
+        record['outputs'] == {output: FileFingerprint(output) for output in outputs}
+    )
+  except (OSError, ValueError, KeyError, TypeError):
+    return False
+
+
+def RunPm(pm_commands, manifest_path, record_path, extra_inputs, outputs):
+  """Runs |pm_commands| unless nothing changed since they produced |outputs|.
+
+  pm re-hashes every file of the package into merkle roots, so a package
+  whose inputs have the same size, mtime and inode as in the last run, and
+  whose outputs are the ones that run produced, is reused instead. The record
+  of the last run is kept at |record_path|. Returns whether pm ran.
+  """
+  inputs = PackageInputsFingerprint(manifest_path, pm_commands, extra_inputs)
+  if inputs is not None and IsPackageUpToDate(record_path, inputs, outputs):
+    return False
+
+  if os.path.exists(record_path):
+    os.unlink(record_path)
+  for pm_command in pm_commands:
+    subprocess.check_output(pm_command)
+
+  if inputs is not None:
+    record = {
+        'inputs': inputs,
+        'outputs': {output: FileFingerprint(output) for output in outputs},
+    }
+    with open(record_path, 'w') as f:
+      json.dump(record, f, sort_keys=True)
+  return True
+
+
+def PmCachePath(package_dir):
+  return os.path.abspath(package_dir) + PM_CACHE_SUFFIX
+
+
 def CreateFarPackage(pm_bin, package_dir, signing_key, dst_dir, api_level):
   manifest_path = GenerateManifest(package_dir)
 
@@ -44,7 +142,8 @@ def CreateFarPackage(pm_bin, package_dir, signing_key, dst_dir, api_level):
       pm_bin, '-m', manifest_path, '-k', signing_key, '-o', dst_dir, '--api-level', api_level
   ]
 
-  # Build the package
+  # Build the package. pm always runs here: the flutter and dart runners of a
+  # mode share |dst_dir|, so its meta.far is never the one this package left.
   subprocess.check_output(pm_command_base + ['build'])
 
   # Archive the package
@@ -104,14 +203,16 @@ def main():
     if args.api_level is not None:
       build_command = ['--api-level', args.api_level] + build_command
 
-    archive_command = [
-        'archive', '--output=' + os.path.join(os.path.dirname(output_dir), args.far_name + "-0")
-    ]
-
-    pm_commands = [build_command, archive_command]
+    archive_path = os.path.join(os.path.dirname(output_dir), args.far_name + "-0")
+    archive_command = ['archive', '--output=' + archive_path]
 
-    for pm_command in pm_commands:
-      subprocess.check_output(pm_command_base + pm_command)
+    pm_commands = [pm_command_base + build_command, pm_command_base + archive_command]
+    outputs = [
+        os.path.join(output_dir, 'meta.far'),
+        args.manifest_json_file,
+        archive_path + '.far',
+    ]
+    RunPm(pm_commands, manifest_file, PmCachePath(pkg_dir), [args.pm_bin], outputs)
   except subprocess.CalledProcessError as e:
     print('==================== Manifest contents =========================================')
     with open(manifest_file, 'r') as manifest:
@@ -9,6 +9,9 @@
 
 import argparse
 import collections
+import concurrent.futures
+import errno
+import filecmp
 import json
 import os
 import platform
@@ -19,6 +22,9 @@ import sys
 import tarfile
 import tempfile
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'build'))
+import copy_strategy  # pylint: disable=import-error,wrong-import-position
+
 # Path to the engine root checkout. This is used to calculate absolute
 # paths if relative ones are passed to the script.
 BUILD_ROOT_DIR = os.path.abspath(os.path.join(os.path.realpath(__file__), '..', '..', '..', '..'))
@@ -118,34 +124,85 @@ def ProcessCIPDPackage(upload, cipd_yaml, engine_version, out_dir, target_arch):
         raise
 
 
-# Recursively hardlinks contents from one directory to another,
-# skipping over collisions.
-def HardlinkContents(dirA, dirB):
-  internal_symbol_dirs = []
-  for src_dir, _, filenames in os.walk(dirA):
-    for filename in filenames:
-      # if a file contains 'dbg_success' in its name, it is a stamp file.
-      # An example of this would be
-      # '._dart_jit_runner_dbg_symbols_unstripped_dbg_success' these
-      # are generated by GN and have to be ignored.
-      if 'dbg_success' in filename:
-        continue
-      src = os.path.join(src_dir, filename)
-      dest_dir = os.path.join(dirB, os.path.relpath(src_dir, dirA))
-      try:
-        os.makedirs(dest_dir)
-        internal_symbol_dirs.append(dest_dir)
-      except:
-        pass
-      dest = os.path.join(dest_dir, filename)
-      if os.path.exists(dest):
-        # The last two path components provide a content address for a .build-id entry.
-        tokens = os.path.split(dest)
-        name = os.path.join(tokens[-2], tokens[-1])
-        print('%s already exists in destination; skipping linking' % name)
-        continue
+def IsStampFile(filename):
+  # if a file contains 'dbg_success' in its name, it is a stamp file.
+  # An example of this would be
+  # '._dart_jit_runner_dbg_symbols_unstripped_dbg_success' these
+  # are generated by GN and have to be ignored.
+  return 'dbg_success' in filename
+
+
+def SameContents(path_a, path_b):
+  return os.path.samefile(path_a, path_b) or filecmp.cmp(path_a, path_b, shallow=False)
+
+
+def PlanMerge(symbol_dirs, out_dir):
+  """Decides where each file of |symbol_dirs| goes in |out_dir|.
+
+  Returns a map from destination to source, where the first symbol directory
+  providing a path wins, and the (destination, source) pairs that lost.
+  """
+  sources = collections.OrderedDict()
+  duplicates = []
+  for symbol_dir in symbol_dirs:
+    for src_dir, _, filenames in os.walk(symbol_dir):
+      rel_dir = os.path.relpath(src_dir, symbol_dir)
+      for filename in sorted(filenames):
+        if IsStampFile(filename):
+          continue
+        src = os.path.join(src_dir, filename)
+        dest = os.path.normpath(os.path.join(out_dir, rel_dir, filename))
+        if dest in sources:
+          duplicates.append((dest, src))
+        else:
+          sources[dest] = src
+  return sources, duplicates
+
+
+def MergeSymbolDirs(symbol_dirs, out_dir, jobs=None):
+  """Hardlinks the contents of |symbol_dirs| into |out_dir|.
+
+  Directories are created up front and files are linked on a thread pool.
+  Files whose path is already taken are skipped; a file with the same path
+  as another but different contents is a conflict. Returns the directories
+  that were created and the conflicting (destination, source) pairs.
+  """
+  sources, duplicates = PlanMerge(symbol_dirs, out_dir)
+
+  dest_dirs = sorted({os.path.dirname(dest) for dest in sources})
+  created_dirs = [dest_dir for dest_dir in dest_dirs if not os.path.isdir(dest_dir)]
+  for dest_dir in created_dirs:
+    os.makedirs(dest_dir, exist_ok=True)
+
+  def Link(dest, src):
+    if os.path.lexists(dest):
+      # Left over from an earlier merge into the same directory.
+      return None if SameContents(dest, src) else (dest, src)
+    try:
       os.link(src, dest)
-  return internal_symbol_dirs
+    except OSError as error:
+      if error.errno != errno.EXDEV:
+        raise
+      # Hardlinks can't cross filesystems, so copy as cheaply as possible instead.
+      copy_strategy.copy_file(src, dest)
+    return None
+
+  def Compare(dest, src):
+    return None if SameContents(dest, src) else (dest, src)
+
+  with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+    results = list(executor.map(lambda item: Link(*item), sources.items()))
+    # Duplicates are compared once every winner is in place.
+    results += list(executor.map(lambda item: Compare(*item), duplicates))
+
+  for dest, _ in duplicates:
+    # The last two path components provide a content address for a .build-id entry.
+    tokens = os.path.split(dest)
+    name = os.path.join(os.path.basename(tokens[-2]), tokens[-1])
+    print('%s already exists in destination; skipping linking' % name)
+
+  conflicts = [result for result in results if result is not None]
+  return created_dirs, conflicts
 
 
 def CalculateAbsoluteDirs(dirs):
@@ -181,6 +238,12 @@ def main():
   parser.add_argument('--engine-version', required=True, help='Specifies the flutter engine SHA.')
 
   parser.add_argument('--upload', default=False, action='store_true')
+  parser.add_argument(
+      '--fail-on-conflicts',
+      default=False,
+      action='store_true',
+      help='If set, fails when two symbol directories have different files at the same path.'
+  )
 
   args = parser.parse_args()
 
@@ -195,12 +258,13 @@ def main():
     shutil.rmtree(out_dir)
   os.makedirs(out_dir)
 
-  internal_symbol_dirs = []
-  for symbol_dir in symbol_dirs:
-    internal_symbol_dirs += HardlinkContents(symbol_dir, out_dir)
-
-  # make these unique
-  internal_symbol_dirs = list(set(internal_symbol_dirs))
+  internal_symbol_dirs, conflicts = MergeSymbolDirs(symbol_dirs, out_dir)
+  if conflicts:
+    print('Symbol files with the same path but different contents:', file=sys.stderr)
+    for dest, src in conflicts:
+      print('  %s (kept) and %s' % (dest, src), file=sys.stderr)
+    if args.fail_on_conflicts:
+      return 1
 
   arch = args.target_arch
   cipd_def = WriteCIPDDefinition(arch, out_dir, internal_symbol_dirs)
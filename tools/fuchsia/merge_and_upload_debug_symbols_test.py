@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+#
+# Copyright 2013 The Flutter Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import errno
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import merge_and_upload_debug_symbols
+
+
+class MergeAndUploadDebugSymbolsTest(unittest.TestCase):
+
+  def setUp(self):
+    self.temp_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.temp_dir)
+    self.out_dir = os.path.join(self.temp_dir, 'out')
+    os.makedirs(self.out_dir)
+
+  def Merge(self, symbol_dirs, jobs=None):
+    return merge_and_upload_debug_symbols.MergeSymbolDirs(symbol_dirs, self.out_dir, jobs=jobs)
+
+  def WriteSymbols(self, name, files):
+    symbol_dir = os.path.join(self.temp_dir, name)
+    for path, contents in files.items():
+      path = os.path.join(symbol_dir, path)
+      os.makedirs(os.path.dirname(path), exist_ok=True)
+      with open(path, 'w') as f:
+        f.write(contents)
+    return symbol_dir
+
+  def test_merge(self):
+    first = self.WriteSymbols(
+        'first', {
+            'ab/cdef.debug': 'abcdef',
+            '12/3456.debug': '123456',
+            '._runner_dbg_success': '',
+        }
+    )
+    second = self.WriteSymbols(
+        'second', {
+            'ab/cdef.debug': 'abcdef',
+            '12/3456.debug': 'something else',
+            '78/9abc': '789abc',
+        }
+    )
+
+    created_dirs, conflicts = self.Merge([first, second], jobs=4)
+
+    self.assertEqual(
+        created_dirs, [os.path.join(self.out_dir, name) for name in ['12', '78', 'ab']]
+    )
+    conflict = (
+        os.path.join(self.out_dir, '12', '3456.debug'), os.path.join(second, '12', '3456.debug')
+    )
+    self.assertEqual(conflicts, [conflict])
+    self.assertEqual(sorted(os.listdir(self.out_dir)), ['12', '78', 'ab'])
+    self.assertTrue(
+        os.path.samefile(
+            os.path.join(self.out_dir, '12', '3456.debug'), os.path.join(first, '12', '3456.debug')
+        )
+    )
+    self.assertTrue(
+        os.path.samefile(
+            os.path.join(self.out_dir, '78', '9abc'), os.path.join(second, '78', '9abc')
+        )
+    )
+
+    # Merging again into the same directory finds everything in place.
+    self.assertEqual(self.Merge([first]), ([], []))
+
+  def test_copies_across_filesystems(self):
+    symbols = self.WriteSymbols('symbols', {'ab/cdef.debug': 'abcdef'})
+    cross_device = OSError(errno.EXDEV, os.strerror(errno.EXDEV))
+    with mock.patch.object(os, 'link', side_effect=cross_device):
+      self.assertEqual(self.Merge([symbols]), ([os.path.join(self.out_dir, 'ab')], []))
+    dest = os.path.join(self.out_dir, 'ab', 'cdef.debug')
+    self.assertFalse(os.path.samefile(dest, os.path.join(symbols, 'ab', 'cdef.debug')))
+    with open(dest) as f:
+      self.assertEqual(f.read(), 'abcdef')
+
+
+if __name__ == '__main__':
+  unittest.main()
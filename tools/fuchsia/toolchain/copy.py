@@ -8,8 +8,14 @@ to preserve nanoseconds of mtime. See https://fxbug.dev/56376#c5."""
 
 import os
 import shutil
+import stat
 import sys
 
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'build')
+)
+import copy_strategy  # pylint: disable=import-error,wrong-import-position
+
 
 def main():
   if len(sys.argv) != 3:
@@ -40,7 +46,9 @@ def main():
         os.chmod(dest, stat.S_IWRITE)
       os.unlink(dest)
 
-  shutil.copy2(source, dest)
+  # The toolchain only gets here when `ln -f` failed, so there is no point in
+  # trying a hardlink again.
+  copy_strategy.copy_file(source, dest, preserve_times=True)
 
 
 if __name__ == '__main__':
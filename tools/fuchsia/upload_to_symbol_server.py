@@ -7,20 +7,37 @@
 """Uploads debug symbols to the symbols server."""
 
 import argparse
+import collections
+import concurrent.futures
 import os
 import subprocess
 import sys
 import tempfile
+import time
+
+from elf_build_id import ElfError, ReadBuildId
 
 ## Path to the engine root checkout. This is used to calculate absolute
 ## paths if relative ones are passed to the script.
 BUILD_ROOT_DIR = os.path.abspath(os.path.join(os.path.realpath(__file__), '..', '..', '..', '..'))
 FUCHSIA_ARTIFACTS_DEBUG_NAMESPACE = 'debug'
 FUCHSIA_ARTIFACTS_BUCKET_NAME = 'fuchsia-artifacts-release'
+# The number of uploads in flight at once.
+DEFAULT_JOBS = 16
 
 
 def remote_filename(exec_path):
-  # An example of exec_path is:
+  # Symbols are stored under the ELF build ID of the executable, and the
+  # unstripped ones keep their .debug suffix.
+  try:
+    build_id = ReadBuildId(exec_path)
+  except (ElfError, OSError):
+    build_id = None
+  if build_id:
+    return build_id + ('.debug' if exec_path.endswith('.debug') else '')
+
+  # Otherwise fall back to the layout of the symbol directory. An example of
+  # exec_path is:
   # out/fuchsia_debug_x64/flutter-fuchsia-x64/d4/917f5976.debug
   # In the above example "d4917f5976" is the elf BuildID for the
   # executable. First 2 characters are used as the directory name
@@ -30,40 +47,127 @@ def remote_filename(exec_path):
   return ''.join(parts[-2:])
 
 
-def exists_remotely(remote_path):
-  gsutil = os.path.join(os.environ['DEPOT_TOOLS'], 'gsutil.py')
-  command = ['python3', gsutil, '--', 'stat', remote_path]
-  process = subprocess.Popen(command, stderr=subprocess.PIPE, stdout=subprocess.PIPE)
-  stdout, stderr = process.communicate()
-  return_code = process.wait()
-  if return_code == 0:
-    print('%s exists - skipping copy' % remote_path)
-  return return_code == 0
+class GsutilBucket:
+  """The symbol server bucket, accessed through depot_tools' gsutil."""
+
+  # The number of URLs passed to a single `gsutil ls`.
+  LIST_BATCH_SIZE = 500
+
+  def __init__(
+      self, bucket_name=FUCHSIA_ARTIFACTS_BUCKET_NAME, namespace=FUCHSIA_ARTIFACTS_DEBUG_NAMESPACE
+  ):
+    self.bucket_name = bucket_name
+    self.namespace = namespace
+
+  def url(self, name):
+    return 'gs://%s/%s/%s' % (self.bucket_name, self.namespace, name)
 
+  def _gsutil(self, args):
+    gsutil = os.path.join(os.environ['DEPOT_TOOLS'], 'gsutil.py')
+    command = ['python3', gsutil, '--'] + args
+    return subprocess.run(
+        command,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=False
+    )
 
-def process_symbols(should_upload, symbol_dir):
+  def list_existing(self, names):
+    """Returns the subset of |names| that are already in the bucket."""
+    names = sorted(names)
+    existing = set()
+    for start in range(0, len(names), self.LIST_BATCH_SIZE):
+      batch = names[start:start + self.LIST_BATCH_SIZE]
+      urls = {self.url(name): name for name in batch}
+      result = self._gsutil(['ls'] + list(urls))
+      # `gsutil ls` lists the URLs that exist and fails for the rest.
+      listed = {line.strip() for line in result.stdout.splitlines()}
+      existing.update(name for url, name in urls.items() if url in listed)
+      if result.returncode != 0 and 'matched no objects' not in result.stderr:
+        raise subprocess.CalledProcessError(
+            result.returncode, 'gsutil ls', result.stdout, result.stderr
+        )
+    return existing
+
+  def upload(self, path, name):
+    result = self._gsutil(['cp', path, self.url(name)])
+    if result.returncode != 0:
+      raise subprocess.CalledProcessError(
+          result.returncode, 'gsutil cp', result.stdout, result.stderr
+      )
+
+
+def upload_with_retries(bucket, path, name, attempts=3, delay=1.0):
+  """Uploads |path| as |name|, retrying with exponential backoff."""
+  for attempt in range(attempts):
+    try:
+      bucket.upload(path, name)
+      return
+    except (subprocess.CalledProcessError, OSError) as error:
+      if attempt == attempts - 1:
+        raise
+      print('Uploading %s failed, retrying: %s' % (name, error))
+      time.sleep(delay * 2**attempt)
+
+
+def collect_symbols(symbol_dir):
+  """Returns the symbol files under |symbol_dir|, keyed by their remote name."""
   full_path = os.path.join(BUILD_ROOT_DIR, symbol_dir)
 
   files = []
   for (dirpath, dirnames, filenames) in os.walk(full_path):
     files.extend([os.path.join(dirpath, f) for f in filenames])
 
-  print('List of files to upload')
-  print('\n'.join(files))
-
   # Remove dbg_files
   files = [f for f in files if 'dbg_success' not in f]
 
-  for file in files:
-    remote_path = 'gs://%s/%s/%s' % (
-        FUCHSIA_ARTIFACTS_BUCKET_NAME, FUCHSIA_ARTIFACTS_DEBUG_NAMESPACE, remote_filename(file)
-    )
-    if should_upload and not exists_remotely(remote_path):
-      gsutil = os.path.join(os.environ['DEPOT_TOOLS'], 'gsutil.py')
-      command = ['python3', gsutil, '--', 'cp', file, remote_path]
-      subprocess.check_call(command)
-    else:
-      print(remote_path)
+  # The same binary may be laid out more than once; upload it once.
+  symbols = collections.OrderedDict()
+  for file in sorted(files):
+    symbols.setdefault(remote_filename(file), file)
+  return symbols
+
+
+def process_symbols(should_upload, symbol_dir, bucket=None, jobs=DEFAULT_JOBS, retry_delay=1.0):
+  """Uploads the symbols under |symbol_dir| that the bucket does not have yet.
+
+  Returns the remote names of the uploaded files.
+  """
+  if bucket is None:
+    bucket = GsutilBucket()
+  symbols = collect_symbols(symbol_dir)
+
+  print('List of files to upload')
+  print('\n'.join(symbols.values()))
+
+  if not should_upload:
+    for name in symbols:
+      print(bucket.url(name))
+    return []
+
+  existing = bucket.list_existing(symbols)
+  for name in sorted(existing):
+    print('%s exists - skipping copy' % bucket.url(name))
+  missing = [name for name in symbols if name not in existing]
+
+  failures = []
+  with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+    futures = {
+        executor.submit(upload_with_retries, bucket, symbols[name], name, delay=retry_delay): name
+        for name in missing
+    }
+    for future in concurrent.futures.as_completed(futures):
+      name = futures[future]
+      try:
+        future.result()
+        print('Uploaded %s' % bucket.url(name))
+      except (subprocess.CalledProcessError, OSError) as error:
+        print('Failed to upload %s: %s' % (bucket.url(name), error))
+        failures.append(name)
+  if failures:
+    raise Exception('Failed to upload %d symbol files: %s' % (len(failures), ', '.join(failures)))
+  return missing
 
 
 def main():
@@ -76,6 +180,13 @@ def main():
   parser.add_argument(
       '--upload', default=False, action='store_true', help='If set, uploads symbols to the server.'
   )
+  parser.add_argument(
+      '--jobs',
+      '-j',
+      type=int,
+      default=DEFAULT_JOBS,
+      help='The number of symbol files to upload at once.'
+  )
 
   args = parser.parse_args()
 
@@ -85,7 +196,7 @@ def main():
     engine_version = 'HEAD'
     should_upload = False
 
-  process_symbols(should_upload, args.symbol_dir)
+  process_symbols(should_upload, args.symbol_dir, jobs=args.jobs)
   return 0
 
 
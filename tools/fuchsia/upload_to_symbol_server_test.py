@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+#
+# Copyright 2013 The Flutter Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import unittest
+
+import upload_to_symbol_server
+
+
+class LocalBucket:
+  """A bucket backed by a local directory, with the interface of GsutilBucket."""
+
+  def __init__(self, root, failures=None):
+    self.root = root
+    # The number of times uploading each name fails before it succeeds.
+    self.failures = dict(failures or {})
+    self.list_calls = 0
+    self.uploads = []
+    self._lock = threading.Lock()
+
+  def url(self, name):
+    return os.path.join(self.root, name)
+
+  def list_existing(self, names):
+    self.list_calls += 1
+    return {name for name in names if os.path.exists(self.url(name))}
+
+  def upload(self, path, name):
+    with self._lock:
+      self.uploads.append(name)
+      if self.failures.get(name):
+        self.failures[name] -= 1
+        raise subprocess.CalledProcessError(1, 'upload')
+    shutil.copyfile(path, self.url(name))
+
+
+class UploadToSymbolServerTest(unittest.TestCase):
+
+  def setUp(self):
+    self.temp_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.temp_dir)
+    self.symbol_dir = os.path.join(self.temp_dir, 'symbols')
+    self.bucket_dir = os.path.join(self.temp_dir, 'bucket')
+    os.makedirs(self.bucket_dir)
+    for path in ['ab/cdef.debug', 'ab/cdef', '12/3456.debug', '._runner_dbg_success']:
+      self.WriteFile(os.path.join(self.symbol_dir, path), path)
+
+  def WriteFile(self, path, contents):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+      f.write(contents)
+
+  def test_uploads_missing_symbols(self):
+    self.WriteFile(os.path.join(self.bucket_dir, '123456.debug'), '12/3456.debug')
+    bucket = LocalBucket(self.bucket_dir)
+
+    uploaded = upload_to_symbol_server.process_symbols(True, self.symbol_dir, bucket, jobs=4)
+
+    self.assertEqual(sorted(uploaded), ['abcdef', 'abcdef.debug'])
+    self.assertEqual(sorted(bucket.uploads), ['abcdef', 'abcdef.debug'])
+    self.assertEqual(bucket.list_calls, 1)
+    self.assertEqual(
+        sorted(os.listdir(self.bucket_dir)), ['123456.debug', 'abcdef', 'abcdef.debug']
+    )
+    with open(os.path.join(self.bucket_dir, 'abcdef.debug')) as f:
+      self.assertEqual(f.read(), 'ab/cdef.debug')
+
+    # Everything is there now, so a second run uploads nothing.
+    self.assertEqual(upload_to_symbol_server.process_symbols(True, self.symbol_dir, bucket), [])
+
+  def test_dry_run_uploads_nothing(self):
+    bucket = LocalBucket(self.bucket_dir)
+    self.assertEqual(upload_to_symbol_server.process_symbols(False, self.symbol_dir, bucket), [])
+    self.assertEqual(bucket.list_calls, 0)
+    self.assertEqual(os.listdir(self.bucket_dir), [])
+
+  def test_retries_failed_uploads(self):
+    bucket = LocalBucket(self.bucket_dir, failures={'abcdef': 2})
+    upload_to_symbol_server.process_symbols(True, self.symbol_dir, bucket, retry_delay=0)
+    self.assertEqual(bucket.uploads.count('abcdef'), 3)
+    self.assertTrue(os.path.exists(os.path.join(self.bucket_dir, 'abcdef')))
+
+  def test_reports_uploads_that_keep_failing(self):
+    bucket = LocalBucket(self.bucket_dir, failures={'abcdef': 3})
+    with self.assertRaisesRegex(Exception, 'Failed to upload 1 symbol files: abcdef'):
+      upload_to_symbol_server.process_symbols(True, self.symbol_dir, bucket, retry_delay=0)
+    # The other uploads still went through.
+    self.assertTrue(os.path.exists(os.path.join(self.bucket_dir, 'abcdef.debug')))
+
+
+if __name__ == '__main__':
+  unittest.main()
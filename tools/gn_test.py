@@ -4,7 +4,10 @@
 
 import imp
 import os
+import shutil
+import tempfile
 import unittest
+from unittest import mock
 
 SKY_TOOLS = os.path.dirname(os.path.abspath(__file__))
 gn = imp.load_source('gn', os.path.join(SKY_TOOLS, 'gn'))
@@ -55,6 +58,45 @@ class GNTestCase(unittest.TestCase):
     self.assertEqual(gn.parse_size('5MB'), 5 * 2**20)
     self.assertEqual(gn.parse_size('5GB'), 5 * 2**30)
 
+  def test_strip_variant_flags(self):
+    self.assertEqual(
+        gn.strip_variant_flags([
+            '--unoptimized', '--variant=--android', '--variant-jobs', '4', '--rbe',
+            '--variant-jobs=2'
+        ]), ['--unoptimized', '--rbe']
+    )
+    args = gn.parse_args(['gn', '--variant=--android --runtime-mode release', '--variant=--ios'])
+    self.assertEqual(args.variants, ['--android --runtime-mode release', '--ios'])
+
+  def test_get_variant_args(self):
+    argv = ['gn', '--runtime-mode', 'profile', '--variant=--android', '--variant=--ios']
+    variants = gn.get_variant_args(argv, gn.parse_args(argv))
+    self.assertEqual([(label, gn.get_out_dir(args)) for label, args in variants], [
+        ('base configuration', os.path.join('out', 'host_profile')),
+        ('--android', os.path.join('out', 'android_profile')),
+        ('--ios', os.path.join('out', 'ios_profile')),
+    ])
+
+  def test_get_pool_depths(self):
+    out_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, out_dir)
+    with open(os.path.join(out_dir, '.ninja_log'), 'w') as ninja_log:
+      ninja_log.write('# ninja log v5\n')
+      for output in ['gen/a.dill', 'gen/b.dill']:
+        ninja_log.write('0\t10\t0\t%s\t0\n' % output)
+    with open(os.path.join(out_dir, '.ninja_rss'), 'w') as rss_log:
+      rss_log.write('900\tdart_kernel\tgen/a.dill\n')
+      rss_log.write('300\tdart_kernel\tgen/b.dill\n')
+      # Removed outputs, older samples and malformed lines are ignored.
+      rss_log.write('5000\tdart_kernel\tgen/removed.dill\n')
+      rss_log.write('garbage\n')
+      rss_log.write('400\tdart_kernel\tgen/a.dill\n')
+
+    # The memory per job that the depth is computed from stands in for it.
+    with mock.patch.object(gn, 'get_concurrent_jobs', lambda reserve, per_job: per_job):
+      depths = gn.get_pool_depths(out_dir, 3)
+    self.assertEqual(depths, {'dart_kernel': '400B', 'dart_snapshot': 3})
+
 
 if __name__ == '__main__':
   unittest.main()